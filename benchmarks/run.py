@@ -0,0 +1,196 @@
+"""Benchmarks for the raytracer.
+
+Run with ``python benchmarks/run.py --output results.json`` and compare against a stored run with
+``--baseline baseline.json``. All rendering is serial, so the numbers measure the tracer and not the pool.
+"""
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "raytracer")]
+
+import click
+import numpy as np
+
+from benchmarks import scenes
+from demo import build_demo_scene
+from geometry.plane import Plane
+from geometry.ray import Ray
+from geometry.sphere import Sphere
+from geometry.triangle import Triangle
+from geometry.vector import Vector
+
+# Metrics where larger is better, only these are compared against a baseline
+RATES = ("primary_rays_per_second", "shadow_rays_per_second", "calls_per_second")
+
+FULL = {"objects": (10, 1000, 10000), "lights": (1, 20, 200), "viewport": (32, 32), "demo_viewport": (64, 64)}
+QUICK = {"objects": (10, 1000), "lights": (1, 20), "viewport": (16, 16), "demo_viewport": (32, 32)}
+# Building 100k objects and their BVH takes minutes, so these scenes only run on request
+LARGE = {**FULL, "objects": (*FULL["objects"], 100000)}
+
+
+def count_calls(instance, name):
+    calls = [0]
+    method = getattr(instance, name)
+
+    def counted(*args, **kwargs):
+        calls[0] += 1
+        return method(*args, **kwargs)
+
+    setattr(instance, name, counted)
+    return calls
+
+
+def render(scene, bounces):
+    width, height = scene.camera.viewport_size
+    shadow_rays = count_calls(scene, "occluded")
+
+    start = time.perf_counter()
+    scene.trace_tile(0, 0, width, height, bounces)
+    wall_time = time.perf_counter() - start
+
+    return {
+        "wall_time": wall_time,
+        "primary_rays_per_second": width * height / wall_time,
+        "shadow_rays_per_second": shadow_rays[0] / wall_time,
+    }
+
+
+def measure(function, repeat=5):
+    number, _ = timeit.Timer(function).autorange()
+    number = max(number, 1)
+    best = min(timeit.repeat(function, number=number, repeat=repeat)) / number
+    return {"wall_time": best, "calls_per_second": 1 / best}
+
+
+def benchmark_demo(config):
+    random.seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scene = build_demo_scene(config["demo_viewport"])
+
+    yield "render/demo", render(scene, 3)
+
+
+def benchmark_scaling(config):
+    for kind, make in (("spheres", scenes.make_spheres), ("triangles", scenes.make_triangles)):
+        for count in config["objects"]:
+            objects = make(count)
+
+            start = time.perf_counter()
+            scene = scenes.build_scaling_scene(objects, 1, config["viewport"])
+            build_time = time.perf_counter() - start
+
+            for lights in config["lights"]:
+                scene.lights = scenes.make_lights(lights)
+                yield f"render/{kind}-{count}/lights-{lights}", {"build_time": build_time, **render(scene, 1)}
+
+
+def benchmark_micro(config):
+    material = scenes.get_materials()[0]
+    ray = Ray(Vector(0, -5, 1), Vector(0.02, 1, -0.01).normalize())
+
+    objects = {
+        "sphere": Sphere(Vector(0, 5, 1), 1, material),
+        "plane": Plane(Vector(0, 0, 1), 0, material),
+        "triangle": Triangle(Vector(-2, 5, -1), Vector(2, 5, -1), Vector(0, 5, 3), material),
+    }
+    for name, object in objects.items():
+        assert object.get_intersection(ray), name
+        yield f"micro/{name}.get_intersection", measure(lambda: object.get_intersection(ray))
+
+    random.seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scene = build_demo_scene(config["demo_viewport"])
+
+    direction = scene.camera.get_ray_direction(*(size // 2 for size in scene.camera.viewport_size))
+    intersection = scene.get_closest_intersection(Ray(scene.camera.origin, direction))
+    yield "micro/scene.calculate_color", measure(lambda: scene.calculate_color(intersection, 0))
+
+    yield "micro/camera.calculate_viewplane", measure(scene.camera.calculate_viewplane)
+    yield "micro/camera.get_viewplane", measure(scene.camera.get_viewplane)
+
+
+SUITES = {
+    "demo": benchmark_demo,
+    "scaling": benchmark_scaling,
+    "micro": benchmark_micro,
+}
+
+
+def run(suites, config, echo=print):
+    results = {}
+    for suite in suites:
+        for name, result in SUITES[suite](config):
+            echo(f"{name:45} " + "  ".join(f"{key}={value:.4g}" for key, value in result.items()))
+            results[name] = result
+
+    return results
+
+
+def get_metadata(quick, large):
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "quick": quick,
+        "large": large,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns (name, metric, ratio) for every rate that dropped more than the tolerance below the baseline."""
+    regressions = []
+    for name, result in results.items():
+        for metric in RATES:
+            if metric not in result or metric not in baseline.get(name, {}):
+                continue
+
+            previous = baseline[name][metric]
+            ratio = result[metric] / previous if previous else math.inf
+            if ratio < 1 - tolerance:
+                regressions.append((name, metric, ratio))
+
+    return regressions
+
+
+@click.command()
+@click.option("--output", type=click.Path(dir_okay=False), help="Write the results to this JSON file.")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), help="Compare against a stored JSON run.")
+@click.option("--tolerance", default=0.1, show_default=True, help="Allowed relative slowdown against the baseline.")
+@click.option("--quick", is_flag=True, help="Smaller scenes, for a fast sanity check.")
+@click.option("--large", is_flag=True, help="Adds the scaling scenes with 100k objects, which take minutes to build.")
+@click.option("--suite", "suites", multiple=True, type=click.Choice(list(SUITES)), help="Suites to run, all by default.")
+def main(output, baseline, tolerance, quick, large, suites):
+    """Renders the benchmark scenes and reports rays per second."""
+    if quick and large:
+        raise click.UsageError("--quick can't be combined with --large.")
+
+    results = run(suites or list(SUITES), QUICK if quick else LARGE if large else FULL, echo=click.echo)
+
+    if output:
+        with open(output, "w") as file:
+            json.dump({"metadata": get_metadata(quick, large), "results": results}, file, indent=2)
+
+    if baseline:
+        with open(baseline) as file:
+            regressions = compare(results, json.load(file)["results"], tolerance)
+
+        for name, metric, ratio in regressions:
+            click.echo(f"REGRESSION {name} {metric}: {ratio:.2f}x of baseline")
+        if regressions:
+            sys.exit(1)
+        click.echo("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
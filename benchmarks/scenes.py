@@ -0,0 +1,69 @@
+"""Procedurally generated scenes for the scaling benchmarks."""
+import math
+import random
+
+from geometry.plane import Plane
+from geometry.sphere import Sphere
+from geometry.triangle import Triangle
+from geometry.vector import Vector
+from scene.scene import Camera, PointLightSource, Scene
+from visual import Intensity, Material, SolidTexture
+
+# Objects are scattered inside this box in front of the camera
+BOX_MINIMUM = Vector(-5, 5, 0)
+BOX_MAXIMUM = Vector(5, 15, 10)
+
+
+def get_camera(viewport_size):
+    return Camera(Vector(0, -5, 5), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=viewport_size)
+
+
+def get_spacing(count):
+    return (BOX_MAXIMUM.x - BOX_MINIMUM.x) / math.pow(max(count, 1), 1 / 3)
+
+
+def get_point(rng: random.Random):
+    return Vector(rng.uniform(BOX_MINIMUM.x, BOX_MAXIMUM.x),
+                  rng.uniform(BOX_MINIMUM.y, BOX_MAXIMUM.y),
+                  rng.uniform(BOX_MINIMUM.z, BOX_MAXIMUM.z))
+
+
+def get_materials():
+    return [Material(SolidTexture(Intensity(0.8, 0.3, 0.3))),
+            Material(SolidTexture(Intensity(0.3, 0.8, 0.3)), specular_reflectivity=Vector.ONE * 0.3),
+            Material(SolidTexture(Intensity(0.3, 0.3, 0.8)))]
+
+
+def make_spheres(count, seed=0):
+    rng = random.Random(seed)
+    materials = get_materials()
+    radius = get_spacing(count) * 0.3
+
+    return [Sphere(get_point(rng), radius, rng.choice(materials)) for _ in range(count)]
+
+
+def make_triangles(count, seed=0):
+    rng = random.Random(seed)
+    materials = get_materials()
+    size = get_spacing(count) * 0.6
+
+    triangles = []
+    for _ in range(count):
+        corner = get_point(rng)
+        offsets = [Vector(rng.uniform(-size, size), rng.uniform(-size, size), rng.uniform(-size, size)) for _ in range(2)]
+        triangles.append(Triangle(corner, corner + offsets[0], corner + offsets[1], rng.choice(materials)))
+
+    return triangles
+
+
+def make_lights(count, seed=0):
+    rng = random.Random(seed)
+    return [PointLightSource(Vector(rng.uniform(-10, 10), rng.uniform(-5, 15), rng.uniform(12, 20)),
+                             Intensity(1, 1, 1) * (200 / count), render_in_picture=False)
+            for _ in range(count)]
+
+
+def build_scaling_scene(objects, light_count, viewport_size=(32, 32)):
+    ground = Plane(Vector(0, 0, 1), 0, Material(SolidTexture(Intensity(1, 1, 1))))
+    return Scene([*objects, ground], make_lights(light_count), get_camera(viewport_size),
+                 ambient_light_intensity=Intensity(0.1, 0.1, 0.1))
@@ -0,0 +1,128 @@
+import copy
+import dataclasses
+import os
+import pathlib
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from scene.scene import Camera
+from scene.session import RenderSession
+from writer import ImageWriter
+
+
+def camera_path(cameras: List[Camera]) -> Callable[[int], Dict[str, Any]]:
+    return lambda index: {"camera": cameras[index]}
+
+
+def zoom_path(camera: Camera, start_distance, end_distance, frames) -> List[Camera]:
+    """Copies of the camera whose viewplane distance shrinks or grows geometrically, like the fly-through of main.py."""
+    factor = (end_distance / start_distance) ** (1 / max(frames - 1, 1))
+
+    cameras = []
+    for index in range(frames):
+        frame_camera = copy.copy(camera)
+        frame_camera.viewplane_distance = start_distance * factor ** index
+        cameras.append(frame_camera)
+
+    return cameras
+
+
+@dataclasses.dataclass
+class AnimationProgress:
+    frames_done: int
+    frames: int
+    elapsed: float
+    # Seconds left, from the pixels per second measured so far, None until the first tile is done
+    eta: float = None
+
+    def __str__(self):
+        eta = "unknown" if self.eta is None else f"{self.eta:.1f} s"
+        return f"{self.frames_done}/{self.frames} frames after {self.elapsed:.1f} s, {eta} remaining"
+
+
+class AnimationRenderer:
+    """Renders an image sequence on one session. update(index) returns the scene attributes of a frame, e.g. from
+    camera_path, they are sent to the workers as deltas. Up to lookahead frames are queued behind the frame in
+    progress, so the tail of a frame overlaps the start of the next."""
+
+    def __init__(self, session: RenderSession, frames, update: Callable[[int], Dict[str, Any]], lookahead=1):
+        self.session = session
+        self.frames = frames
+        self.update = update
+        self.lookahead = lookahead
+
+    def render(self, bounces, output_pattern="output/frame{:04d}.png", engine="ray", writer: ImageWriter = None,
+               progress: Callable[[AnimationProgress], None] = lambda progress: None) -> List[pathlib.Path]:
+        scene = self.session.scene
+        paths = [pathlib.Path(output_pattern.format(index)) for index in range(self.frames)]
+        for directory in {path.parent for path in paths}:
+            os.makedirs(directory, exist_ok=True)
+
+        own_writer = writer is None
+        writer = ImageWriter() if own_writer else writer
+
+        pending = {}
+        next_index = 0
+        frames_done = 0
+        # All traced pixels, and the part of them that belongs to frames still pending
+        pixels_done = 0
+        pixels_pending = 0
+        start = time.perf_counter()
+
+        def submit():
+            nonlocal next_index
+            attributes = self.update(next_index)
+            if attributes:
+                self.session.update(**attributes)
+
+            width, height = scene.camera.viewport_size
+            frame = self.session.submit(bounces, engine)
+            pending[frame] = next_index, np.zeros((height, width, 3), dtype=np.float32)
+            next_index += 1
+
+        def get_progress():
+            elapsed = time.perf_counter() - start
+            if not pixels_done:
+                return AnimationProgress(frames_done, self.frames, elapsed)
+
+            # Frames that aren't submitted yet are assumed to be as large as the last submitted one
+            width, height = scene.camera.viewport_size
+            queued = sum(array.size // 3 for _, array in pending.values()) - pixels_pending
+            remaining = queued + (self.frames - next_index) * width * height
+            return AnimationProgress(frames_done, self.frames, elapsed, elapsed / pixels_done * max(remaining, 0))
+
+        try:
+            while next_index < self.frames and len(pending) <= self.lookahead:
+                submit()
+
+            while pending:
+                frame, (x0, y0, x1, y1), colors, remaining = self.session.next_tile()
+                index, array = pending[frame]
+                array[y0:y1, x0:x1] = np.array([tuple(color) for color in colors], dtype=np.float32).reshape(y1 - y0, x1 - x0, 3)
+
+                pixels_done += (x1 - x0) * (y1 - y0)
+                pixels_pending += (x1 - x0) * (y1 - y0)
+
+                if not remaining:
+                    del pending[frame]
+                    pixels_pending -= array.size // 3
+                    frames_done += 1
+                    # Encoding and writing happen on the writer thread while the next frames are traced
+                    writer.write(paths[index], array)
+
+                    while next_index < self.frames and len(pending) <= self.lookahead:
+                        submit()
+
+                progress(get_progress())
+        except BaseException:
+            self.session.cancel()
+            raise
+        finally:
+            if own_writer:
+                writer.close()
+            else:
+                writer.flush()
+
+        return paths
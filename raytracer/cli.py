@@ -1,16 +1,132 @@
 """Console script for raytracer."""
+import os
+import runpy
 import sys
+
 import click
 
+MODULE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_scene(path, viewport_size):
+    """Loads a JSON or compiled scene file, or builds the scene of a Python file defining build_scene(viewport_size).
+    Without a path the demo scene is built."""
+    if path is None:
+        from demo import build_demo_scene
+        return build_demo_scene(viewport_size)
+
+    if not path.endswith(".py"):
+        from scene import scenefile
+        return scenefile.load_scene(path, viewport_size)
+
+    build_scene = runpy.run_path(path).get("build_scene")
+    if build_scene is None:
+        raise click.BadParameter(f"{path} does not define build_scene(viewport_size)", param_hint="--scene")
+    return build_scene(viewport_size)
+
+
+def get_authkey(authkey):
+    return authkey.encode() if authkey else None
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise click.BadParameter(f"{address} isn't HOST:PORT")
+    return host, int(port)
+
 
-@click.command()
+@click.group()
 def main(args=None):
     """Console script for raytracer."""
-    click.echo("Replace this message by putting your code into "
-               "raytracer.cli.main")
-    click.echo("See click documentation at https://click.palletsprojects.com/")
+    # The raytracer modules import each other as top level modules, like main.py does when run from raytracer/.
+    # Only done once a command runs, so importing this module leaves sys.path alone.
+    if MODULE_DIRECTORY not in sys.path:
+        sys.path.insert(0, MODULE_DIRECTORY)
     return 0
 
 
+@main.command()
+@click.option("--scene", "scene_path", type=click.Path(exists=True, dir_okay=False),
+              help="JSON or compiled scene, or a Python file defining build_scene(viewport_size). The demo scene by default.")
+@click.option("--width", default=100, show_default=True, type=click.IntRange(min=1))
+@click.option("--height", default=100, show_default=True, type=click.IntRange(min=1))
+@click.option("--workers", type=click.IntRange(min=1), help="Render processes, one per CPU by default.")
+@click.option("--bounces", default=3, show_default=True, type=click.IntRange(min=0), help="Reflection depth.")
+@click.option("--samples", default=1, show_default=True, type=click.IntRange(min=1),
+              help="Maximum samples per pixel, more than one enables adaptive anti-aliasing. "
+                   "Only the first sample is traced by the --workers, the extra samples are traced serially.")
+@click.option("--output", "-o", default="render.png", show_default=True, type=click.Path(dir_okay=False),
+              help="Image file, .pfm and .npy keep the linear float data.")
+@click.option("--tiled", is_flag=True,
+              help="Render out of core into a memory-mapped .npy file, an interrupted render resumes from its manifest. "
+                   "A .png or .pfm --output is written from it a band of rows at a time.")
+@click.option("--tile-size", default=64, show_default=True, type=click.IntRange(min=1), help="Tile size of --tiled.")
+@click.option("--listen", metavar="HOST:PORT",
+              help="Coordinate remote `raytracer worker` processes instead of local ones, --workers is how many to wait for.")
+@click.option("--authkey", envvar="RAYTRACER_AUTHKEY", show_envvar=True,
+              help="Secret shared with the workers of --listen, prefer the environment variable over the option.")
+@click.option("--timeout", default=60.0, show_default=True, type=click.FloatRange(min=0),
+              help="Seconds --listen waits for the workers to connect, and for the next tile.")
+def render(scene_path, width, height, workers, bounces, samples, output, tiled, tile_size, listen, authkey, timeout):
+    """Renders a scene without a window and writes the image."""
+    # Imported here, so --help stays fast and nothing in this command pulls in pygame
+    from distributed import Coordinator
+    from sampler import AdaptiveSampler
+    from scene.session import RenderSession
+    from tiled import TiledRenderer
+    from writer import BAND_SUFFIXES, write_image, write_image_bands
+
+    if tiled and samples > 1:
+        raise click.UsageError("--samples can't be combined with --tiled, adaptive sampling needs the whole image in memory.")
+    if listen and tiled:
+        raise click.UsageError("--listen can't be combined with --tiled.")
+    if tiled and not output.lower().endswith((".npy", *BAND_SUFFIXES)):
+        raise click.UsageError(f"--tiled writes .npy, {', '.join(BAND_SUFFIXES)} images, others would need the whole image in memory.")
+    if listen and not authkey:
+        raise click.UsageError("--listen needs a secret shared with the workers, set RAYTRACER_AUTHKEY or pass --authkey.")
+
+    scene = load_scene(scene_path, (width, height))
+
+    if listen:
+        with Coordinator(scene, get_authkey(authkey), parse_address(listen)) as coordinator:
+            click.echo(f"Waiting for {workers or 1} workers on {listen}")
+            try:
+                coordinator.wait_for_workers(workers or 1, timeout)
+                pixels = coordinator.render(bounces, timeout=timeout)
+            except TimeoutError as error:
+                raise click.ClickException(str(error))
+            click.echo(coordinator.report())
+    else:
+        with RenderSession(scene, workers) as session:
+            if tiled:
+                # An .npy output is the tile file itself, other formats are converted band by band once it is complete
+                path = output if output.lower().endswith(".npy") else f"{output}.npy"
+                pixels = TiledRenderer(session, path, tile_size).render(bounces)
+                if path != output:
+                    write_image_bands(output, pixels)
+                click.echo(f"Wrote {output}")
+                return
+            else:
+                pixels = session.render(bounces).array.copy()
+
+    if samples > 1:
+        pixels, _ = AdaptiveSampler(scene, max_samples=samples).render(bounces, pixels)
+
+    write_image(output, pixels)
+    click.echo(f"Wrote {output}")
+
+
+@main.command()
+@click.argument("address")
+@click.option("--authkey", envvar="RAYTRACER_AUTHKEY", show_envvar=True, required=True,
+              help="Secret shared with the coordinator, prefer the environment variable over the option.")
+def worker(address, authkey):
+    """Traces tiles for a coordinator started with `raytracer render --listen HOST:PORT`."""
+    from distributed import serve
+
+    serve(parse_address(address), get_authkey(authkey))
+
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
@@ -0,0 +1,108 @@
+import math
+from pathlib import Path
+
+from geometry.plane import Plane
+from geometry.rectangle import Rectangle
+from geometry.sphere import Sphere
+from geometry.triangle import Triangle
+from geometry.vector import Vector
+from scene.scene import Camera, Scene, PointLightSource, ScatteredLightSource
+from visual import Material, ImageTexture, SolidTexture, Intensity
+
+VIEWPORT_SIZE = (100, 100)
+TEXTURE_PATH = Path(__file__).parent / "res" / "texture1.png"
+
+CAMERA_POSITION = Vector(0, -5, 7)
+
+
+def build_demo_scene(viewport_size=VIEWPORT_SIZE) -> Scene:
+    camera = Camera(CAMERA_POSITION, (math.radians(1.05), math.radians(23)), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=viewport_size)
+
+    # triangletexture = ImageTexture(TEXTURE_PATH, gamma=0.5)
+    triangletexture = SolidTexture(Intensity(1, 1, 0.8))
+    # triangle = Material(triangletexture, interacts_with_light=True)
+    blue = Material(SolidTexture(Intensity(0.5, 0.5, 1)))
+    white = Material(SolidTexture(Intensity(1, 1, 1)))
+
+    # yellow1 = SolidColor(Vector(0.8, 0.8, 0.05))
+    yellow1 = ImageTexture(TEXTURE_PATH)
+    # yellow2 = SolidColor(Vector(1, 0.9, 0.05))
+    yellow2 = ImageTexture(TEXTURE_PATH)
+    # yellow3 = SolidColor(Vector(1, 1, 0.05))
+    yellow3 = ImageTexture(TEXTURE_PATH)
+
+    darkblue = SolidTexture(Intensity(0, 0, 1))
+
+
+    s = 1
+
+    s1 = Material(yellow1, specular_reflectivity=Vector.ONE * s)
+    s2 = Material(yellow2, specular_reflectivity=Vector.ONE * s)
+    s3 = Material(yellow3, specular_reflectivity=Vector.ONE * s)
+
+    sky = Material(darkblue, interacts_with_light=True)
+    triangle = Material(triangletexture, specular_reflectivity=Vector.ONE * 0.1)
+
+    objects = [
+        Triangle(Vector(-5, 6, 5),
+                 Vector(0, 0, 3),
+                 Vector(5, 6, 3),
+                 triangle,
+                 t4=CAMERA_POSITION),
+        # Rectangle(Vector(-2, 4, -1),
+        #           Vector(-5, 6, 5),
+        #           Vector(0, 0, -1),
+        #           Vector(0, 0, 3),
+        #           Material(SolidTexture(Intensity(1, 0.2, 0.2)), specular_reflectivity=Vector.ONE * 0),
+        #           t5=CAMERA_POSITION),
+        # Rectangle(Vector(5, 6, -1),
+        #           Vector(5, 6, 3),
+        #           Vector(0, 0, -1),
+        #           Vector(0, 0, 3),
+        #           Material(SolidTexture(Intensity(1, 0.2, 0.2))),
+        #           t5=CAMERA_POSITION),
+        Sphere(Vector(-2.5, 4, 4.5), 0.3, s1),
+        Sphere(Vector(-1, 4, 4.3), 0.6, s2),
+        Sphere(Vector(1, 4, 4), 1, s3),
+
+        Plane(Vector(0, 0, 1), -1, white),
+    ]
+
+
+
+    # objects = [
+    #     Triangle(Vector(-5, 6, 5),
+    #              Vector(0, 0, 3),
+    #              Vector(5, 6, 3),
+    #              triangle,
+    #              t4=CAMERA_POSITION),
+    #         Rectangle(Vector(5, 6, -1),
+    #                   Vector(5, 6, 3),
+    #                   Vector(0, 0, -1),
+    #                   Vector(0, 0, 3),
+    #                   Material(SolidTexture(Intensity(1, 0.2, 0.2))),
+    #                   t5=CAMERA_POSITION),
+    #     Sphere(Vector(1, 4, 4), 1, s3),
+    #     Plane(Vector(0, 0, 1), -1, white),
+    #
+    # ]
+
+    #
+    # lights = [
+    #     Light(Vector(3, 4, 5), Intensity(2.5, 2.5, 5)),
+    #     Light(Vector(-3, 2, 4), Intensity(8, 8, 2)),
+    #     Light(Vector(-5, -10, 25), Intensity(1, 1, 1) * 800),
+    # ]
+
+    lights = [
+        # Light(Vector(-5, -10, 10), Intensity(1, 1, 1) * 400),
+        # Light(Vector(3, 4, 5), Intensity(2.5, 2.5, 10)),
+        *ScatteredLightSource(Vector(4, 4.5, 4), Intensity(1, 1, 10) * 7, 2, 20),
+        *ScatteredLightSource(Vector(-4, 4.5, 5.5), Intensity(10, 2.5, 10) * 3, 2, 20),
+        # *ScatteredLightSource(Vector(-4, 4.5, 5.5), Intensity(10, 2.5, 10) * 3, 2, 10),
+        *ScatteredLightSource(Vector(-0.12, 3.83, 3.8), Intensity(2, 2, 0.5) / 2, 0.2, 20)
+        # Light(Vector(0, 20, 5), Intensity(2.5, 2, 1) * 100),
+        # Light(Vector(5, 0, 5), Intensity(1, 0.1, 0.1) * 100),
+    ]
+
+    return Scene(objects, lights, camera, ambient_light_intensity=Intensity(0.01, 0.01, 0.01) * 10, gamma=2)
@@ -0,0 +1,267 @@
+"""Tile rendering across machines.
+
+The Coordinator listens on a TCP address, every machine runs serve (or ``raytracer worker HOST:PORT``) to connect
+to it. The scene is pickled once per frame and only sent to workers that don't have that version yet, tiles are
+handed out as they are requested and the tiles of a worker that disconnects are queued again.
+
+Both sides unpickle what they receive, so a connection runs code on the other side. The shared authkey is what keeps
+anyone else who can reach the port out, there is no default and it has to stay secret.
+"""
+import dataclasses
+import itertools
+import os
+import pickle
+import queue
+import socket
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+from typing import List
+
+import numpy as np
+
+from scene.session import get_tiles
+
+def check_authkey(authkey):
+    if not isinstance(authkey, bytes) or not authkey:
+        raise Exception("A non-empty authkey shared by the coordinator and its workers is required!")
+
+
+def serve(address, authkey: bytes, max_tiles=None):
+    """Traces tiles for the coordinator at address until it stops or disconnects, or after max_tiles tiles."""
+    check_authkey(authkey)
+    scene = None
+    traced = 0
+
+    with Client(tuple(address), authkey=authkey) as connection:
+        connection.send(("hello", f"{socket.gethostname()}:{os.getpid()}"))
+        while max_tiles is None or traced < max_tiles:
+            try:
+                message = connection.recv()
+            except EOFError:
+                return
+
+            kind = message[0]
+            if kind == "stop":
+                return
+            if kind == "scene":
+                scene = pickle.loads(message[1])
+                continue
+
+            _, frame, tile, bounces, engine = message
+            x0, y0, x1, y1 = tile
+            try:
+                colors = scene.trace_tile(*tile, bounces, engine=engine)
+                pixels = np.array([tuple(color) for color in colors], dtype=np.float32).reshape(y1 - y0, x1 - x0, 3)
+                connection.send(("result", frame, tile, pixels))
+            except Exception:
+                connection.send(("error", frame, tile, traceback.format_exc()))
+            traced += 1
+
+
+@dataclasses.dataclass
+class WorkerStats:
+    name: str
+    tiles: int = 0
+    pixels: int = 0
+    # Seconds the worker had at least one tile, so waiting for work doesn't count against its throughput
+    busy: float = 0.0
+    lost_tiles: int = 0
+    connected: bool = True
+
+    @property
+    def pixels_per_second(self):
+        return self.pixels / self.busy if self.busy else 0.0
+
+    def __str__(self):
+        state = "" if self.connected else ", disconnected"
+        return (f"{self.name:30} {self.tiles} tiles, {self.pixels_per_second:.0f} pixels/s"
+                f"{f', {self.lost_tiles} tiles lost' if self.lost_tiles else ''}{state}")
+
+
+class Coordinator:
+    def __init__(self, scene, authkey: bytes, address=("127.0.0.1", 0), tile_size=16, prefetch=2):
+        check_authkey(authkey)
+        self.scene = scene
+        self.tile_size = tile_size
+        # Tiles sent ahead to every worker, so it doesn't wait a round trip between tiles
+        self.prefetch = prefetch
+        self.workers: List[WorkerStats] = []
+
+        self.__authkey = authkey
+        self.__listener = Listener(tuple(address), authkey=authkey)
+        self.__tiles = queue.Queue()
+        self.__results = queue.Queue()
+        self.__frames = itertools.count()
+        self.__version = 0
+        self.__scene_data = None
+        self.__closed = False
+        self.__lock = threading.Lock()
+
+        self.__threads = [threading.Thread(target=self.__accept, daemon=True)]
+        self.__threads[0].start()
+
+    @property
+    def address(self):
+        return self.__listener.address
+
+    def __enter__(self):
+        return self
+
+    def __accept(self):
+        while True:
+            try:
+                connection = self.__listener.accept()
+            except Exception:
+                # Closed, or a client with the wrong authkey
+                if self.__closed:
+                    return
+                continue
+
+            if self.__closed:
+                connection.close()
+                return
+
+            thread = threading.Thread(target=self.__serve, args=(connection,), daemon=True)
+            with self.__lock:
+                self.__threads.append(thread)
+            thread.start()
+
+    def __serve(self, connection):
+        stats = None
+        in_flight = []
+        version = None
+        busy_since = None
+
+        try:
+            _, name = connection.recv()
+            stats = WorkerStats(name)
+            with self.__lock:
+                self.workers.append(stats)
+
+            while not self.__closed:
+                while len(in_flight) < self.prefetch:
+                    try:
+                        job = self.__tiles.get(timeout=0.1 if not in_flight else 0)
+                    except queue.Empty:
+                        break
+
+                    frame, job_version, tile, bounces, engine = job
+                    if version != job_version:
+                        connection.send(("scene", self.__scene_data))
+                        version = job_version
+
+                    connection.send(("tile", frame, tile, bounces, engine))
+                    in_flight.append(job)
+                    busy_since = busy_since or time.perf_counter()
+
+                if not in_flight or not connection.poll(0.1):
+                    continue
+
+                kind, frame, tile, payload = connection.recv()
+                in_flight = [job for job in in_flight if (job[0], job[2]) != (frame, tile)]
+
+                x0, y0, x1, y1 = tile
+                stats.tiles += 1
+                stats.pixels += (x1 - x0) * (y1 - y0)
+                if not in_flight:
+                    stats.busy += time.perf_counter() - busy_since
+                    busy_since = None
+
+                self.__results.put((frame, tile, kind, payload))
+
+            connection.send(("stop",))
+        except (EOFError, OSError):
+            pass
+        finally:
+            # Whatever the worker still had is traced by the others
+            for job in in_flight:
+                self.__tiles.put(job)
+            if stats is not None:
+                stats.lost_tiles += len(in_flight)
+                stats.connected = False
+                if busy_since is not None:
+                    stats.busy += time.perf_counter() - busy_since
+            connection.close()
+
+    def get_connected(self):
+        return sum(worker.connected for worker in self.workers)
+
+    def wait_for_workers(self, count, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while (connected := self.get_connected()) < count:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Only {connected} of {count} workers connected within {timeout} s!")
+            time.sleep(0.05)
+
+    def render(self, bounces, engine="ray", timeout=None) -> np.ndarray:
+        """Returns the (H,W,3) framebuffer. With a timeout, fails once no tile finished for that many seconds."""
+        data = pickle.dumps(self.scene)
+        if data != self.__scene_data:
+            self.__scene_data = data
+            self.__version += 1
+
+        width, height = self.scene.camera.viewport_size
+        frame = next(self.__frames)
+        tiles = list(get_tiles(width, height, self.tile_size))
+        remaining = set(tiles)
+        for tile in tiles:
+            self.__tiles.put((frame, self.__version, tile, bounces, engine))
+
+        pixels = np.zeros((height, width, 3), dtype=np.float32)
+        progress = time.monotonic()
+        try:
+            while remaining:
+                try:
+                    result_frame, tile, kind, payload = self.__results.get(timeout=1)
+                except queue.Empty:
+                    if timeout is not None and time.monotonic() - progress > timeout:
+                        raise TimeoutError(f"No tile finished for {timeout} s, {self.get_connected()} workers are "
+                                           f"connected!")
+                    continue
+
+                if result_frame != frame or tile not in remaining:
+                    continue
+                if kind == "error":
+                    raise Exception(f"Tracing tile {tile} failed on a worker:\n{payload}")
+
+                x0, y0, x1, y1 = tile
+                pixels[y0:y1, x0:x1] = payload
+                remaining.discard(tile)
+                progress = time.monotonic()
+        finally:
+            if remaining:
+                self.__drain()
+
+        return pixels
+
+    def __drain(self):
+        while True:
+            try:
+                self.__tiles.get_nowait()
+            except queue.Empty:
+                return
+
+    def report(self):
+        return "\n".join(str(worker) for worker in self.workers)
+
+    def close(self):
+        if self.__closed:
+            return
+        self.__closed = True
+
+        # accept doesn't return when the listener is closed from another thread, a last connection wakes it up
+        try:
+            Client(self.address, authkey=self.__authkey).close()
+        except OSError:
+            pass
+        self.__listener.close()
+
+        with self.__lock:
+            threads = list(self.__threads)
+        for thread in threads:
+            thread.join()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
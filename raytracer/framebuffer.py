@@ -0,0 +1,55 @@
+from multiprocessing import shared_memory
+from typing import List
+
+import numpy as np
+
+from visual import Color
+
+
+def encode_24_bit(array: np.ndarray, gamma=2) -> np.ndarray:
+    # Negative channels are clamped before the gamma, they would turn into nan
+    array = np.maximum(array, 0)
+    encoded = np.sqrt(array, dtype=float) if gamma == 2 else np.power(array, 1 / gamma, dtype=float)
+    return np.minimum(encoded * 256, 255).astype(np.uint8)
+
+
+class SharedFramebuffer:
+    def __init__(self, width, height, name=None, channels=3, dtype=np.float32):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+
+        size = width * height * channels * self.dtype.itemsize
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=max(size, 1))
+        self.array = np.ndarray((height, width, channels), dtype=self.dtype, buffer=self.memory.buf)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def __enter__(self):
+        return self
+
+    def __getstate__(self):
+        return self.width, self.height, self.name, self.channels, self.dtype.str
+
+    def __setstate__(self, state):
+        width, height, name, channels, dtype = state
+        self.__init__(width, height, name=name, channels=channels, dtype=dtype)
+
+    def write(self, x0, y0, x1, y1, colors: List[Color]):
+        self.array[y0:y1, x0:x1] = np.array([tuple(color) for color in colors], dtype=np.float32).reshape(y1 - y0, x1 - x0, 3)
+
+    def get_colors(self) -> List[Color]:
+        return [Color(*pixel) for pixel in self.array.reshape(-1, 3).tolist()]
+
+    def close(self):
+        del self.array
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,307 @@
+import math
+from typing import List
+
+import numpy as np
+
+from geometry.ray import Ray
+from geometry.sceneobject import SceneObject
+
+PADDING = 1e-7
+
+
+def get_entry_distance(minimum, maximum, origin, inverse, max_distance):
+    """Distance at which the ray enters the box, None if it misses it before max_distance."""
+    near, far = 0, max_distance
+    for axis in range(3):
+        if inverse[axis] is None:
+            if not minimum[axis] <= origin[axis] <= maximum[axis]:
+                return None
+            continue
+
+        t1 = (minimum[axis] - origin[axis]) * inverse[axis]
+        t2 = (maximum[axis] - origin[axis]) * inverse[axis]
+        if t1 > t2:
+            t1, t2 = t2, t1
+
+        near = max(near, t1)
+        far = min(far, t2)
+        if near > far:
+            return None
+
+    return near
+
+
+def get_entry_distances(minimum, maximum, origins: np.ndarray, inverses: np.ndarray, max_distances):
+    """get_entry_distance of many rays, inf for the rays that miss the box. Inverses of zero components are infinite."""
+    minimum, maximum = np.asarray(minimum, dtype=float), np.asarray(maximum, dtype=float)
+    with np.errstate(invalid="ignore"):
+        t1 = (minimum - origins) * inverses
+        t2 = (maximum - origins) * inverses
+
+    # A ray parallel to the slabs of an axis passes them only when it starts between them
+    parallel = np.isinf(inverses)
+    inside = (minimum <= origins) & (origins <= maximum)
+    near = np.where(parallel, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2))
+    far = np.where(parallel, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2))
+
+    near = np.maximum(near.max(axis=1), 0)
+    far = np.minimum(far.min(axis=1), max_distances)
+    return np.where(near <= far, near, np.inf)
+
+
+class BVHNode:
+    __slots__ = ("minimum", "maximum", "left", "right", "objects")
+
+    def __init__(self, minimum, maximum, left=None, right=None, objects=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.left = left
+        self.right = right
+        self.objects = objects
+
+    def is_leaf(self):
+        return self.objects is not None
+
+    def get_entry_distance(self, origin, inverse, max_distance):
+        return get_entry_distance(self.minimum, self.maximum, origin, inverse, max_distance)
+
+
+class BVH:
+    TRAVERSAL_COST = 1
+    INTERSECTION_COST = 1
+    LEAF_SIZE = 4
+    # Below this depth nodes are halved by count, so chains of lopsided splits can't exhaust the recursion
+    MAX_DEPTH = 48
+
+    def __init__(self, objects: List[SceneObject]):
+        self.objects = objects
+
+        if objects:
+            bounds = [object.get_bounds() for object in objects]
+            minima = np.array([tuple(minimum) for minimum, _ in bounds], dtype=float) - PADDING
+            maxima = np.array([tuple(maximum) for _, maximum in bounds], dtype=float) + PADDING
+            self.root = self.__build(np.arange(len(objects)), minima, maxima)
+        else:
+            self.root = None
+
+    @classmethod
+    def from_bounds(cls, minima: np.ndarray, maxima: np.ndarray):
+        """Builds a tree over boxes without objects, its objects are the indices of the boxes."""
+        bvh = cls.__new__(cls)
+        bvh.objects = list(range(len(minima)))
+        bvh.root = bvh.__build(np.arange(len(minima)), minima - PADDING, maxima + PADDING) if len(minima) else None
+        return bvh
+
+    def __len__(self):
+        return len(self.objects)
+
+    def to_arrays(self):
+        """Flattens the tree in preorder, leaves reference the objects by their index in self.objects."""
+        indices = {id(object): index for index, object in enumerate(self.objects)}
+        nodes = []
+        order = []
+
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            if node.is_leaf():
+                order.extend(indices[id(object)] for object in node.objects)
+            else:
+                stack.append(node.right)
+                stack.append(node.left)
+
+        positions = {id(node): position for position, node in enumerate(nodes)}
+        children = [(positions[id(node.left)], positions[id(node.right)]) if not node.is_leaf() else (-1, -1) for node in nodes]
+        counts = [len(node.objects) if node.is_leaf() else 0 for node in nodes]
+
+        return {
+            "minima": np.array([node.minimum for node in nodes], dtype=float).reshape(-1, 3),
+            "maxima": np.array([node.maximum for node in nodes], dtype=float).reshape(-1, 3),
+            "children": np.array(children, dtype=np.int64).reshape(-1, 2),
+            "counts": np.array(counts, dtype=np.int64),
+            "order": np.array(order, dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, objects: List[SceneObject], arrays):
+        """Restores a tree of to_arrays over the same objects without rebuilding it."""
+        bvh = cls.__new__(cls)
+        bvh.objects = objects
+
+        minima, maxima = arrays["minima"].tolist(), arrays["maxima"].tolist()
+        children, counts, order = arrays["children"].tolist(), arrays["counts"].tolist(), arrays["order"].tolist()
+        starts = np.cumsum([0] + counts).tolist()
+
+        # Children always come after their parent in preorder
+        nodes = [None] * len(counts)
+        for position in reversed(range(len(counts))):
+            left, right = children[position]
+            if left < 0:
+                leaf_objects = [objects[index] for index in order[starts[position]:starts[position + 1]]]
+                nodes[position] = BVHNode(tuple(minima[position]), tuple(maxima[position]), objects=leaf_objects)
+            else:
+                nodes[position] = BVHNode(tuple(minima[position]), tuple(maxima[position]), left=nodes[left], right=nodes[right])
+
+        bvh.root = nodes[0] if nodes else None
+        return bvh
+
+    @staticmethod
+    def get_surface_area(minimum, maximum):
+        size = np.maximum(maximum - minimum, 0)
+        return 2 * (size[..., 0] * size[..., 1] + size[..., 1] * size[..., 2] + size[..., 2] * size[..., 0])
+
+    def __build(self, indices, minima, maxima, depth=0):
+        minimum = minima[indices].min(axis=0)
+        maximum = maxima[indices].max(axis=0)
+        count = len(indices)
+
+        if count == 1:
+            return self.__make_leaf(indices, minimum, maximum)
+
+        centroids = (minima[indices] + maxima[indices]) / 2
+        area = self.get_surface_area(minimum, maximum)
+
+        best_cost, best_order, best_split = math.inf, None, None
+        for axis in range(3):
+            order = indices[np.argsort(centroids[:, axis], kind="stable")]
+
+            left_area = self.get_surface_area(np.minimum.accumulate(minima[order])[:-1],
+                                              np.maximum.accumulate(maxima[order])[:-1])
+            right_area = self.get_surface_area(np.minimum.accumulate(minima[order][::-1])[::-1][1:],
+                                               np.maximum.accumulate(maxima[order][::-1])[::-1][1:])
+
+            left_count = np.arange(1, count)
+            cost = self.TRAVERSAL_COST + self.INTERSECTION_COST * (left_area * left_count + right_area * (count - left_count)) / max(area, PADDING)
+
+            split = int(np.argmin(cost))
+            if cost[split] < best_cost:
+                best_cost, best_order, best_split = cost[split], order, split + 1
+
+        if best_cost >= self.INTERSECTION_COST * count or depth >= self.MAX_DEPTH:
+            if count <= self.LEAF_SIZE:
+                return self.__make_leaf(indices, minimum, maximum)
+
+            # No split is better than testing everything, e.g. for coincident boxes, where SAH peels off one object
+            # per level. A median split along the widest axis keeps the depth logarithmic.
+            axis = int(np.argmax(centroids.max(axis=0) - centroids.min(axis=0)))
+            best_order, best_split = indices[np.argsort(centroids[:, axis], kind="stable")], count // 2
+
+        return BVHNode(tuple(minimum.tolist()), tuple(maximum.tolist()),
+                       left=self.__build(best_order[:best_split], minima, maxima, depth + 1),
+                       right=self.__build(best_order[best_split:], minima, maxima, depth + 1))
+
+    def __make_leaf(self, indices, minimum, maximum):
+        return BVHNode(tuple(minimum.tolist()), tuple(maximum.tolist()),
+                       objects=[self.objects[index] for index in indices])
+
+    @staticmethod
+    def get_inverse(ray: Ray):
+        return tuple(1 / component if component != 0 else None for component in ray.direction)
+
+    def traverse(self, ray: Ray, max_distance=math.inf):
+        if self.root is None:
+            return
+
+        origin = tuple(ray.constant)
+        inverse = self.get_inverse(ray)
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.get_entry_distance(origin, inverse, max_distance) is None:
+                continue
+
+            if node.is_leaf():
+                yield from node.objects
+            else:
+                stack.append(node.right)
+                stack.append(node.left)
+
+    def get_intersections(self, ray: Ray):
+        intersections = []
+        for object in self.traverse(ray):
+            if intersection := object.get_intersection(ray):
+                intersections.append(intersection)
+
+        return intersections
+
+    def get_closest_intersection(self, ray: Ray):
+        if self.root is None:
+            return None
+
+        origin = tuple(ray.constant)
+        inverse = self.get_inverse(ray)
+
+        closest = None
+        stack = [(self.root, 0)]
+        while stack:
+            node, entry = stack.pop()
+            if closest is not None and entry > closest.distance:
+                continue
+
+            if node.is_leaf():
+                for object in node.objects:
+                    intersection = object.get_intersection(ray)
+                    if intersection and (closest is None or intersection.distance < closest.distance):
+                        closest = intersection
+                continue
+
+            max_distance = closest.distance if closest is not None else math.inf
+            children = []
+            for child in (node.left, node.right):
+                distance = child.get_entry_distance(origin, inverse, max_distance)
+                if distance is not None:
+                    children.append((child, distance))
+
+            children.sort(key=lambda child: child[1], reverse=True)
+            stack.extend(children)
+
+        return closest
+
+    def get_closest_hits(self, origins: np.ndarray, directions: np.ndarray, normalized=False):
+        """get_closest_intersection of a packet of rays, the distances and vertices of their closest hits. Every node
+        is visited once with the rays that enter it before their closest hit so far."""
+        closest = np.full(len(directions), np.inf)
+        vertices = [None] * len(directions)
+        if self.root is None:
+            return closest, vertices
+
+        with np.errstate(divide="ignore"):
+            inverses = 1 / directions
+
+        rays = np.arange(len(directions))
+        stack = [(self.root, rays, np.zeros(len(rays)))]
+        while stack:
+            node, rays, entries = stack.pop()
+            rays = rays[entries <= closest[rays]]
+            if not len(rays):
+                continue
+
+            if node.is_leaf():
+                for object in node.objects:
+                    distances, hits = object.get_hits(origins[rays], directions[rays], normalized)
+                    for index in np.flatnonzero(distances < closest[rays]).tolist():
+                        closest[rays[index]] = distances[index]
+                        vertices[rays[index]] = hits[index]
+                continue
+
+            children = []
+            for child in (node.left, node.right):
+                entries = get_entry_distances(child.minimum, child.maximum, origins[rays], inverses[rays], closest[rays])
+                hit = np.isfinite(entries)
+                if hit.any():
+                    children.append((entries[hit].min(), child, rays[hit], entries[hit]))
+
+            # The child with the nearest entry is visited first, like for a single ray
+            children.sort(key=lambda child: child[0], reverse=True)
+            stack.extend(child[1:] for child in children)
+
+        return closest, vertices
+
+    def occluded(self, ray: Ray, max_distance):
+        for object in self.traverse(ray, max_distance):
+            if object.occluded(ray, max_distance):
+                return True
+
+        return False
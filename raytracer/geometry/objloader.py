@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+from geometry.trianglemesh import TriangleMesh
+
+
+def parse_index(token, count):
+    if not token:
+        return -1
+
+    index = int(token)
+    return index - 1 if index > 0 else count + index
+
+
+def parse_corner(token, vertex_count, uv_count, normal_count):
+    vertex, uv, normal, *_ = token.split("/") + ["", ""]
+    return (parse_index(vertex, vertex_count),
+            parse_index(uv, uv_count),
+            parse_index(normal, normal_count))
+
+
+def load_obj(path: os.PathLike, material) -> TriangleMesh:
+    vertices = []
+    uvs = []
+    normals = []
+    corners = []
+
+    with open(path) as file:
+        for line in file:
+            parts = line.split()
+            if not parts:
+                continue
+
+            kind = parts[0]
+            if kind == "v":
+                vertices.append(parts[1:4])
+            elif kind == "vt":
+                uvs.append((parts[1], parts[2] if len(parts) > 2 else 0))
+            elif kind == "vn":
+                normals.append(parts[1:4])
+            elif kind == "f":
+                polygon = [parse_corner(token, len(vertices), len(uvs), len(normals)) for token in parts[1:]]
+                for second, third in zip(polygon[1:-1], polygon[2:]):
+                    corners.append((polygon[0], second, third))
+
+    if not corners:
+        raise Exception(f"{path} doesn't contain any faces!")
+
+    corners = np.array(corners, dtype=np.int32)
+
+    face_uvs = corners[:, :, 1]
+    face_normals = corners[:, :, 2]
+
+    return TriangleMesh(np.array(vertices, dtype=np.float32), corners[:, :, 0], material,
+                        normals=np.array(normals, dtype=np.float32) if normals and (face_normals >= 0).any() else None,
+                        face_normals=face_normals if normals and (face_normals >= 0).any() else None,
+                        uvs=np.array(uvs, dtype=np.float32) if uvs and (face_uvs >= 0).any() else None,
+                        face_uvs=face_uvs if uvs and (face_uvs >= 0).any() else None)
@@ -1,3 +1,5 @@
+import numpy as np
+
 from geometry.intersection import Intersection, LIMIT
 from geometry.ray import Ray
 from geometry.sceneobject import SceneObject
@@ -17,11 +19,14 @@ class Plane(SceneObject):
         return abs(self.normal * vector + self.intersect) < LIMIT
 
     def get_intersection_distance(self, ray):
-        if self.normal * ray.direction == 0 or self.includes(ray.constant):
+        denominator = self.normal * ray.direction
+        numerator = self.normal * ray.constant + self.intersect
+
+        if denominator == 0 or abs(numerator) < LIMIT:
             # raise Exception(f"{ray} doesn't intersect {self}!")
             return 0
         else:
-            return -(self.normal * ray.constant + self.intersect) / (self.normal * ray.direction)
+            return -numerator / denominator
 
     def get_intersection(self, ray: Ray):
         d = self.get_intersection_distance(ray)
@@ -30,8 +35,32 @@ class Plane(SceneObject):
 
         return Intersection(d, ray.apply(d), self, ray)
 
+    def get_intersection_distances(self, origins, directions, normalized=False):
+        # The steps of get_intersection_distance on arrays, so the distances are the same
+        n = tuple(self.normal)
+        numerator = n[0] * origins[:, 0] + n[1] * origins[:, 1] + n[2] * origins[:, 2] + self.intersect
+        denominator = n[0] * directions[:, 0] + n[1] * directions[:, 1] + n[2] * directions[:, 2]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distances = -numerator / denominator
+
+        distances[(denominator == 0) | (np.abs(numerator) < LIMIT) | ~(distances > 0)] = np.inf
+        return distances
+
+    def occluded(self, ray, max_distance):
+        if not self.material.interacts_with_light:
+            return False
+
+        return 0 < self.get_intersection_distance(ray) < max_distance
+
+    def get_bounds(self):
+        return None
+
     def get_normal_at(self, position: Vector):
         return self.normal.normalize()
 
+    def get_normals(self, positions: np.ndarray):
+        return [self.normal.normalize()] * len(positions)
+
     def get_uv(self, xyz: Vector):
         return Vector(0.5, 0.5, 0)
@@ -0,0 +1,369 @@
+import math
+
+import numpy as np
+
+from geometry.bvh import BVH, get_entry_distance, get_entry_distances
+from geometry.intersection import Intersection, LIMIT
+from geometry.ray import Ray
+from geometry.rectangle import Rectangle
+from geometry.sceneobject import SceneObject
+from geometry.sphere import Sphere
+from geometry.triangle import Triangle
+from geometry.vector import Vector, normalize_rows
+
+# The halves of a rectangle are two triangles in a row
+SPHERE, TRIANGLE, FIRST_HALF, SECOND_HALF = range(4)
+
+
+def cross(a: np.ndarray, b: np.ndarray):
+    # Spelled out like Vector.__matmul__, so the results equal those of Triangle
+    return np.stack([a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1],
+                     a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2],
+                     a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]], axis=1)
+
+
+class PrimitiveSet(SceneObject):
+    """Spheres, triangles and rectangles of one material in flat arrays, e.g. the loose ones of a compiled scene.
+
+    Every primitive is a row of values, the center and radius of a sphere or the three corners of a triangle and the
+    oriented normal of its plane. Hits are found with the steps of Sphere and Triangle on the same values, so they are
+    the same. The rows are bounded by a BVH kept as the flat arrays of BVH.to_arrays, which is traversed in plain
+    Python like the BVH. An object is only built for a primitive once a ray hits it, it is the vertex of the
+    Intersection."""
+
+    def __init__(self, kinds, values, material, nodes=None):
+        kinds = np.ascontiguousarray(kinds, dtype=np.int8).reshape(-1)
+        values = np.ascontiguousarray(values, dtype=float).reshape(-1, 12)
+
+        if nodes is None:
+            kinds, values, nodes = self.sort(kinds, values)
+
+        super().__init__(material)
+
+        self.kinds = kinds
+        self.values = values
+        self.nodes = nodes
+
+        self.__tree = None
+        self.__planes = None
+        self.__objects = {}
+
+    @classmethod
+    def from_objects(cls, objects, material):
+        kinds, values = [], []
+        for object in objects:
+            if isinstance(object, Sphere):
+                kinds.append(SPHERE)
+                values.append((*object.center, object.radius, *[0] * 8))
+                continue
+
+            triangles = [object] if isinstance(object, Triangle) else [object.triangle1, object.triangle2]
+            kinds.extend([TRIANGLE] if isinstance(object, Triangle) else [FIRST_HALF, SECOND_HALF])
+            values.extend((*triangle.t1, *triangle.t2, *triangle.t3, *triangle.plane.normal) for triangle in triangles)
+
+        return cls(kinds, values, material)
+
+    @staticmethod
+    def get_boxes(kinds, values):
+        spheres = kinds == SPHERE
+        corners = values[:, :9].reshape(-1, 3, 3)
+        minima, maxima = corners.min(axis=1), corners.max(axis=1)
+
+        radii = values[spheres, 3:4]
+        minima[spheres], maxima[spheres] = values[spheres, :3] - radii, values[spheres, :3] + radii
+        return minima, maxima
+
+    @classmethod
+    def sort(cls, kinds, values):
+        """Builds the tree over the spheres, triangles and rectangles and sorts the rows in the order of its leaves.
+        The halves of a rectangle stay next to each other."""
+        minima, maxima = cls.get_boxes(kinds, values)
+        firsts = np.flatnonzero(kinds != SECOND_HALF)
+        sizes = np.diff(np.append(firsts, len(kinds)))
+        if len(firsts):
+            minima, maxima = np.minimum.reduceat(minima, firsts), np.maximum.reduceat(maxima, firsts)
+
+        nodes = BVH.from_bounds(minima, maxima).to_arrays()
+        order = nodes.pop("order")
+
+        sizes = sizes[order]
+        ends = np.cumsum(sizes)
+        rows = np.repeat(firsts[order] - (ends - sizes), sizes) + np.arange(len(kinds))
+
+        # The leaves count rows instead of objects
+        counts = nodes["counts"]
+        starts = np.cumsum(counts) - counts
+        ends = np.append(0, ends)
+        nodes["counts"] = ends[starts + counts] - ends[starts]
+
+        return kinds[rows], values[rows], nodes
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def get_planes(self):
+        """The intersect of the plane and the three edge normals of every row, see Triangle. They are meaningless
+        for spheres."""
+        values = self.values
+        t1, t2, t3, normals = values[:, 0:3], values[:, 3:6], values[:, 6:9], values[:, 9:12]
+        intersects = -normals[:, 0] * t1[:, 0] + -normals[:, 1] * t1[:, 1] + -normals[:, 2] * t1[:, 2]
+
+        v1, v2, v3 = t2 - t3, t1 - t3, t2 - t1
+        w1 = cross(cross(v1, v2), v1)
+        w2 = cross(cross(v2, v1), v2)
+        w3 = cross(cross(v3, -v2), v3)
+        return intersects, w1, w2, w3
+
+    def get_rows(self):
+        """The rows as lists of Python floats, which get_distance reads."""
+        intersects, w1, w2, w3 = self.get_planes()
+        triangles = np.hstack([self.values[:, 9:12], intersects[:, np.newaxis], self.values[:, 0:3], self.values[:, 6:9], w1, w2, w3]).tolist()
+        spheres = self.values[:, :4].tolist()
+        return [sphere if kind == SPHERE else triangle for kind, sphere, triangle in zip(self.kinds.tolist(), spheres, triangles)]
+
+    @staticmethod
+    def get_sphere_distance(row, origin: Vector, direction: Vector):
+        # The steps of Sphere.get_intersection_distance in the same order
+        x, y, z, radius = row
+        i, j, k = origin.i - x, origin.j - y, origin.k - z
+
+        squared = i * i + j * j + k * k - radius * radius
+        if abs(squared) < LIMIT:
+            return None
+
+        projection = i * direction.i + j * direction.j + k * direction.k
+        discriminant = projection * projection - squared
+        if discriminant < 0:
+            return None
+
+        root = math.sqrt(discriminant)
+        near, far = -projection - root, -projection + root
+        if near > 0:
+            return near
+        return far if far > 0 else None
+
+    @staticmethod
+    def get_triangle_distance(row, origin: Vector, direction: Vector):
+        # The steps of Plane.get_intersection_distance and Triangle.contains in the same order
+        nx, ny, nz, intersect, x1, y1, z1, x3, y3, z3, *w = row
+
+        denominator = nx * direction.i + ny * direction.j + nz * direction.k
+        numerator = nx * origin.i + ny * origin.j + nz * origin.k + intersect
+        if denominator == 0 or abs(numerator) < LIMIT:
+            return None
+
+        distance = -numerator / denominator
+        if not distance > 0:
+            return None
+
+        x, y, z = origin.i + distance * direction.i, origin.j + distance * direction.j, origin.k + distance * direction.k
+        if not abs(nx * x + ny * y + nz * z + intersect) < LIMIT:
+            return None
+        if (x - x3) * w[0] + (y - y3) * w[1] + (z - z3) * w[2] < 0:
+            return None
+        if (x - x3) * w[3] + (y - y3) * w[4] + (z - z3) * w[5] < 0:
+            return None
+        if (x - x1) * w[6] + (y - y1) * w[7] + (z - z1) * w[8] < 0:
+            return None
+
+        return distance
+
+    def get_triangle(self, index) -> Triangle:
+        # The point the normal faces orients the rebuilt triangle like the original one
+        t1, t2, t3, normal = (Vector(*self.values[index, start:start + 3].tolist()) for start in range(0, 12, 3))
+        return Triangle(t1, t2, t3, self.material, t1 + normal)
+
+    def create_object(self, index) -> SceneObject:
+        kind = self.kinds[index]
+        if kind == SPHERE:
+            return Sphere(Vector(*self.values[index, :3].tolist()), float(self.values[index, 3]), self.material)
+        if kind == FIRST_HALF:
+            return Rectangle.from_triangles(self.get_triangle(index), self.get_triangle(index + 1))
+        if kind == SECOND_HALF:
+            return self.get_object(index - 1)
+        return self.get_triangle(index)
+
+    def get_object(self, index) -> SceneObject:
+        if index not in self.__objects:
+            self.__objects[index] = self.create_object(index)
+        return self.__objects[index]
+
+    def get_tree(self):
+        # Converted on the first traversal, loading a set doesn't pay for it
+        if self.__tree is None:
+            counts = self.nodes["counts"]
+            starts = np.cumsum(counts) - counts
+            self.__tree = (self.nodes["minima"].tolist(), self.nodes["maxima"].tolist(), self.nodes["children"].tolist(),
+                           np.stack([starts, starts + counts], axis=1).tolist(), self.kinds.tolist(), self.get_rows())
+        return self.__tree
+
+    def get_closest(self, ray: Ray, max_distance=math.inf, any_hit=False):
+        """Index and distance of the primitive hit first before max_distance, like BVH.get_closest_intersection. With
+        any_hit the first primitive found is returned."""
+        closest, hit = max_distance, None
+
+        minima, maxima, children, ranges, kinds, rows = self.get_tree()
+        if not minima:
+            return hit, closest
+
+        origin, direction = ray.constant, ray.direction
+        normalized = direction.normalize()
+        inverse = BVH.get_inverse(ray)
+        point = tuple(origin)
+
+        entry = get_entry_distance(minima[0], maxima[0], point, inverse, closest)
+        stack = [(entry, 0)] if entry is not None else []
+        while stack:
+            entry, node = stack.pop()
+            if entry > closest:
+                continue
+
+            left, right = children[node]
+            if left < 0:
+                start, stop = ranges[node]
+                for index in range(start, stop):
+                    if kinds[index] == SPHERE:
+                        distance = self.get_sphere_distance(rows[index], origin, normalized)
+                    else:
+                        distance = self.get_triangle_distance(rows[index], origin, direction)
+
+                    if distance is not None and distance < closest:
+                        closest, hit = distance, index
+                        if any_hit:
+                            return hit, closest
+                continue
+
+            entries = []
+            for child in (left, right):
+                entry = get_entry_distance(minima[child], maxima[child], point, inverse, closest)
+                if entry is not None:
+                    entries.append((entry, child))
+
+            entries.sort(reverse=True)
+            stack.extend(entries)
+
+        return hit, closest
+
+    def get_intersection(self, ray: Ray):
+        index, distance = self.get_closest(ray)
+        if index is None:
+            return False
+
+        return Intersection(distance, ray.apply(distance), self.get_object(index), ray)
+
+    def occluded(self, ray: Ray, max_distance):
+        if not self.material.interacts_with_light:
+            return False
+
+        index, _ = self.get_closest(ray, max_distance, any_hit=True)
+        return index is not None
+
+    def get_closest_rows(self, origins, directions, normalized=False):
+        """Distances and rows of the primitives hit first by many rays, -1 for misses, see get_closest. Every node is
+        visited once with the rays that enter it before their closest hit so far."""
+        closest = np.full(len(directions), np.inf)
+        hits = np.full(len(directions), -1)
+
+        minima, maxima, children, counts = (self.nodes[name] for name in ("minima", "maxima", "children", "counts"))
+        if not len(minima):
+            return closest, hits
+
+        if self.__planes is None:
+            self.__planes = self.get_planes()
+        starts = np.cumsum(counts) - counts
+        spheres = self.kinds == SPHERE
+        # Like get_closest, spheres are hit along the normalized directions and triangles along the directions
+        normalized_directions = directions if normalized else normalize_rows(directions)
+
+        with np.errstate(divide="ignore"):
+            inverses = 1 / directions
+
+        rays = np.arange(len(directions))
+        stack = [(0, rays, get_entry_distances(minima[0], maxima[0], origins, inverses, closest))]
+        while stack:
+            node, rays, entries = stack.pop()
+            rays = rays[entries <= closest[rays]]
+            if not len(rays):
+                continue
+
+            left, right = children[node]
+            if left < 0:
+                rows = np.arange(starts[node], starts[node] + counts[node])
+                columns = spheres[rows]
+
+                distances = np.full((len(rays), len(rows)), np.inf)
+                distances[:, columns] = self.get_sphere_distances(origins[rays], normalized_directions[rays], rows[columns])
+                distances[:, ~columns] = self.get_triangle_distances(origins[rays], directions[rays], rows[~columns], self.__planes)
+
+                # The first of equal distances wins, like in the loop of get_closest
+                nearest = distances.argmin(axis=1)
+                distances = distances[np.arange(len(rays)), nearest]
+                closer = distances < closest[rays]
+                closest[rays[closer]] = distances[closer]
+                hits[rays[closer]] = rows[nearest[closer]]
+                continue
+
+            entered = []
+            for child in (left, right):
+                entries = get_entry_distances(minima[child], maxima[child], origins[rays], inverses[rays], closest[rays])
+                hit = np.isfinite(entries)
+                if hit.any():
+                    entered.append((entries[hit].min(), child, rays[hit], entries[hit]))
+
+            entered.sort(key=lambda child: child[0], reverse=True)
+            stack.extend(child[1:] for child in entered)
+
+        return closest, hits
+
+    def get_intersection_distances(self, origins, directions, normalized=False):
+        return self.get_closest_rows(origins, directions, normalized)[0]
+
+    def get_hits(self, origins, directions, normalized=False):
+        closest, rows = self.get_closest_rows(origins, directions, normalized)
+        return closest, [self.get_object(row) if row >= 0 else None for row in rows.tolist()]
+
+    def get_sphere_distances(self, origins, directions, spheres):
+        centers, radii = self.values[spheres, :3], self.values[spheres, 3]
+        i, j, k = (origins[:, axis, np.newaxis] - centers[np.newaxis, :, axis] for axis in range(3))
+
+        squared = i * i + j * j + k * k - radii * radii
+        projection = i * directions[:, 0, np.newaxis] + j * directions[:, 1, np.newaxis] + k * directions[:, 2, np.newaxis]
+        discriminant = projection * projection - squared
+
+        root = np.sqrt(np.maximum(discriminant, 0))
+        near, far = -projection - root, -projection + root
+
+        distances = np.where(near > 0, near, np.where(far > 0, far, np.inf))
+        distances[(discriminant < 0) | (np.abs(squared) < LIMIT)] = np.inf
+        return distances
+
+    def get_triangle_distances(self, origins, directions, triangles, planes):
+        intersects, *edges = (array[triangles] for array in planes)
+        o, d = origins[:, :, np.newaxis], directions[:, :, np.newaxis]
+
+        n = self.values[triangles, 9:12].T[np.newaxis]
+        denominator = n[:, 0] * d[:, 0] + n[:, 1] * d[:, 1] + n[:, 2] * d[:, 2]
+        numerator = n[:, 0] * o[:, 0] + n[:, 1] * o[:, 1] + n[:, 2] * o[:, 2] + intersects
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distances = -numerator / denominator
+            points = [o[:, axis] + distances * d[:, axis] for axis in range(3)]
+
+        hits = (denominator != 0) & ~(np.abs(numerator) < LIMIT) & (distances > 0)
+        hits &= np.abs(n[:, 0] * points[0] + n[:, 1] * points[1] + n[:, 2] * points[2] + intersects) < LIMIT
+        for edge, corner in zip(edges, (6, 6, 0)):
+            t, w = self.values[triangles, corner:corner + 3].T[np.newaxis], edge.T[np.newaxis]
+            hits &= (points[0] - t[:, 0]) * w[:, 0] + (points[1] - t[:, 1]) * w[:, 1] + (points[2] - t[:, 2]) * w[:, 2] >= 0
+
+        return np.where(hits, distances, np.inf)
+
+    def get_bounds(self):
+        if not len(self.nodes["minima"]):
+            return None
+        return Vector(*self.nodes["minima"][0].tolist()), Vector(*self.nodes["maxima"][0].tolist())
+
+    def get_normal_at(self, position: Vector):
+        raise Exception("Normals of a PrimitiveSet depend on the primitive, use the vertex of the Intersection!")
+
+    def get_uv(self, xyz: Vector):
+        raise Exception("UVs of a PrimitiveSet depend on the primitive, use the vertex of the Intersection!")
@@ -7,6 +7,9 @@ from geometry.vector import Vector
 class Ray:
     constant: Vector
     direction: Vector
+    # Width of the ray cone at the origin and its growth per unit of distance, they pick the mip level of textures
+    width: float = 0.0
+    spread: float = 0.0
 
     def apply(self, λ):
-        return self.constant + λ * self.direction
+        return self.constant.scaled_add(self.direction, λ)
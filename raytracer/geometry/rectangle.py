@@ -1,3 +1,5 @@
+import numpy as np
+
 from geometry.ray import Ray
 from geometry.sceneobject import SceneObject
 from geometry.triangle import Triangle
@@ -20,15 +22,46 @@ class Rectangle(SceneObject):
 
         return False
 
+    def get_intersection_distances(self, origins, directions, normalized=False):
+        first = self.triangle1.get_intersection_distances(origins, directions)
+        second = self.triangle2.get_intersection_distances(origins, directions)
+        return np.where(np.isfinite(first), first, second)
+
+
+    def occluded(self, ray, max_distance):
+        if not self.material.interacts_with_light:
+            return False
+
+        return self.triangle1.occluded(ray, max_distance) or self.triangle2.occluded(ray, max_distance)
+
+    def get_bounds(self):
+        minimum1, maximum1 = self.triangle1.get_bounds()
+        minimum2, maximum2 = self.triangle2.get_bounds()
+
+        return (Vector(*map(min, minimum1, minimum2)),
+                Vector(*map(max, maximum1, maximum2)))
 
     def get_normal_at(self, position: Vector):
         return self.triangle1.get_normal_at(position)
 
+    def get_normals(self, positions: np.ndarray):
+        return self.triangle1.get_normals(positions)
+
     def __init__(self, t1, t2, t3, t4, material, t5=None):
         super().__init__(material)
 
         self.triangle1 = Triangle(t1, t2, t3, material, t5)
         self.triangle2 = Triangle(t2, t3, t4, material, t5)
 
+    @classmethod
+    def from_triangles(cls, triangle1: Triangle, triangle2: Triangle):
+        # Keeps the orientation of both halves as they are, e.g. when a compiled scene is loaded
+        rectangle = cls.__new__(cls)
+        SceneObject.__init__(rectangle, triangle1.material)
+
+        rectangle.triangle1 = triangle1
+        rectangle.triangle2 = triangle2
+        return rectangle
+
     def get_uv(self, xyz: Vector):
         return Vector(0.5, 0.5, 0)
@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
 
+import numpy as np
+
 from geometry.ray import Ray
 from geometry.vector import Vector
 
@@ -12,10 +14,38 @@ class SceneObject(ABC):
     def get_intersection(self, ray: Ray):
         pass
 
+    def get_intersection_distances(self, origins: np.ndarray, directions: np.ndarray, normalized=False) -> np.ndarray:
+        # Normalized directions are flagged like those of primary rays, so they aren't normalized again
+        distances = np.full(len(directions), np.inf)
+        for index, (origin, direction) in enumerate(zip(origins.tolist(), directions.tolist())):
+            if intersection := self.get_intersection(Ray(Vector(*origin), Vector(*direction, normalized=normalized))):
+                distances[index] = intersection.distance
+
+        return distances
+
+    def get_hits(self, origins: np.ndarray, directions: np.ndarray, normalized=False):
+        """Distances of the hits like get_intersection_distances along with the vertex of each hit, None for misses."""
+        distances = self.get_intersection_distances(origins, directions, normalized)
+        return distances, [self if hit else None for hit in np.isfinite(distances).tolist()]
+
+    def occluded(self, ray: Ray, max_distance) -> bool:
+        if not self.material.interacts_with_light:
+            return False
+
+        intersection = self.get_intersection(ray)
+        return bool(intersection) and intersection.distance < max_distance
+
+    def get_bounds(self):
+        return None
+
     @abstractmethod
     def get_normal_at(self, position: Vector):
         pass
 
+    def get_normals(self, positions: np.ndarray):
+        """Normalized normals at many positions on the object, the same as those of get_normal_at."""
+        return [self.get_normal_at(Vector(*position)).normalize() for position in positions.tolist()]
+
     @abstractmethod
     def get_uv(self, xyz: Vector):
         pass
@@ -1,9 +1,11 @@
 import math
 
+import numpy as np
+
 import uvmap
 from geometry.intersection import LIMIT, Intersection
 from geometry.sceneobject import SceneObject
-from geometry.vector import Vector
+from geometry.vector import Vector, normalize_rows
 
 
 class Sphere(SceneObject):
@@ -17,30 +19,51 @@ class Sphere(SceneObject):
         self.uv_map = uvmap.UVMapSphere(self)
 
     def includes(self, point: Vector):
-        return abs((self.center - point) ** 2 - self.radius ** 2) < LIMIT
+        return abs(self.center.distance_squared(point) - self.radius ** 2) < LIMIT
 
     def get_intersection_distance(self, ray):
-        if self.includes(ray.constant):
-            return None
-
-        d = ray.direction.normalize()
         C = ray.constant
         r = self.radius
         P = self.center
 
-        discriminant = (d * (C - P)) ** 2 - ((C - P) ** 2 - r ** 2)
+        # Products instead of ** 2, which goes through pow and may round differently than the arrays of a SphereSet
+        squared = C.distance_squared(P) - r * r
+        if abs(squared) < LIMIT:
+            return None
+
+        d = ray.direction.normalize()
+        projection = C.sub_dot(P, d)
+
+        discriminant = projection * projection - squared
         # print(discriminant)
         if discriminant < 0:
             return None
         # else:
         #     print(discriminant)
 
-        base = -(d * (C - P))
+        base = -projection
         if discriminant == 0:
             return base,
 
         return base + math.sqrt(discriminant), base - math.sqrt(discriminant)
 
+    def get_intersection_distances(self, origins, directions, normalized=False):
+        # The steps of get_intersection_distance on arrays, so the distances are the same
+        d = directions if normalized else normalize_rows(directions)
+        i, j, k = (origins[:, axis] - component for axis, component in enumerate(tuple(self.center)))
+
+        squared = i * i + j * j + k * k - self.radius * self.radius
+        projection = i * d[:, 0] + j * d[:, 1] + k * d[:, 2]
+        discriminant = projection * projection - squared
+
+        root = np.sqrt(np.maximum(discriminant, 0))
+        far = -projection + root
+        near = -projection - root
+
+        distances = np.where(near > 0, near, np.where(far > 0, far, np.inf))
+        distances[(discriminant < 0) | (np.abs(squared) < LIMIT)] = np.inf
+        return distances
+
     def get_uv(self, xyz: Vector):
         # return Vector(0.5, 0.5, 0)
         return self.uv_map.get_uv(xyz)
@@ -57,7 +80,24 @@ class Sphere(SceneObject):
         intersection = ray.apply(λ)
         return Intersection(λ, intersection, self, ray)
 
+    def occluded(self, ray, max_distance):
+        if not self.material.interacts_with_light:
+            return False
+
+        distances = self.get_intersection_distance(ray)
+        if distances is None:
+            return False
+
+        return 0 < min(filter(lambda x: x > 0, distances), default=0) < max_distance
+
+    def get_bounds(self):
+        return self.center - Vector.ONE * self.radius, self.center + Vector.ONE * self.radius
+
     def get_normal_at(self, position: Vector):
         # print((position - self.center).normalize())
         return (position - self.center).normalize()
 
+    def get_normals(self, positions: np.ndarray):
+        normals = normalize_rows(positions - np.array(tuple(self.center), dtype=float))
+        return [Vector(*normal, normalized=True) for normal in normals.tolist()]
+
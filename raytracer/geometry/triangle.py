@@ -1,5 +1,7 @@
+import numpy as np
+
 import uvmap
-from geometry.intersection import Intersection
+from geometry.intersection import Intersection, LIMIT
 from geometry.plane import Plane
 from geometry.sceneobject import SceneObject
 from geometry.vector import Vector
@@ -39,13 +41,31 @@ class Triangle(SceneObject):
         self.b2 = self.v2 @ self.v1
         self.b3 = self.v3 @ (-self.v2)
 
+        self.w1 = self.b1 @ self.v1
+        self.w2 = self.b2 @ self.v2
+        self.w3 = self.b3 @ self.v3
+
         self.plane = Plane(normal, intersect, material)
 
-        self.uv_map = uvmap.UVMapTriangle(self)
+        # A degenerate triangle is never hit, it has no UV basis to invert
+        self.uv_map = uvmap.UVMapTriangle(self) if normal ** 2 > 0 else None
 
     def contains(self, vector):
         return self.plane.includes(vector) and self.check_fine(vector)
 
+    def occluded(self, ray, max_distance):
+        if not self.material.interacts_with_light:
+            return False
+
+        λ = self.plane.get_intersection_distance(ray)
+        if not λ or λ < 0 or λ >= max_distance:
+            return False
+
+        return self.contains(ray.apply(λ))
+
+    def get_bounds(self):
+        return self.minimum, self.maximum
+
     def get_normal_at(self, position: Vector):
         return self.plane.get_normal_at(position)
 
@@ -60,24 +80,31 @@ class Triangle(SceneObject):
         else:
             return Intersection(λ, intersection, self, ray)
 
-    def check_coarse(self, vector):
-        return self.minimum < vector < self.maximum
-
-    def check_fine(self, vector):
-        a = self.v1 @ (vector - self.t3)
-        c = a * self.b1
+    def get_intersection_distances(self, origins, directions, normalized=False):
+        # The steps of get_intersection and contains on arrays, so the distances are the same
+        distances = self.plane.get_intersection_distances(origins, directions)
+        hits = np.flatnonzero(np.isfinite(distances))
+        x, y, z = (origins[hits, axis] + distances[hits] * directions[hits, axis] for axis in range(3))
 
-        if c < 0: return False
+        n = tuple(self.plane.normal)
+        inside = np.abs(n[0] * x + n[1] * y + n[2] * z + self.plane.intersect) < LIMIT
+        for w, corner in ((self.w1, self.t3), (self.w2, self.t3), (self.w3, self.t1)):
+            inside &= (x - corner.i) * w.i + (y - corner.j) * w.j + (z - corner.k) * w.k >= 0
 
-        a = self.v2 @ (vector - self.t3)
-        c = a * self.b2
+        distances[hits[~inside]] = np.inf
+        return distances
 
-        if c < 0: return False
+    def get_normals(self, positions: np.ndarray):
+        return self.plane.get_normals(positions)
 
-        a = self.v3 @ (vector - self.t1)
-        c = a * self.b3
+    def check_coarse(self, vector):
+        return self.minimum < vector < self.maximum
 
-        if c < 0: return False
+    def check_fine(self, vector):
+        # (v × (p - t)) · b == (p - t) · (b × v), with b × v precomputed as w
+        if vector.sub_dot(self.t3, self.w1) < 0: return False
+        if vector.sub_dot(self.t3, self.w2) < 0: return False
+        if vector.sub_dot(self.t1, self.w3) < 0: return False
 
         return True
 
@@ -0,0 +1,237 @@
+import numpy as np
+
+from geometry.intersection import Intersection, LIMIT
+from geometry.ray import Ray
+from geometry.sceneobject import SceneObject
+from geometry.vector import Vector
+
+CLUSTER_SIZE = 64
+PADDING = 1e-6
+
+
+def dot(a: np.ndarray, b: np.ndarray):
+    # Spelled out instead of einsum, which may sum in another order depending on the shapes, so a ray gets the same
+    # distances alone and in a packet
+    return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1] + a[..., 2] * b[..., 2]
+
+
+def get_morton_codes(points: np.ndarray):
+    minimum = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - minimum, PADDING)
+    quantized = ((points - minimum) / extent * 1023).astype(np.int64)
+
+    codes = np.zeros(len(points), dtype=np.int64)
+    for bit in range(10):
+        for axis in range(3):
+            codes |= ((quantized[:, axis] >> bit) & 1) << (3 * bit + axis)
+
+    return codes
+
+
+def get_face_order(vertices: np.ndarray, faces: np.ndarray):
+    if not len(faces):
+        return np.arange(0)
+
+    return np.argsort(get_morton_codes(vertices[faces].mean(axis=1)), kind="stable")
+
+
+class MeshFace:
+    def __init__(self, mesh, index):
+        self.mesh = mesh
+        self.index = index
+
+        self.material = mesh.material
+
+    def get_barycentric(self, position: Vector):
+        corner = self.mesh.corners[self.index].astype(float)
+        edge1 = self.mesh.edges1[self.index].astype(float)
+        edge2 = self.mesh.edges2[self.index].astype(float)
+        offset = np.array(tuple(position), dtype=float) - corner
+
+        d00, d01, d11 = edge1 @ edge1, edge1 @ edge2, edge2 @ edge2
+        d20, d21 = offset @ edge1, offset @ edge2
+        denominator = d00 * d11 - d01 * d01
+
+        v = (d11 * d20 - d01 * d21) / denominator
+        w = (d00 * d21 - d01 * d20) / denominator
+        return np.array([1 - v - w, v, w])
+
+    def get_normal_at(self, position: Vector):
+        if self.mesh.normals is None or self.mesh.face_normals[self.index, 0] < 0:
+            normal = np.cross(self.mesh.edges1[self.index].astype(float), self.mesh.edges2[self.index].astype(float))
+        else:
+            normal = self.get_barycentric(position) @ self.mesh.normals[self.mesh.face_normals[self.index]].astype(float)
+
+        return Vector(*normal.tolist()).normalize()
+
+    def get_normals(self, positions: np.ndarray):
+        return [self.get_normal_at(Vector(*position)) for position in positions.tolist()]
+
+    def get_uv(self, xyz: Vector):
+        barycentric = self.get_barycentric(xyz)
+        if self.mesh.uvs is None or self.mesh.face_uvs[self.index, 0] < 0:
+            return Vector(barycentric[1], barycentric[2], 0)
+
+        u, v = barycentric @ self.mesh.uvs[self.mesh.face_uvs[self.index]].astype(float)
+        return Vector(u, v, 0)
+
+
+class TriangleMesh(SceneObject):
+    def __init__(self, vertices, faces, material, normals=None, face_normals=None, uvs=None, face_uvs=None):
+        super().__init__(material)
+
+        vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+        faces = np.ascontiguousarray(faces, dtype=np.int32).reshape(-1, 3)
+
+        normals = None if normals is None else np.ascontiguousarray(normals, dtype=np.float32).reshape(-1, 3)
+        face_normals = None if face_normals is None else np.ascontiguousarray(face_normals, dtype=np.int32).reshape(-1, 3)
+        uvs = None if uvs is None else np.ascontiguousarray(uvs, dtype=np.float32).reshape(-1, 2)
+        face_uvs = None if face_uvs is None else np.ascontiguousarray(face_uvs, dtype=np.int32).reshape(-1, 3)
+
+        if normals is not None and face_normals is None:
+            face_normals = faces
+        if uvs is not None and face_uvs is None:
+            face_uvs = faces
+
+        # Faces of an OBJ may mix forms like v//vn and v/vt/, a face missing the index of any corner falls back to
+        # its flat normal or barycentric UVs as a whole, so MeshFace only has to check the first corner
+        if face_normals is not None:
+            face_normals = np.where((face_normals < 0).any(axis=1, keepdims=True), -1, face_normals).astype(np.int32)
+        if face_uvs is not None:
+            face_uvs = np.where((face_uvs < 0).any(axis=1, keepdims=True), -1, face_uvs).astype(np.int32)
+
+        order = get_face_order(vertices, faces)
+        self.vertices = vertices
+        self.faces = faces[order]
+        self.normals = normals
+        self.face_normals = None if face_normals is None else face_normals[order]
+        self.uvs = uvs
+        self.face_uvs = None if face_uvs is None else face_uvs[order]
+
+        self.corners = self.vertices[self.faces[:, 0]]
+        self.edges1 = self.vertices[self.faces[:, 1]] - self.corners
+        self.edges2 = self.vertices[self.faces[:, 2]] - self.corners
+
+        triangles = self.vertices[self.faces]
+        starts = np.arange(0, len(self.faces), CLUSTER_SIZE)
+        self.cluster_minima = np.minimum.reduceat(triangles.min(axis=1), starts) - PADDING if len(starts) else np.empty((0, 3))
+        self.cluster_maxima = np.maximum.reduceat(triangles.max(axis=1), starts) + PADDING if len(starts) else np.empty((0, 3))
+
+    def __len__(self):
+        return len(self.faces)
+
+    def get_bounds(self):
+        used = self.vertices[np.unique(self.faces)] if len(self.faces) else self.vertices
+        return Vector(*used.min(axis=0).tolist()), Vector(*used.max(axis=0).tolist())
+
+    def get_face_distances(self, origin: np.ndarray, direction: np.ndarray, start=0, stop=None):
+        corners = self.corners[start:stop]
+        edges1 = self.edges1[start:stop]
+        edges2 = self.edges2[start:stop]
+
+        p = np.cross(direction, edges2)
+        determinant = dot(edges1, p)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverse = 1 / determinant
+
+            t = origin - corners
+            u = dot(t, p) * inverse
+
+            q = np.cross(t, edges1)
+            v = dot(direction, q) * inverse
+            distances = dot(edges2, q) * inverse
+
+            valid = (determinant != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (distances > LIMIT)
+
+        return np.where(valid, distances, np.inf)
+
+    def get_cluster_entries(self, origin: np.ndarray, direction: np.ndarray, max_distance=np.inf):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverse = 1 / direction
+            t1 = (self.cluster_minima - origin) * inverse
+            t2 = (self.cluster_maxima - origin) * inverse
+
+        near = np.maximum(np.fmin(t1, t2).max(axis=1), 0)
+        far = np.minimum(np.fmax(t1, t2).min(axis=1), max_distance)
+
+        clusters = np.flatnonzero(near <= far)
+        return clusters[np.argsort(near[clusters], kind="stable")], near
+
+    def get_intersection(self, ray: Ray):
+        origin = np.array(tuple(ray.constant), dtype=float)
+        direction = np.array(tuple(ray.direction), dtype=float)
+
+        closest, index = np.inf, None
+        clusters, entries = self.get_cluster_entries(origin, direction)
+        for cluster in clusters.tolist():
+            if entries[cluster] > closest:
+                break
+
+            start = cluster * CLUSTER_SIZE
+            distances = self.get_face_distances(origin, direction, start, start + CLUSTER_SIZE)
+            candidate = int(np.argmin(distances))
+            if distances[candidate] < closest:
+                closest, index = float(distances[candidate]), start + candidate
+
+        if index is None:
+            return False
+
+        return Intersection(closest, ray.apply(closest), MeshFace(self, index), ray)
+
+    def occluded(self, ray, max_distance):
+        if not self.material.interacts_with_light:
+            return False
+
+        origin = np.array(tuple(ray.constant), dtype=float)
+        direction = np.array(tuple(ray.direction), dtype=float)
+
+        clusters, _ = self.get_cluster_entries(origin, direction, max_distance)
+        for cluster in clusters.tolist():
+            start = cluster * CLUSTER_SIZE
+            if (self.get_face_distances(origin, direction, start, start + CLUSTER_SIZE) < max_distance).any():
+                return True
+
+        return False
+
+    def get_closest_faces(self, origins, directions):
+        """Distances and indices of the faces hit first by many rays, -1 for misses. Each cluster is tested for the
+        rays that enter it before their closest hit so far."""
+        closest = np.full(len(directions), np.inf)
+        faces = np.full(len(directions), -1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverses = 1 / directions
+            for cluster in range(len(self.cluster_minima)):
+                t1 = (self.cluster_minima[cluster] - origins) * inverses
+                t2 = (self.cluster_maxima[cluster] - origins) * inverses
+
+                near = np.maximum(np.fmin(t1, t2).max(axis=1), 0)
+                far = np.minimum(np.fmax(t1, t2).min(axis=1), closest)
+                rays = np.flatnonzero(near <= far)
+                if not len(rays):
+                    continue
+
+                start = cluster * CLUSTER_SIZE
+                distances = self.get_face_distances(origins[rays, np.newaxis], directions[rays, np.newaxis], start, start + CLUSTER_SIZE)
+                candidates = distances.argmin(axis=1)
+                candidate_distances = distances[np.arange(len(rays)), candidates]
+
+                closer = candidate_distances < closest[rays]
+                closest[rays[closer]] = candidate_distances[closer]
+                faces[rays[closer]] = start + candidates[closer]
+
+        return closest, faces
+
+    def get_intersection_distances(self, origins, directions, normalized=False):
+        return self.get_closest_faces(origins, directions)[0]
+
+    def get_hits(self, origins, directions, normalized=False):
+        closest, faces = self.get_closest_faces(origins, directions)
+        return closest, [MeshFace(self, face) if face >= 0 else None for face in faces.tolist()]
+
+    def get_normal_at(self, position: Vector):
+        raise Exception("Normals of a TriangleMesh depend on the face, use the vertex of the Intersection!")
+
+    def get_uv(self, xyz: Vector):
+        raise Exception("UVs of a TriangleMesh depend on the face, use the vertex of the Intersection!")
@@ -6,12 +6,14 @@ import numpy as np
 
 @functools.total_ordering
 class Vector:
+    __slots__ = ("i", "j", "k", "_normalized")
+
     def __init__(self, i, j, k, normalized=False):
-        self.__i = i
-        self.__j = j
-        self.__k = k
+        self.i = i
+        self.j = j
+        self.k = k
 
-        self.__normalized = normalized
+        self._normalized = normalized
 
 
     def __add__(self, other):
@@ -37,18 +39,30 @@ class Vector:
 
 
     def __matmul__(self, other):
-        return Vector(self.y * other.z - self.z * other.y,
-                      self.z * other.x - self.x * other.z,
-                      self.x * other.y - self.y * other.x)
+        return Vector(self.j * other.k - self.k * other.j,
+                      self.k * other.i - self.i * other.k,
+                      self.i * other.j - self.j * other.i)
 
     def __sub__(self, other):
-        return self + -1 * other
+        return Vector(self.i - other.i, self.j - other.j, self.k - other.k)
 
     def __neg__(self):
-        return self * -1
+        return Vector(-self.i, -self.j, -self.k)
+
+    def sub_dot(self, other, factor):
+        return (self.i - other.i) * factor.i + (self.j - other.j) * factor.j + (self.k - other.k) * factor.k
+
+    def scaled_add(self, other, scale):
+        return Vector(self.i + scale * other.i, self.j + scale * other.j, self.k + scale * other.k)
+
+    def distance_squared(self, other):
+        i = self.i - other.i
+        j = self.j - other.j
+        k = self.k - other.k
+        return i * i + j * j + k * k
 
     def length(self):
-        return math.sqrt(self.i ** 2 + self.j ** 2 + self.k ** 2)
+        return math.sqrt(self.i * self.i + self.j * self.j + self.k * self.k)
 
     def __truediv__(self, other):
         return Vector(self.i / other, self.j / other, self.k / other)
@@ -63,16 +77,14 @@ class Vector:
         return True
 
     def __iter__(self):
-        yield self.i
-        yield self.j
-        yield self.k
+        return iter((self.i, self.j, self.k))
 
     def __gt__(self, other):
         return self.i > other.i and self.j > other.j and self.k > other.k
 
     def __pow__(self, power, modulo=None):
         if power == 2:
-            return self * self
+            return self.i * self.i + self.j * self.j + self.k * self.k
         else:
             raise Exception(f"Cannot raise Vector to power of {power}!")
 
@@ -98,9 +110,22 @@ class Vector:
         return self.rotate(0, pitch)
 
     def rotate(self, yaw, pitch):
-        return Vector(self.x * math.cos(yaw) + (self.z * math.sin(pitch) + self.y * math.cos(pitch)) * math.sin(yaw),
-                      -self.x * math.sin(yaw) + (self.z * math.sin(pitch) + self.y * math.cos(pitch)) * math.cos(yaw),
-                      self.z * math.cos(pitch) - self.y * math.sin(pitch))
+        cos_yaw, sin_yaw = math.cos(yaw), math.sin(yaw)
+        cos_pitch, sin_pitch = math.cos(pitch), math.sin(pitch)
+
+        tilted = self.k * sin_pitch + self.j * cos_pitch
+        return Vector(self.i * cos_yaw + tilted * sin_yaw,
+                      -self.i * sin_yaw + tilted * cos_yaw,
+                      self.k * cos_pitch - self.j * sin_pitch)
+
+    @staticmethod
+    def get_rotation_matrix(yaw, pitch):
+        cos_yaw, sin_yaw = math.cos(yaw), math.sin(yaw)
+        cos_pitch, sin_pitch = math.cos(pitch), math.sin(pitch)
+
+        return np.array([[cos_yaw, sin_yaw * cos_pitch, sin_yaw * sin_pitch],
+                         [-sin_yaw, cos_yaw * cos_pitch, cos_yaw * sin_pitch],
+                         [0, -sin_pitch, cos_pitch]])
 
     def in_terms_of_components(self, i, j, k):
         A = np.array([list(i), list(j), list(k)]).T
@@ -111,54 +136,45 @@ class Vector:
 
 
     def normalize(self):
-        if self.__normalized:
+        if self._normalized:
             return self
         else:
-            normalized = self / abs(self)
-            normalized.__normalized = True
-            return normalized
+            length = self.length()
+            return Vector(self.i / length, self.j / length, self.k / length, normalized=True)
 
     def reflection(self, normal):
-        return self - (2 * (self * normal) / self ** 2) * normal
+        return self.scaled_add(normal, -(2 * (self * normal) / self ** 2))
 
     @property
     def x(self):
-        return self.__i
-
-    @property
-    def i(self):
-        return self.__i
-
+        return self.i
 
     @property
     def y(self):
-        return self.__j
-
-    @property
-    def j(self):
-        return self.__j
-
-
-    @property
-    def k(self):
-        return self.__k
+        return self.j
 
     @property
     def z(self):
-        return self.__k
+        return self.k
 
     @property
     def u(self):
-        return self.__i
+        return self.i
 
     @property
     def v(self):
-        return self.__j
+        return self.j
 
 
 Vector.ORIGIN = Vector(0, 0, 0)
 Vector.ONE = Vector(1, 1, 1)
 
+
+def normalize_rows(vectors: np.ndarray):
+    # The steps of Vector.normalize, so a row equals the normalized Vector of it
+    length = np.sqrt(vectors[:, 0] * vectors[:, 0] + vectors[:, 1] * vectors[:, 1] + vectors[:, 2] * vectors[:, 2])
+    return vectors / length[:, np.newaxis]
+
 if __name__ == '__main__':
     vector = Vector(3, 5, 4)
 
@@ -1,5 +1,9 @@
+from typing import List
+
+import numpy as np
 import pygame
 
+from framebuffer import encode_24_bit
 from visual import Color
 
 
@@ -45,14 +49,39 @@ class Painter:
         return list(result)
 
     def fill(self, pixels, width):
-        for index, pixel in enumerate(pixels):
-            x = index % width
-            y = index // width
-            self.set(x, y, pixel)
+        self.draw(np.array([tuple(pixel) for pixel in pixels], dtype=float).reshape(-1, width, 3))
         # for y, row in enumerate(pixels):
         #     for x, pixel in enumerate(row):
         #         self.set(x, y, pixel)
 
+    def fill_array(self, array: np.ndarray):
+        self.draw(array)
+
+    def draw(self, array: np.ndarray, tiles=None) -> List[pygame.Rect]:
+        """Draws an (H,W,3) uint8 or linear float array, only the (x0, y0, x1, y1) tiles if given.
+        Returns the window rects that changed, for present."""
+        height, width = array.shape[:2]
+
+        rects = []
+        for x0, y0, x1, y1 in tiles or [(0, 0, width, height)]:
+            tile = array[y0:y1, x0:x1]
+            if tile.dtype != np.uint8:
+                tile = encode_24_bit(tile)
+
+            # surfarray indexes by (x, y), a single scaled blit replaces one fill per pixel
+            surface = pygame.surfarray.make_surface(tile.swapaxes(0, 1))
+            rect = pygame.Rect(x0 * self.scale, y0 * self.scale, (x1 - x0) * self.scale, (y1 - y0) * self.scale)
+            self.window.blit(pygame.transform.scale(surface, rect.size), rect)
+            rects.append(rect)
+
+        return rects
+
+    def present(self, rects: List[pygame.Rect] = None):
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+
     def update(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -60,6 +89,16 @@ class Painter:
                 exit()
         pygame.display.flip()
 
+    def poll(self, callback=lambda x: x):
+        handled = False
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                exit()
+            handled = callback(event) or handled
+
+        return handled
+
     def wait(self, callback=lambda x: x):
         while True:
             # print("waiting")
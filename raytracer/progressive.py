@@ -0,0 +1,59 @@
+import copy
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+from scene.session import RenderSession
+
+# (downscale factor, bounces or None for the requested amount, shadows) of each pass
+PASSES = [
+    (8, 0, False),
+    (4, 0, True),
+    (2, 1, True),
+    (1, None, True),
+]
+
+
+def upscale(array: np.ndarray, width, height) -> np.ndarray:
+    rows = np.arange(height) * array.shape[0] // height
+    columns = np.arange(width) * array.shape[1] // width
+    return array[rows[:, np.newaxis], columns]
+
+
+class ProgressiveRenderer:
+    def __init__(self, session: RenderSession, passes=None):
+        self.session = session
+        self.passes = PASSES if passes is None else passes
+
+    def get_passes(self, bounces):
+        for scale, pass_bounces, shadows in self.passes:
+            yield scale, bounces if pass_bounces is None else min(pass_bounces, bounces), shadows
+
+    def render(self, bounces, engine="ray", show: Callable[[np.ndarray], None] = lambda array: None,
+               interrupted: Callable[[], bool] = lambda: False,
+               show_tile: Callable[[np.ndarray, Tuple[int, int, int, int]], None] = lambda array, tile: None) -> Optional[np.ndarray]:
+        """show gets every pass upscaled to the viewport, show_tile every finished tile of the full resolution pass."""
+        scene = self.session.scene
+        camera, shadows = scene.camera, scene.shadows
+        width, height = camera.viewport_size
+
+        try:
+            for scale, pass_bounces, pass_shadows in self.get_passes(bounces):
+                preview = copy.copy(camera)
+                preview.viewport_size = (max(width // scale, 1), max(height // scale, 1))
+                scene.camera = preview if scale != 1 else camera
+                scene.shadows = shadows and pass_shadows
+
+                framebuffer = None
+                for framebuffer, tile in self.session.render_tiles(pass_bounces, engine):
+                    if interrupted():
+                        self.session.cancel()
+                        return None
+                    if scale == 1:
+                        show_tile(framebuffer.array, tile)
+
+                show(upscale(framebuffer.array, width, height))
+        finally:
+            scene.camera, scene.shadows = camera, shadows
+
+        return framebuffer.array
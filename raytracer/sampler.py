@@ -0,0 +1,83 @@
+from typing import Tuple
+
+import numpy as np
+
+from geometry.ray import Ray
+from geometry.vector import Vector
+
+# Generalized golden ratio of the R2 sequence, spreads sub-pixel offsets evenly for any sample count
+PLASTIC = 1.32471795724474602596
+R2 = np.array([1 / PLASTIC, 1 / PLASTIC ** 2])
+
+LUMINANCE = np.array([0.299, 0.587, 0.114])
+
+
+def get_offsets(indices: np.ndarray) -> np.ndarray:
+    return (0.5 + np.asarray(indices)[:, np.newaxis] * R2) % 1 - 0.5
+
+
+def get_luminance(pixels: np.ndarray) -> np.ndarray:
+    # Same perceptual space as encode_24_bit, so thresholds are fractions of the displayed range
+    return np.minimum(np.sqrt(np.maximum(pixels, 0)), 1) @ LUMINANCE
+
+
+def get_contrast(luminance: np.ndarray) -> np.ndarray:
+    height, width = luminance.shape
+    padded = np.pad(luminance, 1, mode="edge")
+    neighbourhood = np.stack([padded[y:y + height, x:x + width] for y in range(3) for x in range(3)])
+    return neighbourhood.max(axis=0) - neighbourhood.min(axis=0)
+
+
+class AdaptiveSampler:
+    def __init__(self, scene, threshold=0.02, max_samples=16, batch_size=4):
+        self.scene = scene
+        self.threshold = threshold
+        self.max_samples = max_samples
+        self.batch_size = batch_size
+
+    def trace_rays(self, directions: np.ndarray, bounces) -> np.ndarray:
+        origin = self.scene.camera.origin
+        spread = self.scene.camera.get_pixel_spread()
+        return np.array([tuple(self.scene.do_raycast(Ray(origin, Vector(*direction, normalized=True), 0.0, spread), bounces))
+                         for direction in directions.tolist()], dtype=float).reshape(-1, 3)
+
+    def render(self, bounces, pixels: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the averaged (H,W,3) pixels and the amount of samples spent on every pixel.
+        The one sample per pixel pass can be handed in, e.g. from RenderSession.render."""
+        camera = self.scene.camera
+        width, height = camera.viewport_size
+
+        if pixels is None:
+            pixels = self.trace_rays(camera.get_viewplane().reshape(-1, 3), bounces).reshape(height, width, 3)
+
+        totals = np.array(pixels, dtype=float)
+        samples = np.ones((height, width), dtype=int)
+
+        luminance = get_luminance(totals)
+        luminance_totals, squared_totals = luminance.copy(), luminance ** 2
+
+        active = get_contrast(luminance) > self.threshold
+        while True:
+            ys, xs = np.nonzero(active & (samples < self.max_samples))
+            if not len(ys):
+                break
+
+            # Continue the offset sequence of every pixel where its previous batch stopped, index 0 is the pixel center
+            counts = np.minimum(self.batch_size, self.max_samples - samples[ys, xs])
+            starts = np.repeat(samples[ys, xs] - counts.cumsum() + counts, counts)
+            ys, xs = np.repeat(ys, counts), np.repeat(xs, counts)
+            offsets = get_offsets(starts + np.arange(len(ys)))
+
+            colors = self.trace_rays(camera.get_ray_directions(xs + offsets[:, 0], ys + offsets[:, 1]), bounces)
+            color_luminance = get_luminance(colors)
+
+            np.add.at(totals, (ys, xs), colors)
+            np.add.at(luminance_totals, (ys, xs), color_luminance)
+            np.add.at(squared_totals, (ys, xs), color_luminance ** 2)
+            np.add.at(samples, (ys, xs), 1)
+
+            mean = luminance_totals / samples
+            error = np.sqrt(np.maximum(squared_totals / samples - mean ** 2, 0) / samples)
+            active &= error > self.threshold
+
+        return totals / samples[..., np.newaxis], samples
@@ -0,0 +1,78 @@
+import math
+from typing import List
+
+import numpy as np
+
+from geometry.ray import Ray
+from geometry.vector import Vector
+from visual import Color, Intensity
+
+# Channels of a G-buffer pixel, a distance of inf marks pixels without primary geometry hit
+DISTANCE = 0
+POSITION = slice(1, 4)
+NORMAL = slice(4, 7)
+TEXEL = slice(7, 10)
+TEXEL_GAMMA = 10
+MATERIAL = 11
+CHANNELS = 12
+
+
+class GBuffer:
+    def __init__(self, array: np.ndarray):
+        self.array = array
+        # Key of the scene state the stored hits belong to, see Scene.get_gbuffer_key
+        self.key = None
+
+    @staticmethod
+    def create(width, height):
+        return GBuffer(np.full((height, width, CHANNELS), math.inf))
+
+    @property
+    def distance(self):
+        return self.array[..., DISTANCE]
+
+    @property
+    def material(self):
+        return self.array[..., MATERIAL]
+
+    def store(self, scene, x0, y0, x1, y1):
+        origin = scene.camera.origin
+        spread = scene.camera.get_pixel_spread()
+        materials = {id(material): index for index, material in enumerate(scene.get_materials())}
+
+        for y, row in enumerate(scene.camera.get_viewplane_region(x0, y0, x1, y1).tolist(), y0):
+            for x, direction in enumerate(row, x0):
+                ray = Ray(origin, Vector(*direction, normalized=True), 0.0, spread)
+                intersection = scene.get_closest_geometry_intersection(ray)
+                if not intersection:
+                    self.array[y, x, DISTANCE] = math.inf
+                    continue
+
+                material = intersection.vertex.material
+                normal = intersection.vertex.get_normal_at(intersection.intersection).normalize()
+                texel = scene.get_texel(intersection, normal)
+
+                self.array[y, x] = (intersection.distance, *intersection.intersection, *normal,
+                                    *texel, texel.gamma, materials[id(material)])
+
+    def shade(self, scene, x0, y0, x1, y1, bounces) -> List[Color]:
+        origin = scene.camera.origin
+        spread = scene.camera.get_pixel_spread()
+        materials = scene.get_materials()
+
+        pixels = []
+        for directions, hits in zip(scene.camera.get_viewplane_region(x0, y0, x1, y1).tolist(), self.array[y0:y1, x0:x1].tolist()):
+            for direction, hit in zip(directions, hits):
+                ray = Ray(origin, Vector(*direction, normalized=True), 0.0, spread)
+
+                # Lights are not part of the cached hits, so moving them only costs these proxy tests
+                if light := scene.get_closest_light_intersection(ray, hit[DISTANCE]):
+                    pixels.append(scene.calculate_color(light, bounces))
+                elif hit[DISTANCE] == math.inf:
+                    pixels.append(Intensity(0, 0, 0))
+                else:
+                    pixels.append(scene.shade(Vector(*hit[POSITION]), Vector(*hit[NORMAL], normalized=True),
+                                              Color(*hit[TEXEL], gamma=hit[TEXEL_GAMMA]), materials[int(hit[MATERIAL])],
+                                              ray.direction, bounces, spread * hit[DISTANCE], spread))
+
+        return pixels
@@ -0,0 +1,72 @@
+from typing import List
+
+import numpy as np
+
+from geometry.intersection import Intersection
+from geometry.ray import Ray
+from geometry.vector import Vector
+from visual import Color, Intensity
+
+
+class PacketTracer:
+    """Finds the primary hits of a tile for all of its rays at once, they are shaded like those of Scene.do_raycast.
+
+    The packet goes through the BVH and the other objects in the order of Scene.get_closest_intersection and every
+    object computes its hits with the steps of get_intersection on arrays, so the image is the same as with rays."""
+
+    def __init__(self, scene):
+        self.scene = scene
+
+    def get_closest(self, origins: np.ndarray, directions: np.ndarray):
+        # Primary directions are normalized, like the flagged Vectors of their rays
+        closest, vertices = self.scene.bvh.get_closest_hits(origins, directions, normalized=True)
+
+        for object in self.scene.unbounded_objects:
+            self.update(closest, vertices, *object.get_hits(origins, directions, normalized=True))
+        # Lights are only hit in front of the geometry
+        for object in self.scene.get_light_objects():
+            self.update(closest, vertices, *object.get_hits(origins, directions, normalized=True))
+
+        return closest, vertices
+
+    @staticmethod
+    def update(closest, vertices, distances, hits):
+        for index in np.flatnonzero(distances < closest).tolist():
+            closest[index] = distances[index]
+            vertices[index] = hits[index]
+
+    @staticmethod
+    def get_normals(vertices, positions: np.ndarray):
+        """Normals of the hits, computed at once for all hits of the same vertex."""
+        groups = {}
+        for index, vertex in enumerate(vertices):
+            groups.setdefault(id(vertex), []).append(index)
+
+        normals = [None] * len(vertices)
+        for indices in groups.values():
+            for index, normal in zip(indices, vertices[indices[0]].get_normals(positions[indices])):
+                normals[index] = normal
+
+        return normals
+
+    def trace(self, origin: Vector, directions: np.ndarray, bounces) -> List[Color]:
+        origins = np.broadcast_to(np.array(tuple(origin), dtype=float), directions.shape)
+        closest, vertices = self.get_closest(origins, directions)
+
+        spread = self.scene.camera.get_pixel_spread()
+        hits = np.flatnonzero(np.isfinite(closest)).tolist()
+        distances = closest.tolist()
+
+        intersections = []
+        for index in hits:
+            ray = Ray(origin, Vector(*directions[index].tolist(), normalized=True), 0.0, spread)
+            intersections.append(Intersection(distances[index], ray.apply(distances[index]), vertices[index], ray))
+
+        positions = np.array([tuple(intersection.intersection) for intersection in intersections], dtype=float).reshape(-1, 3)
+        normals = self.get_normals([intersection.vertex for intersection in intersections], positions)
+
+        pixels = [Intensity(0, 0, 0) for _ in range(len(directions))]
+        for index, intersection, normal in zip(hits, intersections, normals):
+            pixels[index] = self.scene.calculate_color(intersection, bounces, normal)
+
+        return pixels
@@ -4,19 +4,29 @@ from abc import ABC, abstractmethod
 from typing import List
 
 DEBUG = False
+# Lower bound of squared light distances when lights are sampled by power over distance²
+MIN_DISTANCE_SQUARED = 1e-12
 
 import dataclasses
-import multiprocessing
 
+import numpy as np
+
+from geometry.bvh import BVH
 from geometry.intersection import Intersection
 from geometry.ray import Ray
 from geometry.sphere import Sphere
 from geometry.vector import Vector
+from scene.gbuffer import GBuffer
+from scene.packet import PacketTracer
+from scene.session import RenderSession
+from stats import RenderStats, instrumented
 from visual import Material, ColorBlend, Color, SolidTexture, Intensity
 
 
 class Camera:
     DIRECTION_REFERENCE = Vector(0, 1, 0)
+    # Larger viewports compute the directions of each region on demand instead of caching the whole viewplane
+    MAX_CACHED_PIXELS = 1 << 22
 
     def __init__(self, origin, rotation, viewplane_distance=2, viewplane_size=(1.0, 1.0), viewport_size=(80, 80)):
         self.origin = origin
@@ -28,32 +38,63 @@ class Camera:
         self.direction = Camera.DIRECTION_REFERENCE.rotate(*rotation)
         self.rotation = rotation
 
+        self.__viewplane_key = None
+        self.__viewplane = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_Camera__viewplane_key"] = None
+        state["_Camera__viewplane"] = None
+        return state
+
+    def get_viewplane_key(self):
+        return (tuple(self.origin), tuple(self.rotation), self.viewplane_distance,
+                tuple(self.viewplane_size), tuple(self.viewport_size))
+
+    def get_viewplane(self) -> np.ndarray:
+        key = self.get_viewplane_key()
+        if key != self.__viewplane_key:
+            self.__viewplane = self.calculate_viewplane()
+            self.__viewplane_key = key
 
-    def get_viewplane(self):
-        # v = Vector(self.scale * x, self.viewplane_distance, self.scale * z)
+        return self.__viewplane
 
-        ray_matrix = []
+    def get_viewplane_region(self, x0, y0, x1, y1) -> np.ndarray:
+        width, height = self.viewport_size
+        if width * height <= self.MAX_CACHED_PIXELS:
+            return self.get_viewplane()[y0:y1, x0:x1]
 
+        return self.get_ray_directions(*np.meshgrid(np.arange(x0, x1), np.arange(y0, y1)))
 
-        # scaled_x = self.viewplane_scale * self.viewplane_size[0]
-        # scaled_z = self.viewplane_scale * self.viewplane_size[1]
-        viewport_to_viewplane_x = self.viewplane_size[0] / self.viewport_size[0]
-        viewport_to_viewplane_z = self.viewplane_size[1] / self.viewport_size[1]
+    def calculate_viewplane(self) -> np.ndarray:
+        width, height = self.viewport_size
+        viewplane = self.get_ray_directions(*np.meshgrid(np.arange(width), np.arange(height)))
 
+        viewplane.flags.writeable = False
+        return viewplane
 
+    def get_ray_directions(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        # Pixel coordinates may be fractional, offsets within ±0.5 stay inside the footprint of the pixel
+        width, height = self.viewport_size
 
-        for z in range(self.viewport_size[1] - 1, -1, -1):
-            ray_matrix_row = []
-            for x in range(self.viewport_size[0]):
-                ray_matrix_row.append(Vector(viewport_to_viewplane_x * x - self.viewplane_size[0] // 2,
-                                             self.viewplane_distance,
-                                             viewport_to_viewplane_z * z - self.viewplane_size[1] // 2)
-                                      .rotate(*self.rotation)
-                                      .normalize())
-                # print("moi")
-            ray_matrix.append(ray_matrix_row)
+        viewport_to_viewplane_x = self.viewplane_size[0] / width
+        viewport_to_viewplane_z = self.viewplane_size[1] / height
 
-        return ray_matrix
+        points = np.empty((*np.shape(x), 3))
+        points[..., 0] = viewport_to_viewplane_x * np.asarray(x) - self.viewplane_size[0] // 2
+        points[..., 1] = self.viewplane_distance
+        points[..., 2] = viewport_to_viewplane_z * (height - 1 - np.asarray(y)) - self.viewplane_size[1] // 2
+
+        directions = points @ Vector.get_rotation_matrix(*self.rotation).T
+        directions /= np.linalg.norm(directions, axis=-1)[..., np.newaxis]
+        return directions
+
+    def get_pixel_spread(self):
+        """Angle one pixel covers at the center of the viewplane, the spread of primary ray cones."""
+        return self.viewplane_size[0] / self.viewport_size[0] / self.viewplane_distance
+
+    def get_ray_direction(self, x, y) -> Vector:
+        return Vector(*self.get_viewplane()[y, x].tolist(), normalized=True)
 
     def __str__(self) -> str:
         return f"Camera({self.origin}, {self.rotation})"
@@ -61,6 +102,9 @@ class Camera:
 
 
 class LightSource(ABC):
+    # Bumped whenever any light changes, so scenes know when to rebuild their light proxies
+    generation = 0
+
     @abstractmethod
     def get_representative_object(self):
         pass
@@ -91,6 +135,10 @@ class PointLightSource(LightSource):
     emit_light: bool = True
     radius: float = 0.2
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        LightSource.generation += 1
+
     def get_representative_object(self):
         if self.render_in_picture:
             return Sphere(self.position, self.radius, Material(SolidTexture(self.intensity.normalize()), interacts_with_light=False))
@@ -138,70 +186,226 @@ class ScatteredLightSource:
 
 
 class Scene:
-    def __init__(self, objects, lights: List[LightSource],  camera, ambient_light_intensity: Intensity=Intensity(0, 0, 0), gamma=2.2):
+    def __init__(self, objects, lights: List[LightSource],  camera, ambient_light_intensity: Intensity=Intensity(0, 0, 0), gamma=2.2, light_samples=None,
+                 bvh_arrays=None):
+        # Flattened BVH of the bounded objects from BVH.to_arrays, e.g. of a compiled scene, skips the first build
+        self.__bvh_arrays = bvh_arrays
+        # Bumped by every change of the geometry, it keys the stored G-buffer hits. Pickled copies keep it, so workers
+        # reuse the BVH that comes with the scene
+        self.__geometry_version = 0
         self.objects = objects
+        self.__gbuffer = None
+        self.__light_generation = None
+        self.__light_objects = []
+        self.__emitters = []
+        self.__emitter_positions = None
+        self.__emitter_powers = None
+
+        # Amount of lights sampled per shading point, None shades every light
+        self.light_samples = light_samples
+        # Whether shadow rays are cast, previews turn them off
+        self.shadows = True
+
         self.lights = lights
         self.camera = camera
         self.ambient_light_intensity = ambient_light_intensity
         self.gamma = gamma
 
-    def do_raycast(self, ray, bounces_left=2) -> Color:
-        intersections = self.get_intersections(ray)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_Scene__gbuffer"] = None
+        return state
+
+    @property
+    def objects(self):
+        return self.__objects
+
+    @objects.setter
+    def objects(self, objects):
+        self.__objects = objects
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        """Rebuilds the BVH and invalidates the stored G-buffer hits. Only reassigning the objects is noticed, call it
+        after changing the list, an object or a material in place."""
+        self.__geometry_version += 1
+        self.refresh_geometry()
+
+    def get_geometry_key(self):
+        return self.__geometry_version
+
+    def refresh_geometry(self):
+        objects = self.objects
+        bounded = [object for object in objects if object.get_bounds() is not None]
+
+        bvh_arrays, self.__bvh_arrays = self.__bvh_arrays, None
+        self.bvh = BVH(bounded) if bvh_arrays is None else BVH.from_arrays(bounded, bvh_arrays)
+        self.unbounded_objects = [object for object in objects if object.get_bounds() is None]
+
+        self.__materials = list({id(object.material): object.material for object in objects}.values())
+
+    def get_materials(self):
+        return self.__materials
+
+    def get_gbuffer_key(self):
+        return self.camera.get_viewplane_key(), self.get_geometry_key()
+
+    @property
+    def lights(self):
+        return self.__lights
+
+    @lights.setter
+    def lights(self, lights):
+        self.__lights = lights
+        self.refresh_lights()
+
+    def refresh_lights(self):
+        self.__light_generation = None
+
+    def __update_lights(self):
+        if self.__light_generation == LightSource.generation:
+            return
+
+        objects = (light.get_representative_object() for light in self.lights)
+        self.__light_objects = [object for object in objects if object is not None]
+
+        self.__emitters = [light for light in self.lights if light.emits_light()]
+        self.__emitter_positions = np.array([tuple(light.get_position()) for light in self.__emitters], dtype=float).reshape(-1, 3)
+        self.__emitter_powers = np.array([light.get_intensity().luminance() for light in self.__emitters], dtype=float)
+
+        self.__light_generation = LightSource.generation
+
+    def get_light_objects(self):
+        self.__update_lights()
+        return self.__light_objects
+
+    def get_shading_lights(self, point: Vector):
+        self.__update_lights()
+
+        samples = self.light_samples
+        if samples is None or samples >= len(self.__emitters):
+            return [(light, 1) for light in self.__emitters]
 
-        if intersections:
-            closest = min(intersections, key=lambda intersection: intersection.distance)
+        offsets = self.__emitter_positions - np.array(tuple(point), dtype=float)
+        # A light on the shading point itself, e.g. hit through its proxy sphere, would get an infinite weight
+        weights = self.__emitter_powers / np.maximum(np.einsum("ij,ij->i", offsets, offsets), MIN_DISTANCE_SQUARED)
+        cumulative = np.cumsum(weights)
+        total = cumulative[-1]
+        if not total > 0:
+            return []
 
+        picks = np.searchsorted(cumulative, [random.random() * total for _ in range(samples)], side="right")
+        picks = np.minimum(picks, len(self.__emitters) - 1).tolist()
+
+        # Each pick has probability weight / total, so dividing by samples * probability keeps the sum unbiased
+        return [(self.__emitters[pick], total / (samples * weights[pick])) for pick in picks]
+
+    def do_raycast(self, ray, bounces_left=2) -> Color:
+        closest = self.get_closest_intersection(ray)
+
+        if closest:
             return self.calculate_color(closest, bounces_left)
         else:
             return Intensity(0, 0, 0)
 
+    def get_closest_intersection(self, ray):
+        closest = self.get_closest_geometry_intersection(ray)
+        light = self.get_closest_light_intersection(ray, closest.distance if closest else math.inf)
+        return light or closest
+
+    def get_closest_geometry_intersection(self, ray):
+        closest = self.bvh.get_closest_intersection(ray)
+
+        for object in self.unbounded_objects:
+            if (intersection := object.get_intersection(ray)) and (closest is None or intersection.distance < closest.distance):
+                closest = intersection
+        return closest
+
+    def get_closest_light_intersection(self, ray, max_distance=math.inf):
+        closest = None
+        for object in self.get_light_objects():
+            if (intersection := object.get_intersection(ray)) and intersection.distance < (closest.distance if closest else max_distance):
+                closest = intersection
+        return closest
+
+    def occluded(self, ray, max_distance):
+        if self.bvh.occluded(ray, max_distance):
+            return True
+
+        for object in self.unbounded_objects:
+            if object.occluded(ray, max_distance):
+                return True
+
+        return False
+
     def get_intersections(self, ray):
-        intersections = []
-        for object in self.objects:
+        intersections = self.bvh.get_intersections(ray)
+        for object in self.unbounded_objects:
             if intersection := object.get_intersection(ray):
                 intersections.append(intersection)
-        for light in self.lights:
-            object = light.get_representative_object()
-
-            if object is not None and (intersection := object.get_intersection(ray)):
+        for object in self.get_light_objects():
+            if intersection := object.get_intersection(ray):
                 intersections.append(intersection)
         return intersections
 
-    def calculate_color(self, intersection: Intersection, bounces_left=1):
+    def calculate_color(self, intersection: Intersection, bounces_left=1, vertex_normal: Vector = None):
+        # The normal may come along, e.g. computed with those of other hits by the PacketTracer
         material = intersection.vertex.material
-        vertex_normal = intersection.vertex.get_normal_at(intersection.intersection).normalize()
-        vector_to_camera = (self.camera.origin - intersection.intersection).normalize()
-
-
+        if vertex_normal is None:
+            vertex_normal = intersection.vertex.get_normal_at(intersection.intersection).normalize()
+        texel = self.get_texel(intersection, vertex_normal)
+
+        ray = intersection.ray
+        return self.shade(intersection.intersection, vertex_normal, texel, material, ray.direction, bounces_left,
+                          ray.width + ray.spread * intersection.distance, ray.spread)
+
+    def get_texel(self, intersection: Intersection, vertex_normal: Vector) -> Color:
+        vertex, position, ray = intersection.vertex, intersection.intersection, intersection.ray
+        albedo = vertex.material.albedo
+        uv = vertex.get_uv(position)
+        if not albedo.mipmapped or not ray.spread:
+            return albedo.get_color(uv)
+
+        # The cone width at the hit is carried into UV space along two directions in the surface
+        width = ray.width + ray.spread * intersection.distance
+        tangent = vertex_normal @ ray.direction
+        if tangent ** 2 < 1e-12:
+            tangent = vertex_normal @ (Vector(1, 0, 0) if abs(vertex_normal.x) < 0.9 else Vector(0, 1, 0))
+        tangent = tangent.normalize()
+        bitangent = tangent @ vertex_normal
+
+        footprint = 0.0
+        for offset in (tangent, bitangent):
+            other = vertex.get_uv(position.scaled_add(offset, width))
+            for delta in (abs(other.u - uv.u) % 1, abs(other.v - uv.v) % 1):
+                # UVs of spheres wrap around, a step across the seam is the short way round
+                footprint = max(footprint, min(delta, 1 - delta))
+
+        return albedo.get_color(uv, footprint)
+
+    def shade(self, position: Vector, vertex_normal: Vector, texel: Color, material: Material, direction: Vector, bounces_left=1,
+              width=0.0, spread=0.0):
         specular_intensity = ColorBlend()
         diffuse_intensity = ColorBlend()
-        texel = material.albedo.get_color(intersection.vertex.get_uv(intersection.intersection))
 
         if not material.interacts_with_light:
             return texel.apply_gamma(self.gamma)
 
+        reflection_direction = direction.reflection(vertex_normal)
 
-        for light in self.lights:
-            if not light.emits_light():
-                continue
 
-            occlusions = []
+        for light, weight in self.get_shading_lights(position):
+            vector_to_light = light.get_position() - position
+            distance_to_light = abs(vector_to_light)
 
-            vector_to_light = light.get_position() - intersection.intersection
+            direction_to_light = vector_to_light.normalize()
+            new_ray = Ray(position, direction_to_light)
 
-            new_ray = Ray(intersection.intersection, vector_to_light.normalize())
+            if not self.shadows or not self.occluded(new_ray, distance_to_light):
+                specular_direction_coefficient = abs(reflection_direction * direction_to_light)
+                diffuse_direction_coefficient = abs(direction_to_light * vertex_normal)
 
-            for object in self.objects:
-                if occlusion := object.get_intersection(new_ray):
-                    if occlusion.vertex.material.interacts_with_light and occlusion.distance < abs(vector_to_light):
-                        occlusions.append(occlusion)
-
-
-            if not occlusions:
-                specular_direction_coefficient = abs(intersection.ray.direction.reflection(vertex_normal) * vector_to_light.normalize())
-                diffuse_direction_coefficient = abs(vector_to_light.normalize() * vertex_normal)
-
-                distance_coefficient = 1 / vector_to_light ** 2
+                distance_coefficient = weight / vector_to_light ** 2
                 # pixel_color += abs(vertex_normal * vector_to_light.normalize()) * abs(vector_to_light) ** 2 * self.do_gamma_correction(light.intensity, 2.2)
                 specular_intensity.add(light.get_intensity() * distance_coefficient * specular_direction_coefficient)
                 diffuse_intensity.add(light.get_intensity() * distance_coefficient * diffuse_direction_coefficient)
@@ -210,10 +414,7 @@ class Scene:
         diffuse_reflectivity = material.diffuse_reflectivity
 
         if bounces_left > 0 and specular_reflectivity != Vector(0, 0, 0):
-            reflection_ray_direction = intersection.ray.direction.reflection(vertex_normal)
-            reflection_ray_origin = intersection.intersection
-
-            spexel = self.do_raycast(Ray(reflection_ray_origin, reflection_ray_direction), bounces_left - 1)
+            spexel = self.do_raycast(Ray(position, reflection_direction, width, spread), bounces_left - 1)
         else:
             spexel = Intensity(0, 0, 0)
 
@@ -223,54 +424,50 @@ class Scene:
         return result
 
 
-    def trace(self, bounces):
-        if not DEBUG:
-            global f
-            print("generating viewplane")
-            viewplane = self.camera.get_viewplane()
-
-            print("starting tracing")
-
-            a = 0
-            flattened = [(pixel, x, y) for y, row in enumerate(viewplane) for x, pixel in enumerate(row)]
+    def trace_tile(self, x0, y0, x1, y1, bounces, engine="ray", gbuffer: GBuffer = None, reuse=False) -> List[Color]:
+        if gbuffer is not None:
+            # Primary hits come from the G-buffer, so only shading and secondary rays are traced on reuse
+            if not reuse:
+                gbuffer.store(self, x0, y0, x1, y1)
+            return gbuffer.shade(self, x0, y0, x1, y1, bounces)
 
+        directions = self.camera.get_viewplane_region(x0, y0, x1, y1).reshape(-1, 3)
 
-            def f(args):
-                direction, x, row = args
-                if not row % 10 and x == 0:
-                    # pygame.event.get()
-                    print(row)
-                    # pass
+        if engine == "packet":
+            return PacketTracer(self).trace(self.camera.origin, directions, bounces)
+        elif engine != "ray":
+            raise Exception(f"Unknown engine {engine}!")
 
+        spread = self.camera.get_pixel_spread()
+        return [self.do_raycast(Ray(self.camera.origin, Vector(*direction, normalized=True), 0.0, spread), bounces)
+                for direction in directions.tolist()]
 
-                return self.do_raycast(Ray(self.camera.origin, direction), bounces)
-
-            with multiprocessing.Pool(10) as pool:
-                return pool.map(f, flattened, 128)
-        else:
-            print("generating viewplane, DEBUG")
-            viewplane = self.camera.get_viewplane()
+    def trace(self, bounces, engine="ray", workers=None, gbuffer=False, stats=False):
+        # With stats the RenderStats of the frame, merged over all workers, are returned along with the pixels
+        render_stats = RenderStats() if stats else None
 
+        if not DEBUG:
             print("starting tracing")
 
-            a = 0.5
-            flattened = [(pixel, x, y) for y, row in enumerate(viewplane) for x, pixel in enumerate(row)]
-
-
-            def f(args):
-                direction, x, row = args
-                if not row % 10 and x == 0:
-                    # pygame.event.get()
-                    print(row)
-
-                try:
-                    return self.do_raycast(Ray(self.camera.origin, direction), bounces)
-                except Exception as e:
-                    print(args)
-                    raise e
+            with RenderSession(self, workers) as session:
+                pixels = session.trace(bounces, engine, gbuffer=gbuffer, stats=render_stats)
+        else:
+            print("starting tracing, DEBUG")
 
-            return list(map(f, flattened))
+            with instrumented(self, render_stats):
+                pixels = self.__trace_serial(bounces, engine, gbuffer)
 
+        return (pixels, render_stats) if stats else pixels
 
+    def __trace_serial(self, bounces, engine, gbuffer):
+        width, height = self.camera.viewport_size
+        if not gbuffer:
+            return self.trace_tile(0, 0, width, height, bounces, engine)
 
+        if self.__gbuffer is None or self.__gbuffer.array.shape[:2] != (height, width):
+            self.__gbuffer = GBuffer.create(width, height)
 
+        key = self.get_gbuffer_key()
+        pixels = self.trace_tile(0, 0, width, height, bounces, gbuffer=self.__gbuffer, reuse=self.__gbuffer.key == key)
+        self.__gbuffer.key = key
+        return pixels
@@ -0,0 +1,397 @@
+"""Declarative JSON scene files and their compiled binary form.
+
+A scene file describes the camera, named textures and materials, objects and lights::
+
+    {
+        "camera": {"origin": [0, -5, 7], "rotation": [0.02, 0.4], "viewplane_distance": 2,
+                   "viewplane_size": [2, 2], "viewport_size": [100, 100]},
+        "ambient": [0.1, 0.1, 0.1],
+        "gamma": 2,
+        "textures": {"white": {"type": "solid", "color": [1, 1, 1]},
+                     "marble": {"type": "image", "path": "res/texture1.png", "gamma": 0.5}},
+        "materials": {"floor": {"albedo": "white"},
+                      "mirror": {"albedo": "marble", "specular_reflectivity": [1, 1, 1]}},
+        "objects": [{"type": "sphere", "center": [1, 4, 4], "radius": 1, "material": "mirror"},
+                    {"type": "plane", "normal": [0, 0, 1], "intersect": -1, "material": "floor"},
+                    {"type": "triangle", "vertices": [[-5, 6, 5], [0, 0, 3], [5, 6, 3]], "facing": [0, -5, 7],
+                     "material": "floor"},
+                    {"type": "rectangle", "vertices": [[-2, 4, -1], [-5, 6, 5], [0, 0, -1], [0, 0, 3]],
+                     "material": "floor"},
+                    {"type": "mesh", "path": "bunny.obj", "material": "floor"}],
+        "lights": [{"type": "point", "position": [-5, -10, 10], "intensity": [400, 400, 400]},
+                   {"type": "scattered", "position": [4, 4.5, 4], "intensity": [7, 7, 70], "radius": 2, "points": 20}]
+    }
+
+Relative paths are resolved against the directory of the scene file. The compiled form stores every object as rows
+of flat arrays together with the flattened BVH, behind a JSON index of names, dtypes, shapes and offsets. It is read
+through a memory map, so loading it skips the JSON parsing, the OBJ parsing and the BVH build. Materials with many
+loose spheres, triangles or rectangles are compiled into one PrimitiveSet, so loading them builds no Python object
+per primitive.
+"""
+import collections
+import json
+import math
+import os
+import pathlib
+
+import numpy as np
+
+from geometry.bvh import BVH
+from geometry.objloader import load_obj
+from geometry.plane import Plane
+from geometry.primitiveset import PrimitiveSet
+from geometry.rectangle import Rectangle
+from geometry.sphere import Sphere
+from geometry.triangle import Triangle
+from geometry.trianglemesh import TriangleMesh
+from geometry.vector import Vector
+from scene.scene import Camera, PointLightSource, ScatteredLightSource, Scene
+from visual import Color, ImageTexture, Intensity, Material, SolidTexture
+
+MAGIC = b"RTSCENE2"
+SUFFIX = ".rtscene"
+ALIGNMENT = 64
+# Loose primitives of one material are compiled into one PrimitiveSet from this many on
+GROUP_SIZE = 64
+
+SPHERE, PLANE, TRIANGLE, RECTANGLE, MESH, PRIMITIVE_SET = range(6)
+MESH_ARRAYS = ("vertices", "faces", "normals", "face_normals", "uvs", "face_uvs")
+
+
+def get_cache_path(path: os.PathLike) -> pathlib.Path:
+    return pathlib.Path(path).with_suffix(SUFFIX)
+
+
+def get_referenced_paths(description, directory: pathlib.Path):
+    textures = description.get("textures", {}).values()
+    return [directory / item["path"] for item in [*textures, *description.get("objects", [])]
+            if item["type"] in ("image", "mesh")]
+
+
+def get_status(paths):
+    status = []
+    for path in paths:
+        stat = os.stat(path)
+        status.append([str(pathlib.Path(path).resolve()), stat.st_mtime_ns, stat.st_size])
+    return status
+
+
+def get_source_key(path: os.PathLike):
+    """Resolved path, mtime and size of the scene file and every OBJ mesh and image it references, the compiled
+    form bakes in their contents."""
+    path = pathlib.Path(path)
+    with open(path) as file:
+        description = json.load(file)
+
+    return get_status([path, *get_referenced_paths(description, path.parent)])
+
+
+def get_color(values) -> Color:
+    r, g, b, *gamma = values
+    return Intensity(r, g, b) if not gamma or gamma[0] == 1 else Color(r, g, b, gamma=gamma[0])
+
+
+def read_texture(description, directory: pathlib.Path):
+    kind = description["type"]
+    if kind == "solid":
+        return SolidTexture(get_color(description["color"]))
+    if kind == "image":
+        return ImageTexture(directory / description["path"], gamma=description.get("gamma", 0.5))
+
+    raise Exception(f"Unknown texture type {kind}!")
+
+
+def read_material(description, textures) -> Material:
+    return Material(textures[description["albedo"]],
+                    specular_reflectivity=Vector(*description.get("specular_reflectivity", (0, 0, 0))),
+                    diffuse_reflectivity=Vector(*description.get("diffuse_reflectivity", (1, 1, 1))),
+                    interacts_with_light=description.get("interacts_with_light", True))
+
+
+def read_object(description, materials, directory: pathlib.Path):
+    kind = description["type"]
+    material = materials[description["material"]]
+    facing = Vector(*description["facing"]) if "facing" in description else None
+
+    if kind == "sphere":
+        return Sphere(Vector(*description["center"]), description["radius"], material)
+    if kind == "plane":
+        return Plane(Vector(*description["normal"]), description["intersect"], material)
+    if kind == "triangle":
+        return Triangle(*(Vector(*vertex) for vertex in description["vertices"]), material, facing)
+    if kind == "rectangle":
+        return Rectangle(*(Vector(*vertex) for vertex in description["vertices"]), material, facing)
+    if kind == "mesh":
+        return load_obj(directory / description["path"], material)
+
+    raise Exception(f"Unknown object type {kind}!")
+
+
+def read_lights(description):
+    kind = description["type"]
+    position, intensity = Vector(*description["position"]), get_color(description["intensity"])
+
+    if kind == "point":
+        return [PointLightSource(position, intensity,
+                                 render_in_picture=description.get("render_in_picture", True),
+                                 emit_light=description.get("emit_light", True),
+                                 radius=description.get("radius", 0.2))]
+    if kind == "scattered":
+        return list(ScatteredLightSource(position, intensity, description["radius"], description["points"]))
+
+    raise Exception(f"Unknown light type {kind}!")
+
+
+def read_scene(path: os.PathLike, viewport_size=None) -> Scene:
+    path = pathlib.Path(path)
+    directory = path.parent
+    with open(path) as file:
+        description = json.load(file)
+
+    textures = {name: read_texture(texture, directory) for name, texture in description.get("textures", {}).items()}
+    materials = {name: read_material(material, textures) for name, material in description.get("materials", {}).items()}
+
+    camera = description["camera"]
+    return Scene([read_object(object, materials, directory) for object in description.get("objects", [])],
+                 [light for lights in description.get("lights", []) for light in read_lights(lights)],
+                 Camera(Vector(*camera["origin"]), tuple(camera["rotation"]),
+                        viewplane_distance=camera.get("viewplane_distance", 2),
+                        viewplane_size=tuple(camera.get("viewplane_size", (1.0, 1.0))),
+                        viewport_size=tuple(viewport_size or camera.get("viewport_size", (80, 80)))),
+                 ambient_light_intensity=get_color(description.get("ambient", (0, 0, 0))),
+                 gamma=description.get("gamma", 2.2),
+                 light_samples=description.get("light_samples"))
+
+
+def group_objects(objects):
+    """Replaces the loose spheres, triangles and rectangles of every material with at least GROUP_SIZE of them by one
+    PrimitiveSet, which takes the place of the first of them."""
+    groups = collections.defaultdict(list)
+    for object in objects:
+        if isinstance(object, (Sphere, Triangle, Rectangle)):
+            groups[id(object.material)].append(object)
+
+    firsts = {id(members[0]): members for members in groups.values() if len(members) >= GROUP_SIZE}
+    grouped = {id(member) for members in firsts.values() for member in members}
+    if not grouped:
+        return objects
+
+    return [PrimitiveSet.from_objects(firsts[id(object)], object.material) if id(object) in firsts else object
+            for object in objects if id(object) in firsts or id(object) not in grouped]
+
+
+def compile_scene(scene: Scene, path: os.PathLike, source: os.PathLike = None):
+    """Writes the compiled form of any scene built from the supported types. With a source path the file is only
+    used as its cache while the source is unchanged."""
+    materials = scene.get_materials()
+    material_indices = {id(material): index for index, material in enumerate(materials)}
+    textures = list({id(material.albedo): material.albedo for material in materials}.values())
+    texture_indices = {id(texture): index for index, texture in enumerate(textures)}
+
+    rows = {SPHERE: [], PLANE: [], TRIANGLE: [], RECTANGLE: []}
+    row_materials = {SPHERE: [], PLANE: [], TRIANGLE: [], RECTANGLE: []}
+    arrays = {}
+    meshes = []
+    primitive_sets = []
+    objects = []
+
+    compiled = group_objects(scene.objects)
+    for object in compiled:
+        material = material_indices[id(object.material)]
+        if isinstance(object, Sphere):
+            kind, row = SPHERE, (*object.center, object.radius)
+        elif isinstance(object, Triangle):
+            # The point the normal faces is rebuilt from the oriented normal, which Triangle keeps
+            kind, row = TRIANGLE, (*object.t1, *object.t2, *object.t3, *(object.t1 + object.plane.normal))
+        elif isinstance(object, Rectangle):
+            first, second = object.triangle1, object.triangle2
+            kind, row = RECTANGLE, (*first.t1, *first.t2, *first.t3, *second.t3,
+                                    *(first.t1 + first.plane.normal), *(second.t1 + second.plane.normal))
+        elif isinstance(object, Plane):
+            kind, row = PLANE, (*object.normal, object.intersect)
+        elif isinstance(object, TriangleMesh):
+            for name in MESH_ARRAYS:
+                if getattr(object, name) is not None:
+                    arrays[f"mesh{len(meshes)}.{name}"] = getattr(object, name)
+            objects.append((MESH, len(meshes)))
+            meshes.append(material)
+            continue
+        elif isinstance(object, PrimitiveSet):
+            prefix = f"primitiveset{len(primitive_sets)}"
+            arrays[f"{prefix}.kinds"], arrays[f"{prefix}.values"] = object.kinds, object.values
+            arrays.update({f"{prefix}.nodes.{name}": array for name, array in object.nodes.items()})
+            objects.append((PRIMITIVE_SET, len(primitive_sets)))
+            primitive_sets.append(material)
+            continue
+        else:
+            raise Exception(f"{type(object).__name__} can't be compiled!")
+
+        objects.append((kind, len(rows[kind])))
+        rows[kind].append(row)
+        row_materials[kind].append(material)
+
+    for kind, name, width in ((SPHERE, "spheres", 4), (PLANE, "planes", 4), (TRIANGLE, "triangles", 12), (RECTANGLE, "rectangles", 18)):
+        arrays[name] = np.array(rows[kind], dtype=float).reshape(-1, width)
+        arrays[f"{name}.materials"] = np.array(row_materials[kind], dtype=np.int64)
+    arrays["objects"] = np.array(objects, dtype=np.int64).reshape(-1, 2)
+
+    lights = []
+    for light in scene.lights:
+        if not isinstance(light, PointLightSource):
+            raise Exception(f"{type(light).__name__} can't be compiled!")
+        lights.append((*light.position, *light.intensity, light.intensity.gamma, light.radius, light.render_in_picture, light.emit_light))
+    arrays["lights"] = np.array(lights, dtype=float).reshape(-1, 10)
+
+    bvh = scene.bvh if compiled is scene.objects else BVH([object for object in compiled if object.get_bounds() is not None])
+    for name, array in bvh.to_arrays().items():
+        arrays[f"bvh.{name}"] = array
+
+    camera = scene.camera
+    index = {
+        "source": get_source_key(source) if source is not None else None,
+        "camera": {"origin": list(camera.origin), "rotation": list(camera.rotation), "viewplane_distance": camera.viewplane_distance,
+                   "viewplane_size": list(camera.viewplane_size), "viewport_size": list(camera.viewport_size)},
+        "ambient": [*scene.ambient_light_intensity, scene.ambient_light_intensity.gamma],
+        "gamma": scene.gamma,
+        "light_samples": scene.light_samples,
+        "textures": [get_texture_description(texture) for texture in textures],
+        "materials": [{"albedo": texture_indices[id(material.albedo)],
+                       "specular_reflectivity": list(material.specular_reflectivity),
+                       "diffuse_reflectivity": list(material.diffuse_reflectivity),
+                       "interacts_with_light": material.interacts_with_light} for material in materials],
+        "meshes": meshes,
+        "primitive_sets": primitive_sets,
+        "arrays": {},
+    }
+
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        index["arrays"][name] = [array.dtype.str, list(array.shape), offset]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps(index).encode()
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    # Written next to the target first, so a concurrent load never sees half a file
+    temporary = pathlib.Path(f"{path}.{os.getpid()}.tmp")
+    with open(temporary, "wb") as file:
+        file.write(MAGIC + np.uint64(len(header)).tobytes() + header)
+        for name, array in arrays.items():
+            file.seek(start + index["arrays"][name][2])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(start + offset)
+    os.replace(temporary, path)
+
+
+def get_texture_description(texture):
+    if isinstance(texture, SolidTexture):
+        return {"type": "solid", "color": [*texture.color, texture.color.gamma]}
+    if isinstance(texture, ImageTexture):
+        return {"type": "image", "path": str(pathlib.Path(texture.path).resolve()), "gamma": texture.gamma}
+
+    raise Exception(f"{type(texture).__name__} can't be compiled!")
+
+
+def read_index(data: np.ndarray):
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise Exception("Not a compiled scene!")
+
+    length = int(data[len(MAGIC):len(MAGIC) + 8].view(np.uint64)[0])
+    header_end = len(MAGIC) + 8 + length
+    return json.loads(bytes(data[len(MAGIC) + 8:header_end])), -(-header_end // ALIGNMENT) * ALIGNMENT
+
+
+def get_prefixed(arrays, prefix):
+    return {name[len(prefix):]: array for name, array in arrays.items() if name.startswith(prefix)}
+
+
+def load_compiled(path: os.PathLike, viewport_size=None) -> Scene:
+    data = np.memmap(path, mode="r")
+    index, start = read_index(data)
+
+    arrays = {}
+    for name, (dtype, shape, offset) in index["arrays"].items():
+        dtype = np.dtype(dtype)
+        size = math.prod(shape) * dtype.itemsize
+        arrays[name] = data[start + offset:start + offset + size].view(dtype).reshape(shape)
+
+    textures = [read_texture(texture, pathlib.Path()) for texture in index["textures"]]
+    materials = [Material(textures[material["albedo"]],
+                          specular_reflectivity=Vector(*material["specular_reflectivity"]),
+                          diffuse_reflectivity=Vector(*material["diffuse_reflectivity"]),
+                          interacts_with_light=material["interacts_with_light"]) for material in index["materials"]]
+
+    def get_rows(name):
+        return zip(arrays[name].tolist(), (materials[material] for material in arrays[f"{name}.materials"].tolist()))
+
+    def get_vectors(row):
+        return [Vector(*row[start:start + 3]) for start in range(0, len(row), 3)]
+
+    spheres = [Sphere(Vector(*row[:3]), row[3], material) for row, material in get_rows("spheres")]
+    planes = [Plane(Vector(*row[:3]), row[3], material) for row, material in get_rows("planes")]
+    triangles = []
+    for row, material in get_rows("triangles"):
+        t1, t2, t3, facing = get_vectors(row)
+        triangles.append(Triangle(t1, t2, t3, material, facing))
+    rectangles = []
+    for row, material in get_rows("rectangles"):
+        t1, t2, t3, t4, facing1, facing2 = get_vectors(row)
+        rectangles.append(Rectangle.from_triangles(Triangle(t1, t2, t3, material, facing1), Triangle(t2, t3, t4, material, facing2)))
+    meshes = [TriangleMesh(*(arrays.get(f"mesh{mesh}.{name}") for name in MESH_ARRAYS[:2]), materials[material],
+                           **{name: arrays.get(f"mesh{mesh}.{name}") for name in MESH_ARRAYS[2:]})
+              for mesh, material in enumerate(index["meshes"])]
+    primitive_sets = [PrimitiveSet(arrays[f"primitiveset{primitive_set}.kinds"], arrays[f"primitiveset{primitive_set}.values"], materials[material],
+                                   nodes=get_prefixed(arrays, f"primitiveset{primitive_set}.nodes."))
+                      for primitive_set, material in enumerate(index["primitive_sets"])]
+
+    kinds = {SPHERE: spheres, PLANE: planes, TRIANGLE: triangles, RECTANGLE: rectangles, MESH: meshes, PRIMITIVE_SET: primitive_sets}
+    objects = [kinds[kind][position] for kind, position in arrays["objects"].tolist()]
+
+    lights = [PointLightSource(Vector(*row[0:3]), get_color(row[3:7]), radius=row[7],
+                               render_in_picture=bool(row[8]), emit_light=bool(row[9])) for row in arrays["lights"].tolist()]
+
+    camera = index["camera"]
+    bvh_arrays = get_prefixed(arrays, "bvh.")
+    return Scene(objects, lights,
+                 Camera(Vector(*camera["origin"]), tuple(camera["rotation"]), viewplane_distance=camera["viewplane_distance"],
+                        viewplane_size=tuple(camera["viewplane_size"]), viewport_size=tuple(viewport_size or camera["viewport_size"])),
+                 ambient_light_intensity=get_color(index["ambient"]),
+                 gamma=index["gamma"],
+                 light_samples=index["light_samples"],
+                 bvh_arrays=bvh_arrays)
+
+
+def is_cache_valid(cache: pathlib.Path, source: os.PathLike):
+    if not cache.exists():
+        return False
+
+    try:
+        index, _ = read_index(np.memmap(cache, mode="r"))
+        # The scene file comes first. Editing it changes its own entry, so the references listed after it are
+        # checked without parsing it again. A missing source fails again in read_scene, with its own error.
+        key = index["source"]
+        return bool(key) and key[0][0] == str(pathlib.Path(source).resolve()) and get_status([path for path, _, _ in key]) == key
+    except Exception:
+        return False
+
+
+def load_scene(path: os.PathLike, viewport_size=None, cache=True) -> Scene:
+    """Loads a JSON scene file or a compiled scene. JSON files are compiled next to themselves on the first load,
+    later loads use the compiled file until the JSON file changes."""
+    path = pathlib.Path(path)
+    if path.suffix == SUFFIX:
+        return load_compiled(path, viewport_size)
+
+    cache_path = get_cache_path(path)
+    if cache and is_cache_valid(cache_path, path):
+        return load_compiled(cache_path, viewport_size)
+
+    scene = read_scene(path)
+    if cache:
+        compile_scene(scene, cache_path, source=path)
+        # Loaded back, so the first load renders with the same grouped objects as the later ones
+        return load_compiled(cache_path, viewport_size)
+    if viewport_size is not None:
+        scene.camera.viewport_size = tuple(viewport_size)
+    return scene
@@ -0,0 +1,275 @@
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import traceback
+from multiprocessing import resource_tracker
+
+import numpy as np
+
+from framebuffer import SharedFramebuffer
+from scene.gbuffer import CHANNELS, GBuffer
+from stats import RenderStats, instrumented, timed
+
+
+def get_tiles(width, height, tile_size):
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            yield x, y, min(x + tile_size, width), min(y + tile_size, height)
+
+
+def attach(attached, name, size, **kwargs):
+    if attached is not None and attached.name == name:
+        return attached
+
+    if attached is not None:
+        attached.close()
+    return SharedFramebuffer(*size, name=name, **kwargs)
+
+
+def work(scene, control, tasks, results, cancelled):
+    scene = pickle.loads(scene)
+    version = 0
+    framebuffer = None
+    gbuffer_memory = None
+
+    while (task := tasks.get()) is not None:
+        frame, task_version, tile, bounces, engine, target, gbuffer_target, collect_stats = task
+        if frame <= cancelled.value:
+            continue
+
+        try:
+            while version < task_version:
+                version, attributes = control.get()
+                for name, value in attributes.items():
+                    setattr(scene, name, value)
+
+            stats = RenderStats() if collect_stats else None
+            with instrumented(scene, stats):
+                if gbuffer_target is None:
+                    pixels = scene.trace_tile(*tile, bounces, engine=engine)
+                else:
+                    name, reuse = gbuffer_target
+                    gbuffer_memory = attach(gbuffer_memory, name, scene.camera.viewport_size, channels=CHANNELS, dtype=np.float64)
+                    pixels = scene.trace_tile(*tile, bounces, engine=engine, gbuffer=GBuffer(gbuffer_memory.array), reuse=reuse)
+
+            if target is None:
+                results.put((frame, tile, pixels, None, stats))
+                continue
+
+            with timed(stats, "output"):
+                framebuffer = attach(framebuffer, target, scene.camera.viewport_size)
+                framebuffer.write(*tile, pixels)
+            results.put((frame, tile, None, None, stats))
+        except Exception:
+            results.put((frame, tile, None, traceback.format_exc(), None))
+
+    for attached in (framebuffer, gbuffer_memory):
+        if attached is not None:
+            attached.close()
+
+
+class RenderSession:
+    # Attributes that are compared against the workers before every frame
+    SYNCED = ("camera", "shadows")
+
+    def __init__(self, scene, workers=None, start_method=None, tile_size=16):
+        self.scene = scene
+        self.workers = workers or os.cpu_count()
+        self.tile_size = tile_size
+
+        self.__context = multiprocessing.get_context(start_method)
+        self.__tasks = self.__context.Queue()
+        self.__results = self.__context.Queue()
+        self.__controls = [self.__context.Queue() for _ in range(self.workers)]
+        self.__cancelled = self.__context.Value("q", -1)
+
+        self.framebuffers = {}
+        self.gbuffers = {}
+
+        self.__frames = itertools.count()
+        self.__frame = -1
+        # Remaining tiles of every frame queued with submit
+        self.__pending = {}
+        self.__version = 0
+        self.__synced = {name: self.__get_state(name) for name in self.SYNCED}
+
+        # Forked workers have to share the tracker of the session, otherwise they unlink its framebuffers on exit
+        resource_tracker.ensure_running()
+
+        pickled = pickle.dumps(scene)
+        self.__processes = [self.__context.Process(target=work, args=(pickled, control, self.__tasks, self.__results, self.__cancelled), daemon=True)
+                            for control in self.__controls]
+        for process in self.__processes:
+            process.start()
+
+    def __enter__(self):
+        return self
+
+    def update(self, **attributes):
+        self.__version += 1
+        for name, value in attributes.items():
+            setattr(self.scene, name, value)
+
+        for control in self.__controls:
+            control.put((self.__version, attributes))
+
+        for name in attributes:
+            self.__synced[name] = self.__get_state(name)
+
+    def __get_state(self, name):
+        value = getattr(self.scene, name)
+        if hasattr(value, "get_viewplane_key"):
+            return value, value.get_viewplane_key()
+
+        return value
+
+    def __sync(self):
+        changed = {name: getattr(self.scene, name) for name, state in self.__synced.items()
+                   if state != self.__get_state(name)}
+        if changed:
+            self.update(**changed)
+
+    def __get_framebuffer(self):
+        size = tuple(self.scene.camera.viewport_size)
+        if size not in self.framebuffers:
+            self.framebuffers[size] = SharedFramebuffer(*size)
+
+        return self.framebuffers[size]
+
+    def __get_gbuffer(self):
+        size = tuple(self.scene.camera.viewport_size)
+        if size not in self.gbuffers:
+            self.gbuffers[size] = SharedFramebuffer(*size, channels=CHANNELS, dtype=np.float64), None
+
+        return self.gbuffers[size]
+
+    def cancel(self):
+        self.__cancelled.value = self.__frame
+        self.__pending.clear()
+
+    def __run(self, bounces, engine, target=None, use_gbuffer=False, stats: RenderStats = None, tiles=None):
+        if self.__pending:
+            raise Exception("Submitted frames are still pending!")
+        self.__sync()
+
+        width, height = self.scene.camera.viewport_size
+        frame = self.__frame = next(self.__frames)
+
+        gbuffer_target = None
+        if use_gbuffer:
+            memory, stored_key = self.__get_gbuffer()
+            key = self.scene.get_gbuffer_key()
+            reuse = stored_key == key
+            gbuffer_target = (memory.name, reuse)
+            # Only a completed frame makes the stored hits valid again
+            self.gbuffers[memory.width, memory.height] = memory, key if reuse else None
+
+        tiles = list(get_tiles(width, height, self.tile_size) if tiles is None else tiles)
+        for tile in tiles:
+            self.__tasks.put((frame, self.__version, tile, bounces, engine, target, gbuffer_target, stats is not None))
+
+        remaining = len(tiles)
+        while remaining:
+            result_frame, tile, pixels, error, tile_stats = self.__get_result()
+            if result_frame != frame:
+                continue
+
+            remaining -= 1
+            if error is not None:
+                raise Exception(f"Tracing tile {tile} failed:\n{error}")
+            if stats is not None:
+                stats.merge(tile_stats)
+
+            yield tile, pixels
+
+        if use_gbuffer:
+            self.gbuffers[memory.width, memory.height] = memory, key
+
+    def __get_result(self):
+        while True:
+            try:
+                return self.__results.get(timeout=1)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.__processes):
+                    raise Exception("A render worker died!")
+
+    def submit(self, bounces, engine="ray") -> int:
+        """Queues a frame of the current scene without waiting for it and returns its number. Frames queue behind
+        each other, so workers move on to the next frame while the last tiles of the previous one finish."""
+        self.__sync()
+
+        width, height = self.scene.camera.viewport_size
+        frame = self.__frame = next(self.__frames)
+
+        tiles = list(get_tiles(width, height, self.tile_size))
+        for tile in tiles:
+            self.__tasks.put((frame, self.__version, tile, bounces, engine, None, None, False))
+
+        self.__pending[frame] = len(tiles)
+        return frame
+
+    def next_tile(self):
+        """Waits for the next tile of any submitted frame, returns (frame, tile, colors, remaining tiles of the frame)."""
+        while self.__pending:
+            frame, tile, pixels, error, _ = self.__get_result()
+            if frame not in self.__pending:
+                continue
+            if error is not None:
+                raise Exception(f"Tracing tile {tile} of frame {frame} failed:\n{error}")
+
+            self.__pending[frame] -= 1
+            remaining = self.__pending[frame]
+            if not remaining:
+                del self.__pending[frame]
+
+            return frame, tile, pixels, remaining
+
+        raise Exception("No frames are pending!")
+
+    def trace(self, bounces, engine="ray", gbuffer=False, stats: RenderStats = None):
+        width, height = self.scene.camera.viewport_size
+        pixels = [None] * (width * height)
+
+        for (x0, y0, x1, y1), colors in self.__run(bounces, engine, use_gbuffer=gbuffer, stats=stats):
+            with timed(stats, "output"):
+                tile_width = x1 - x0
+                for row in range(y1 - y0):
+                    start = (y0 + row) * width + x0
+                    pixels[start:start + tile_width] = colors[row * tile_width:(row + 1) * tile_width]
+
+        return pixels
+
+    def trace_tiles(self, bounces, tiles, engine="ray", stats: RenderStats = None):
+        """Yields (tile, colors) for the given tiles as they finish, nothing is kept for the whole viewport."""
+        yield from self.__run(bounces, engine, stats=stats, tiles=tiles)
+
+    def render_tiles(self, bounces, engine="ray", gbuffer=False, stats: RenderStats = None):
+        framebuffer = self.__get_framebuffer()
+        for tile, _ in self.__run(bounces, engine, framebuffer.name, use_gbuffer=gbuffer, stats=stats):
+            yield framebuffer, tile
+
+    def render(self, bounces, engine="ray", gbuffer=False, stats: RenderStats = None) -> SharedFramebuffer:
+        framebuffer = self.__get_framebuffer()
+        for _ in self.render_tiles(bounces, engine, gbuffer, stats):
+            pass
+
+        return framebuffer
+
+    def close(self):
+        for _ in self.__processes:
+            self.__tasks.put(None)
+        for process in self.__processes:
+            process.join()
+
+        for framebuffer in self.framebuffers.values():
+            framebuffer.close()
+        self.framebuffers.clear()
+
+        for memory, _ in self.gbuffers.values():
+            memory.close()
+        self.gbuffers.clear()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
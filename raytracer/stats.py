@@ -0,0 +1,172 @@
+import collections
+import contextlib
+import time
+
+import numpy as np
+
+
+class RenderStats:
+    def __init__(self, counts=None, times=None):
+        self.counts = collections.Counter(counts or {})
+        self.times = collections.defaultdict(float, times or {})
+
+    def count(self, name, amount=1):
+        self.counts[name] += amount
+
+    @contextlib.contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+
+    def merge(self, other: "RenderStats"):
+        self.counts.update(other.counts)
+        for name, seconds in other.times.items():
+            self.times[name] += seconds
+        return self
+
+    def __add__(self, other):
+        return RenderStats(self.counts, self.times).merge(other)
+
+    def __eq__(self, other):
+        return isinstance(other, RenderStats) and self.counts == other.counts and self.times == other.times
+
+    def __getstate__(self):
+        return dict(self.counts), dict(self.times)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __str__(self):
+        lines = [f"{name:40} {count}" for name, count in sorted(self.counts.items())]
+        lines += [f"{name + ' time':40} {seconds:.3f} s" for name, seconds in sorted(self.times.items())]
+        return "\n".join(lines)
+
+
+def timed(stats, name):
+    return stats.time(name) if stats is not None else contextlib.nullcontext()
+
+
+def instrumented(scene, stats):
+    return Instrumentation(scene, stats) if stats is not None else contextlib.nullcontext()
+
+
+class Instrumentation:
+    """Wraps methods of one scene, its objects, light proxies and textures on the instances while active.
+    Nothing is wrapped outside of the with block, so rendering without stats runs the plain methods."""
+
+    def __init__(self, scene, stats: RenderStats):
+        self.scene = scene
+        self.stats = stats
+        self.wrapped = []
+        self.shading_depth = 0
+
+    def wrap(self, instance, name, wrapper):
+        self.wrapped.append((instance, name))
+        setattr(instance, name, wrapper(getattr(instance, name)))
+
+    def __enter__(self):
+        scene, stats = self.scene, self.stats
+
+        def trace_tile(method):
+            def wrapped(x0, y0, x1, y1, *args, **kwargs):
+                stats.count("rays.primary", (x1 - x0) * (y1 - y0))
+                with stats.time("tracing"):
+                    return method(x0, y0, x1, y1, *args, **kwargs)
+            return wrapped
+
+        def do_raycast(method):
+            def wrapped(*args, **kwargs):
+                if self.shading_depth:
+                    stats.count("rays.reflection")
+                return method(*args, **kwargs)
+            return wrapped
+
+        def occluded(method):
+            def wrapped(*args, **kwargs):
+                stats.count("rays.shadow")
+                return method(*args, **kwargs)
+            return wrapped
+
+        def shade(method):
+            def wrapped(*args, **kwargs):
+                # Reflections shade recursively, only the outermost call is timed so nothing is counted twice
+                self.shading_depth += 1
+                try:
+                    if self.shading_depth > 1:
+                        return method(*args, **kwargs)
+                    with stats.time("shading"):
+                        return method(*args, **kwargs)
+                finally:
+                    self.shading_depth -= 1
+            return wrapped
+
+        def calculate_viewplane(method):
+            def wrapped():
+                with stats.time("viewplane"):
+                    return method()
+            return wrapped
+
+        self.wrap(scene, "trace_tile", trace_tile)
+        self.wrap(scene, "do_raycast", do_raycast)
+        self.wrap(scene, "occluded", occluded)
+        self.wrap(scene, "shade", shade)
+        self.wrap(scene.camera, "calculate_viewplane", calculate_viewplane)
+
+        for object in {id(object): object for object in [*scene.objects, *scene.get_light_objects()]}.values():
+            self.wrap_object(object)
+
+        textures = {id(object.material.albedo): object.material.albedo for object in scene.objects if object.material is not None}
+        for texture in textures.values():
+            self.wrap(texture, "get_color", self.counter(f"texture_lookups.{type(texture).__name__}"))
+
+        return stats
+
+    def counter(self, name):
+        def wrapper(method):
+            def wrapped(*args, **kwargs):
+                self.stats.count(name)
+                return method(*args, **kwargs)
+            return wrapped
+        return wrapper
+
+    def wrap_object(self, object):
+        stats = self.stats
+        prefix = type(object).__name__
+
+        def get_intersection(method):
+            def wrapped(ray):
+                stats.count(f"{prefix}.tests")
+                intersection = method(ray)
+                if intersection:
+                    stats.count(f"{prefix}.hits")
+                return intersection
+            return wrapped
+
+        def occluded(method):
+            def wrapped(ray, max_distance):
+                stats.count(f"{prefix}.occlusion_tests")
+                blocked = method(ray, max_distance)
+                if blocked:
+                    stats.count(f"{prefix}.occlusion_hits")
+                return blocked
+            return wrapped
+
+        def get_hits(method):
+            def wrapped(origins, directions, normalized=False):
+                distances, vertices = method(origins, directions, normalized)
+                stats.count(f"{prefix}.tests", len(distances))
+                stats.count(f"{prefix}.hits", int(np.isfinite(distances).sum()))
+                return distances, vertices
+            return wrapped
+
+        self.wrap(object, "get_intersection", get_intersection)
+        self.wrap(object, "occluded", occluded)
+        self.wrap(object, "get_hits", get_hits)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for instance, name in reversed(self.wrapped):
+            delattr(instance, name)
+        self.wrapped.clear()
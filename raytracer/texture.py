@@ -1,17 +1,90 @@
 import os
 import pathlib
-from abc import ABC, abstractmethod
 
+import numpy as np
 from PIL import Image
 
-from geometry.vector import Vector
-from visual import Color
 
+def downsample(texels: np.ndarray) -> np.ndarray:
+    height, width = texels.shape[:2]
+    # Odd edges are repeated so every texel ends up in a 2x2 box
+    padded = np.pad(texels, ((0, height % 2), (0, width % 2), (0, 0)), mode="edge")
+    return (padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2]) / 4
 
 
-#
-# if __name__ == "__main__":
-#     # print(PIL.__version__)
-#     t = ImageTexture(pathlib.Path("/home/kaappo/git/raytracer/raytracer/res/texture1.png"))
-#     print(t.get_color())
+class MipMap:
+    def __init__(self, texels: np.ndarray):
+        self.levels = [np.ascontiguousarray(texels, dtype=np.float32)]
+        while max(self.levels[-1].shape[:2]) > 1:
+            self.levels.append(downsample(self.levels[-1]))
 
+    @property
+    def size(self):
+        height, width = self.levels[0].shape[:2]
+        return width, height
+
+    def get_level(self, footprints) -> np.ndarray:
+        # A footprint is the extent in UV units one ray covers, a level halves the resolution per doubling
+        texels = np.maximum(np.asarray(footprints, dtype=float) * max(self.size), 1)
+        return np.minimum(np.floor(np.log2(texels)).astype(int), len(self.levels) - 1)
+
+    def sample_nearest(self, uvs: np.ndarray, level=0) -> np.ndarray:
+        texels = self.levels[level]
+        height, width = texels.shape[:2]
+
+        # Truncation instead of flooring matches the indexing of the scalar ImageTexture.get_color
+        i = np.clip(np.trunc(uvs[:, 0] * width).astype(int), 0, width - 1)
+        j = np.clip(np.trunc(uvs[:, 1] * height).astype(int), 0, height - 1)
+        return texels[j, i]
+
+    def sample_bilinear(self, uvs: np.ndarray, level=0) -> np.ndarray:
+        texels = self.levels[level]
+        height, width = texels.shape[:2]
+
+        x = np.clip(uvs[:, 0] * width - 0.5, 0, width - 1)
+        y = np.clip(uvs[:, 1] * height - 0.5, 0, height - 1)
+        i0, j0 = x.astype(int), y.astype(int)
+        i1, j1 = np.minimum(i0 + 1, width - 1), np.minimum(j0 + 1, height - 1)
+        fx, fy = (x - i0)[:, np.newaxis], (y - j0)[:, np.newaxis]
+
+        top = texels[j0, i0] * (1 - fx) + texels[j0, i1] * fx
+        bottom = texels[j1, i0] * (1 - fx) + texels[j1, i1] * fx
+        return top * (1 - fy) + bottom * fy
+
+    def sample(self, uvs: np.ndarray, footprints=None, bilinear=False) -> np.ndarray:
+        """Looks up (N,2) UVs at once, each in the level its footprint selects, or in level 0 without footprints."""
+        uvs = np.asarray(uvs, dtype=float).reshape(-1, 2)
+        sample = self.sample_bilinear if bilinear else self.sample_nearest
+        if footprints is None:
+            return sample(uvs)
+
+        levels = np.broadcast_to(self.get_level(footprints), len(uvs))
+        result = np.empty((len(uvs), self.levels[0].shape[2]), dtype=np.float32)
+        for level in np.unique(levels).tolist():
+            selected = levels == level
+            result[selected] = sample(uvs[selected], level)
+
+        return result
+
+
+class TextureStore:
+    def __init__(self):
+        self.__textures = {}
+
+    def __len__(self):
+        return len(self.__textures)
+
+    def load(self, path: os.PathLike) -> MipMap:
+        key = pathlib.Path(path).resolve()
+        if key not in self.__textures:
+            with Image.open(key) as image:
+                # Same scale as the former PixelAccess lookups, which divided the 8 bit channels by 256
+                self.__textures[key] = MipMap(np.asarray(image.convert("RGB"), dtype=np.float32) / 256)
+
+        return self.__textures[key]
+
+    def clear(self):
+        self.__textures.clear()
+
+
+STORE = TextureStore()
@@ -0,0 +1,89 @@
+import json
+import os
+import pathlib
+import time
+from typing import Callable
+
+import numpy as np
+
+from scene.session import RenderSession, get_tiles
+
+
+def get_manifest_path(path: os.PathLike) -> pathlib.Path:
+    return pathlib.Path(f"{path}.json")
+
+
+class TiledRenderer:
+    """Renders into a memory-mapped .npy file on disk, tile by tile, for images that don't fit in memory.
+
+    Completed tiles are checkpointed in a JSON manifest next to the file, a render with the same settings resumes
+    from it and only traces the missing tiles. Only the tiles in flight are held in memory."""
+
+    def __init__(self, session: RenderSession, path: os.PathLike, tile_size=64, checkpoint_interval=10.0):
+        self.session = session
+        self.path = pathlib.Path(path)
+        self.tile_size = tile_size
+        # Seconds between checkpoints, every checkpoint flushes the file and rewrites the manifest
+        self.checkpoint_interval = checkpoint_interval
+
+    def get_settings(self, bounces, engine):
+        width, height = self.session.scene.camera.viewport_size
+        return {"width": width, "height": height, "tile_size": self.tile_size, "bounces": bounces, "engine": engine,
+                "camera": repr(self.session.scene.camera.get_viewplane_key())}
+
+    def load_completed(self, settings):
+        manifest_path = get_manifest_path(self.path)
+        if not self.path.exists() or not manifest_path.exists():
+            return set()
+
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if manifest["settings"] != settings:
+            return set()
+
+        return set(manifest["completed"])
+
+    def save_completed(self, settings, completed, array: np.memmap):
+        # The pixels have to be on disk before the manifest claims their tiles
+        array.flush()
+
+        manifest_path = get_manifest_path(self.path)
+        temporary = manifest_path.with_name(manifest_path.name + ".tmp")
+        with open(temporary, "w") as file:
+            json.dump({"settings": settings, "completed": sorted(completed)}, file)
+        os.replace(temporary, manifest_path)
+
+    def render(self, bounces, engine="ray", progress: Callable[[int, int], None] = lambda done, total: None) -> np.memmap:
+        width, height = self.session.scene.camera.viewport_size
+        settings = self.get_settings(bounces, engine)
+        tiles = list(get_tiles(width, height, self.tile_size))
+
+        completed = self.load_completed(settings)
+        if completed:
+            array = np.lib.format.open_memmap(self.path, mode="r+")
+        else:
+            array = np.lib.format.open_memmap(self.path, mode="w+", dtype=np.float32, shape=(height, width, 3))
+            self.save_completed(settings, completed, array)
+
+        indices = {tile: index for index, tile in enumerate(tiles)}
+        missing = [tile for index, tile in enumerate(tiles) if index not in completed]
+        progress(len(completed), len(tiles))
+
+        checkpoint = time.monotonic()
+        try:
+            for tile, colors in self.session.trace_tiles(bounces, missing, engine):
+                x0, y0, x1, y1 = tile
+                array[y0:y1, x0:x1] = np.array([tuple(color) for color in colors], dtype=np.float32).reshape(y1 - y0, x1 - x0, 3)
+                completed.add(indices[tile])
+                progress(len(completed), len(tiles))
+
+                if time.monotonic() - checkpoint >= self.checkpoint_interval:
+                    self.save_completed(settings, completed, array)
+                    checkpoint = time.monotonic()
+        except BaseException:
+            self.session.cancel()
+            raise
+        finally:
+            self.save_completed(settings, completed, array)
+
+        return array
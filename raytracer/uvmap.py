@@ -3,6 +3,8 @@ from __future__ import  annotations
 import math
 from abc import ABC, abstractmethod
 
+import numpy as np
+
 import geometry
 from geometry.vector import Vector
 
@@ -12,6 +14,11 @@ class UVMap(ABC):
     def get_uv(self, xyz: Vector) -> Vector:
         pass
 
+    def get_uvs(self, points: np.ndarray) -> np.ndarray:
+        # Maps (N,3) points to (N,3) UVs, subclasses with a closed form replace the loop
+        return np.array([tuple(self.get_uv(Vector(*point))) for point in np.asarray(points, dtype=float).tolist()],
+                        dtype=float).reshape(-1, 3)
+
 
 class UVMapSphere(UVMap):
     def __init__(self, sphere: geometry.Sphere):
@@ -30,27 +37,34 @@ class UVMapTriangle(UVMap):
     def __init__(self, triangle: geometry.Triangle):
         self.triangle = triangle
 
-    def get_uv(self, xyz: Vector) -> Vector:
-        t1 = self.triangle.t1
-        t2 = self.triangle.t2
-        t3 = self.triangle.t3
-
+        t1 = triangle.t1
+        t2 = triangle.t2
+        t3 = triangle.t3
 
-        tangent = t3 - t1
-        normal = self.triangle.get_normal_at(xyz)
-        bitangent = tangent @ normal
+        # Corners on one line span no plane, the basis below would be singular
+        if not triangle.plane.normal ** 2 > 0:
+            raise Exception(f"Triangle {t1}, {t2}, {t3} is degenerate, its UV basis is singular!")
 
-        width = tangent
+        # The normal of a triangle is the same everywhere, so the basis only depends on the corners
+        width = t3 - t1
         height = t2 - t1 - ((width * t2 - width * t1) / width ** 2) * width
+        normal = triangle.get_normal_at(t1).normalize()
+
+        self.origin = np.array(tuple(t1), dtype=float)
+        self.rows = np.linalg.inv(np.array([tuple(width), tuple(height), tuple(normal)], dtype=float).T).tolist()
 
-        i = width
-        j = height
-        k = normal.normalize()
+    def get_uv(self, xyz: Vector) -> Vector:
+        t1 = self.triangle.t1
+        x, y, z = xyz.i - t1.i, xyz.j - t1.j, xyz.k - t1.k
 
-        local_xyz = xyz - t1
+        (a, b, c), (d, e, f), (g, h, i) = self.rows
+        return Vector(a * x + b * y + c * z, d * x + e * y + f * z, g * x + h * y + i * z)
 
-        # u, v, _ = local_xyz.in_terms_of_components(i, j, k)
-        return local_xyz.in_terms_of_components(i, j, k)
+    def get_uvs(self, points: np.ndarray) -> np.ndarray:
+        # Spelled out like get_uv instead of a matrix product, so both give the same floats
+        x, y, z = (np.asarray(points, dtype=float) - self.origin).T
+        (a, b, c), (d, e, f), (g, h, i) = self.rows
+        return np.stack([a * x + b * y + c * z, d * x + e * y + f * z, g * x + h * y + i * z], axis=-1)
 
         # print(u, v, _)
         # print(i.normalize(), j.normalize())
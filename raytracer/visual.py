@@ -6,33 +6,54 @@ import os
 from abc import ABC, abstractmethod
 from typing import List, Union
 
-from PIL import Image
-# from PIL.Image import Image
+import numpy as np
 
 from geometry.vector import Vector
+from texture import STORE, TextureStore
 
 
 class ColorBlend:
+    # The legacy blend summed its colors onto Color(0, 0, 0), whose gamma of 2.2 makes the sum non-linear:
+    # every addition raises the running sum to its gamma and takes the square root of that gamma.
+    # The running state below reproduces this fold exactly without keeping the colors around. The fold can't be
+    # reordered, so every add still costs three powers.
+    SEED_GAMMA = 2.2
+
     def __init__(self, initialColors: List[Color]=None):
-        if initialColors is None:
-            initialColors = []
+        self.r = self.g = self.b = 0
+        self.gamma = ColorBlend.SEED_GAMMA
+        self.count = 0
 
-        # print(initialColors)
-        self.colors = initialColors
-        # print("Moiasdasdas")
+        for color in initialColors or []:
+            self.add(color)
 
     def add(self, color: Union[Color, ColorBlend]):
         if isinstance(color, ColorBlend):
-            print(color)
-            self.colors.extend(color.colors)
+            self.__merge(color)
         elif isinstance(color, Color):
-            self.colors.append(color)
+            applied = color.apply_gamma()
+            if self.gamma == 1:
+                self.r, self.g, self.b = self.r + applied.r, self.g + applied.g, self.b + applied.b
+            elif not self.count:
+                # The seed is black and 0 ** gamma is 0
+                self.r, self.g, self.b = applied.r, applied.g, applied.b
+                self.gamma = math.sqrt(self.gamma)
+            else:
+                gamma = self.gamma
+                self.r, self.g, self.b = self.r ** gamma + applied.r, self.g ** gamma + applied.g, self.b ** gamma + applied.b
+                self.gamma = math.sqrt(gamma)
+            self.count += 1
         else:
             raise Exception()
 
+    def __merge(self, other: ColorBlend):
+        if self.count:
+            raise Exception("Blends can only be merged into empty blends!")
+        self.r, self.g, self.b, self.gamma = other.r, other.g, other.b, other.gamma
+        self.count += other.count
 
     def blend(self, gamma=1) -> Color:
-        return sum(map(Color.apply_gamma, self.colors), Color(0, 0, 0)).apply_gamma(gamma)
+        return Color(self.r, self.g, self.b, gamma=self.gamma).apply_gamma(gamma)
 
 
 class Color:
@@ -120,36 +141,47 @@ class Intensity(Color):
 
 
 class Texture(ABC):
+    # Whether get_color uses the footprint, shading only estimates it for these textures
+    mipmapped = False
+
     @abstractmethod
-    def get_color(self, uv: Vector) -> Intensity:
+    def get_color(self, uv: Vector, footprint=0.0) -> Intensity:
         pass
 
 
 class ImageTexture(Texture):
-    def __init__(self, path: os.PathLike, gamma=0.5):
-        self.image = Image.open(path)
-        # print(self.image.format)
-        # print(self.image.size)
-        # print(self.image.mode)
-        self.pixels = self.image.load()
-        self.size = self.image.size
-        # self.size = Vector(size[0], size[1], 0)
-        print(self.pixels[0, 100])
+    mipmapped = True
+
+    def __init__(self, path: os.PathLike, gamma=0.5, store: TextureStore = None):
+        self.path = path
+        # Textures loaded from the same file share one decoded MipMap
+        self.mipmap = (STORE if store is None else store).load(path)
+        self.texels = self.mipmap.levels[0]
+        self.size = self.mipmap.size
         self.gamma = gamma
 
-    def get_color(self, uv: Vector) -> Intensity:
-        i = int(uv.u * self.size[0])
-        j = int(uv.v * self.size[1])
+    def get_color(self, uv: Vector, footprint=0.0) -> Intensity:
+        # A footprint of less than two texels reads level 0, like the lookups without mipmaps did
+        texels = self.texels
+        if footprint * max(self.size) >= 2:
+            texels = self.mipmap.levels[int(self.mipmap.get_level(footprint))]
+
+        height, width = texels.shape[:2]
+        i = int(uv.u * width)
+        j = int(uv.v * height)
+
+        return Intensity(*texels[j, i].tolist())
 
-        r, g, b, *_ = self.pixels[i, j]
+    def get_colors(self, uvs: np.ndarray, footprints=None, bilinear=False) -> np.ndarray:
+        # Batched lookup of (N,2) UVs, nearest sampling returns the texels of get_color
+        return self.mipmap.sample(uvs, footprints, bilinear)
 
-        return Intensity(r / 256, g / 256, b / 256)
 
 class SolidTexture(Texture):
     def __init__(self, color: Intensity):
         self.color = color
 
-    def get_color(self, uv: Vector) -> Intensity:
+    def get_color(self, uv: Vector, footprint=0.0) -> Intensity:
         return self.color
 
 
@@ -0,0 +1,144 @@
+import os
+import pathlib
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from framebuffer import encode_24_bit
+
+# Rows encoded at once by the writers that stream a framebuffer, e.g. a memory-mapped one that doesn't fit in memory
+BAND_SIZE = 256
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def write_png(path: os.PathLike, array: np.ndarray, gamma=2):
+    # Any format PIL knows by the suffix works, PNG keeps the 8 bit result lossless
+    Image.fromarray(encode_24_bit(array, gamma)).save(path)
+
+
+def write_png_chunk(file, kind: bytes, data: bytes):
+    file.write(struct.pack(">I", len(data)))
+    file.write(kind + data)
+    file.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+
+def write_png_bands(path: os.PathLike, array: np.ndarray, gamma=2):
+    """Writes the same 8 bit RGB PNG as write_png, encoded and compressed a band of rows at a time."""
+    height, width = array.shape[:2]
+    compressor = zlib.compressobj()
+    with open(path, "wb") as file:
+        file.write(PNG_SIGNATURE)
+        write_png_chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+        for start in range(0, height, BAND_SIZE):
+            band = encode_24_bit(array[start:start + BAND_SIZE], gamma).reshape(-1, width * 3)
+            # Every scanline starts with its filter type, 0 stores it as is
+            scanlines = np.hstack([np.zeros((len(band), 1), dtype=np.uint8), band])
+            if data := compressor.compress(scanlines.tobytes()):
+                write_png_chunk(file, b"IDAT", data)
+
+        write_png_chunk(file, b"IDAT", compressor.flush())
+        write_png_chunk(file, b"IEND", b"")
+
+
+def write_pfm(path: os.PathLike, array: np.ndarray):
+    height, width = array.shape[:2]
+    with open(path, "wb") as file:
+        # A negative scale marks little endian data, rows are stored bottom to top
+        file.write(f"PF\n{width} {height}\n-1.0\n".encode())
+        for stop in range(height, 0, -BAND_SIZE):
+            file.write(np.ascontiguousarray(array[max(stop - BAND_SIZE, 0):stop][::-1], dtype="<f4").tobytes())
+
+
+def read_pfm(path: os.PathLike) -> np.ndarray:
+    with open(path, "rb") as file:
+        kind = file.readline().strip()
+        width, height = map(int, file.readline().split())
+        scale = float(file.readline())
+        data = np.frombuffer(file.read(), dtype="<f4" if scale < 0 else ">f4")
+
+    channels = 3 if kind == b"PF" else 1
+    return data.reshape(height, width, channels)[::-1].astype(np.float32)
+
+
+def write_npy(path: os.PathLike, array: np.ndarray):
+    np.save(path, array)
+
+
+WRITERS = {".pfm": write_pfm, ".npy": write_npy}
+BAND_SUFFIXES = (".png", ".pfm")
+
+
+def write_image(path: os.PathLike, array: np.ndarray, gamma=2):
+    """Writes a linear float (H,W,3) framebuffer. .pfm and .npy keep the float data, everything else is tonemapped."""
+    writer = WRITERS.get(pathlib.Path(path).suffix.lower())
+    if writer is None:
+        write_png(path, array, gamma)
+    else:
+        writer(path, array)
+
+
+def write_image_bands(path: os.PathLike, array: np.ndarray, gamma=2):
+    """Writes a framebuffer too large for memory, e.g. of a tiled render, a band of rows at a time. Only the
+    BAND_SUFFIXES are supported, other formats would need the whole image in memory."""
+    suffix = pathlib.Path(path).suffix.lower()
+    if suffix == ".png":
+        write_png_bands(path, array, gamma)
+    elif suffix == ".pfm":
+        write_pfm(path, array)
+    else:
+        raise Exception(f"Can't write {path} a band at a time, use one of {', '.join(BAND_SUFFIXES)}!")
+
+
+class ImageWriter:
+    """Writes images on a background thread, so encoding overlaps with tracing the next frame.
+    Errors of a write are raised by the next call to write, flush or close."""
+
+    def __init__(self, gamma=2, max_pending=2):
+        self.gamma = gamma
+        # Bounded, so a slow disk holds up rendering instead of piling up frames in memory
+        self.__queue = queue.Queue(max_pending)
+        self.__error = None
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        while (job := self.__queue.get()) is not None:
+            path, array = job
+            try:
+                write_image(path, array, self.gamma)
+            except Exception as error:
+                self.__error = error
+            finally:
+                self.__queue.task_done()
+        self.__queue.task_done()
+
+    def __raise_error(self):
+        error, self.__error = self.__error, None
+        if error is not None:
+            raise error
+
+    def write(self, path: os.PathLike, array: np.ndarray):
+        self.__raise_error()
+        # Copied, shared framebuffers are overwritten by the next frame
+        self.__queue.put((path, np.array(array)))
+
+    def flush(self):
+        self.__queue.join()
+        self.__raise_error()
+
+    def close(self):
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+        self.__raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -3,12 +3,47 @@
 """Tests for `raytracer` package."""
 
 
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import threading
 import unittest
+
+import numpy as np
 from click.testing import CliRunner
+from PIL import Image
 
+from benchmarks import scenes as benchmark_scenes
+from benchmarks.run import compare
+from animation import AnimationRenderer, camera_path, zoom_path
 from raytracer import cli
-from geometry.geometry import Triangle
+from distributed import Coordinator, serve
+from framebuffer import SharedFramebuffer, encode_24_bit
+from geometry.bvh import BVH
+from geometry.objloader import load_obj
+from geometry.plane import Plane
+from geometry.primitiveset import PrimitiveSet
+from geometry.ray import Ray
+from geometry.rectangle import Rectangle
+from geometry.sphere import Sphere
+from geometry.triangle import Triangle
+from geometry.trianglemesh import TriangleMesh
 from geometry.vector import Vector
+from progressive import ProgressiveRenderer, upscale
+from sampler import AdaptiveSampler, get_offsets
+from scene.gbuffer import GBuffer
+from scene.scenefile import compile_scene, get_cache_path, is_cache_valid, load_compiled, load_scene
+from scene.scene import Camera, PointLightSource, Scene
+from scene.session import RenderSession, get_tiles
+from stats import Instrumentation, RenderStats
+from texture import MipMap, TextureStore
+from tiled import TiledRenderer, get_manifest_path
+from uvmap import UVMapTriangle
+from visual import Color, ColorBlend, ImageTexture, Material, SolidTexture, Intensity
+from writer import BAND_SIZE, ImageWriter, read_pfm, write_image, write_image_bands
 
 
 class TestRaytracer(unittest.TestCase):
@@ -28,11 +63,22 @@ class TestRaytracer(unittest.TestCase):
         runner = CliRunner()
         result = runner.invoke(cli.main)
         assert result.exit_code == 0
-        assert 'raytracer.cli.main' in result.output
+        assert 'render' in result.output
         help_result = runner.invoke(cli.main, ['--help'])
         assert help_result.exit_code == 0
         assert '--help  Show this message and exit.' in help_result.output
 
+    def test_render_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "image.png")
+            result = CliRunner().invoke(cli.main, ["render", "--width", "8", "--height", "6", "--workers", "2",
+                                                   "--bounces", "1", "--samples", "2", "--output", output])
+            assert result.exit_code == 0, result.output
+            with Image.open(output) as image:
+                assert image.size == (8, 6)
+
+        assert "pygame" not in sys.modules
+
 
 class TestVector(unittest.TestCase):
 
@@ -56,22 +102,988 @@ class TestVector(unittest.TestCase):
         assert Vector(1, 2, 3) @ Vector(1, 5, 7) == Vector(-1, -4, 3)
         assert Vector(-1, -2, 3) @ Vector(4, 0, -8) == Vector(16, 4, 8)
 
+    def test_fused(self):
+        a, b, c = Vector(1, 2, 3), Vector(-2, 0, 5), Vector(3, -1, 2)
+        assert a.sub_dot(b, c) == (a - b) * c
+        assert a.scaled_add(b, 3) == a + 3 * b
+        assert a.distance_squared(b) == (a - b) ** 2
+        assert -a == Vector(-1, -2, -3)
+
 
 class TestTriangle(unittest.TestCase):
 
     def test_intersect_fine(self):
         t = Triangle(Vector(1, 0, 0),
                      Vector(0, 1, 0),
-                     Vector(0, 0, 1))
+                     Vector(0, 0, 1),
+                     None)
 
         assert t.contains(Vector(0.28, 0.23, 0.49))
 
     def test_intersect_coarse(self):
         t = Triangle(Vector(1, 0, 0),
                      Vector(0, 1, 0),
-                     Vector(0, 0, 1))
+                     Vector(0, 0, 1),
+                     None)
 
         v = Vector(-0.14, 0.52, 0.62)
         assert t.check_coarse(v)
         assert not t.check_fine(v)
 
+    def test_uv(self):
+        t = Triangle(Vector(-5, 6, 5),
+                     Vector(0, 0, 3),
+                     Vector(5, 6, 3),
+                     None)
+
+        width = t.t3 - t.t1
+        height = t.t2 - t.t1 - ((width * t.t2 - width * t.t1) / width ** 2) * width
+        points = [Vector(-0.42, 4.32, 3.8), Vector(-0.72, 2.16, 3.5), Vector(1, 2, 3)]
+
+        for point in points:
+            expected = (point - t.t1).in_terms_of_components(width, height, t.get_normal_at(point))
+            np.testing.assert_allclose(tuple(t.get_uv(point)), tuple(expected), atol=1e-12)
+
+    def test_uvs(self):
+        t = Triangle(Vector(-5, 6, 5), Vector(0, 0, 3), Vector(5, 6, 3), None)
+        points = np.random.default_rng(0).normal(size=(50, 3)) * 5
+
+        assert t.uv_map.get_uvs(points).tolist() == [list(t.get_uv(Vector(*point))) for point in points.tolist()]
+
+        sphere = Sphere(Vector(0, 0, 1), 2, None)
+        np.testing.assert_array_equal(sphere.uv_map.get_uvs(points), [tuple(sphere.get_uv(Vector(*point))) for point in points.tolist()])
+
+    def test_degenerate(self):
+        material = Material(SolidTexture(Intensity(1, 1, 1)))
+        t = Triangle(Vector(0, 0, 0), Vector(1, 1, 1), Vector(2, 2, 2), material)
+
+        with self.assertRaisesRegex(Exception, "degenerate"):
+            UVMapTriangle(t)
+
+        camera = Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(4, 3))
+        scene = Scene([t, Sphere(Vector(0, 0, 1), 1, material)], [PointLightSource(Vector(2, -2, 4), Intensity(1, 1, 1))],
+                      camera)
+        assert len(scene.trace_tile(0, 0, 4, 3, 1)) == 12
+
+
+
+class TestIntersectionDistances(unittest.TestCase):
+
+    def setUp(self):
+        xs, zs = np.meshgrid(np.linspace(-1, 1, 15), np.linspace(-1, 1, 15))
+        self.directions = np.stack([xs.ravel(), np.full(xs.size, 2.0), zs.ravel()], axis=1)
+        self.origins = np.zeros_like(self.directions)
+
+    def check(self, object):
+        distances = object.get_intersection_distances(self.origins, self.directions)
+        for distance, direction in zip(distances, self.directions):
+            intersection = object.get_intersection(Ray(Vector.ORIGIN, Vector(*direction)))
+            if intersection:
+                self.assertAlmostEqual(distance, intersection.distance)
+            else:
+                self.assertEqual(distance, np.inf)
+
+    def test_sphere(self):
+        self.check(Sphere(Vector(0.3, 4, -0.2), 1, None))
+
+    def test_plane(self):
+        self.check(Plane(Vector(0, 0, 1), 0.5, None))
+
+    def test_triangle(self):
+        self.check(Triangle(Vector(-1, 3, -1), Vector(1, 3, -1), Vector(0, 4, 1), None))
+
+
+class TestBVH(unittest.TestCase):
+
+    def setUp(self):
+        material = Material(SolidTexture(Intensity(1, 1, 1)))
+        self.objects = [Sphere(Vector(x, 5 + (x * z) % 3, z), 0.4, material) for x in range(-3, 4) for z in range(-3, 4)]
+        self.objects += [Triangle(Vector(-4, 9, -4), Vector(4, 9, -4), Vector(0, 9, 4), material)]
+        self.bvh = BVH(self.objects)
+
+    def test_closest_intersection(self):
+        for x in np.linspace(-0.6, 0.6, 9):
+            for z in np.linspace(-0.6, 0.6, 9):
+                ray = Ray(Vector.ORIGIN, Vector(x, 1, z).normalize())
+                intersections = [i for object in self.objects if (i := object.get_intersection(ray))]
+                expected = min(intersections, key=lambda intersection: intersection.distance, default=None)
+                closest = self.bvh.get_closest_intersection(ray)
+
+                if expected is None:
+                    assert closest is None
+                else:
+                    assert closest.distance == expected.distance
+                    assert self.bvh.occluded(ray, expected.distance + 0.01)
+                    assert not self.bvh.occluded(ray, expected.distance - 0.01)
+
+    def test_unbounded(self):
+        assert Plane(Vector(0, 0, 1), 0, None).get_bounds() is None
+
+    def test_degenerate(self):
+        # Coincident objects, like duplicated OBJ faces, give SAH nothing to split
+        material = Material(SolidTexture(Intensity(1, 1, 1)))
+        objects = [Sphere(Vector(0, 5, 0), 1, material) for _ in range(5000)]
+        objects += [Sphere(Vector(0, 5 + 0.5 ** index, 0), 0.5 ** index, material) for index in range(200)]
+        bvh = BVH(objects)
+
+        def get_depth(node):
+            return 1 if node.is_leaf() else 1 + max(get_depth(node.left), get_depth(node.right))
+
+        assert get_depth(bvh.root) <= BVH.MAX_DEPTH + 16
+        assert bvh.get_closest_intersection(Ray(Vector.ORIGIN, Vector(0, 1, 0))).distance == 4
+
+    def test_scene_occluded(self):
+        material = Material(SolidTexture(Intensity(1, 1, 1)))
+        light = Material(SolidTexture(Intensity(1, 1, 1)), interacts_with_light=False)
+        camera = Camera(Vector(0, 0, 0), (0, 0), viewport_size=(4, 4))
+        scene = Scene([Plane(Vector(0, 1, 0), -10, material), Sphere(Vector(0, 5, 0), 1, light)], [], camera)
+
+        ray = Ray(Vector.ORIGIN, Vector(0, 1, 0))
+        assert scene.occluded(ray, 10.5)
+        assert not scene.occluded(ray, 9.5)
+
+
+class TestTriangleMesh(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".obj", delete=False) as file:
+            file.write("v -1 5 -1\nv 1 5 -1\nv 1 5 1\nv -1 5 1\n"
+                       "vt 0 0\nvt 1 0\nvt 1 1\nvt 0 1\n"
+                       "f 1/1 2/2 3/3 4/4\n")
+        self.mesh = load_obj(file.name, None)
+        os.remove(file.name)
+
+    def test_load_obj(self):
+        assert len(self.mesh) == 2
+        assert self.mesh.get_bounds() == (Vector(-1, 5, -1), Vector(1, 5, 1))
+
+    def test_intersection(self):
+        ray = Ray(Vector.ORIGIN, Vector(0.1, 1, -0.1).normalize())
+        intersection = self.mesh.get_intersection(ray)
+
+        self.assertAlmostEqual(intersection.distance, abs(Vector(0.5, 5, -0.5)))
+        uv = intersection.vertex.get_uv(intersection.intersection)
+        self.assertAlmostEqual(uv.u, 0.75, places=5)
+        self.assertAlmostEqual(uv.v, 0.25, places=5)
+        assert not self.mesh.get_intersection(Ray(Vector.ORIGIN, Vector(0, -1, 0)))
+
+    def test_mixed_faces(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".obj", delete=False) as file:
+            file.write("v -1 5 -1\nv 1 5 -1\nv 1 5 1\nv -1 5 1\n"
+                       "vt 0 0\nvt 1 0\nvt 1 1\nvn 0 -1 0\nvn 1 0 0\n"
+                       "f 1/1/1 2//1 3/3/1\nf 1/1/1 3/3/ 4/2/2\n")
+        mesh = load_obj(file.name, None)
+        os.remove(file.name)
+
+        for x in (0.5, -0.5):
+            ray = Ray(Vector.ORIGIN, Vector(x, 5, x * 0.5).normalize())
+            intersection = mesh.get_intersection(ray)
+            # Both faces miss an index, the last normal and UV must not be picked up by a -1
+            assert intersection.vertex.get_normal_at(intersection.intersection) == Vector(0, -1, 0)
+            uv = intersection.vertex.get_uv(intersection.intersection)
+            assert uv.u + uv.v <= 1 + 1e-6 and uv.u >= -1e-6 and uv.v >= -1e-6
+
+
+class TestPacketTracer(unittest.TestCase):
+
+    def setUp(self):
+        material = Material(SolidTexture(Intensity(0.5, 0.5, 0.9)), specular_reflectivity=Vector.ONE * 0.2)
+        rectangle = Rectangle(Vector(-4, 14, 0), Vector(4, 14, 0), Vector(-4, 14, 8), Vector(4, 14, 8), material)
+        mesh = TriangleMesh([(-2, 9, 6), (2, 9, 6), (2, 9, 9), (-2, 9, 9)], [(0, 1, 2), (0, 2, 3)], material)
+
+        objects = [*benchmark_scenes.make_spheres(40), *benchmark_scenes.make_triangles(20), rectangle, mesh]
+        self.scene = benchmark_scenes.build_scaling_scene(objects, 2, (24, 24))
+        self.scene.lights.append(PointLightSource(Vector(1, 6, 4), Intensity(2, 2, 2)))
+        self.scene.refresh_lights()
+
+    def check(self):
+        rays = self.scene.trace_tile(0, 0, 24, 24, 1)
+        packets = self.scene.trace_tile(0, 0, 24, 24, 1, engine="packet")
+        assert [tuple(pixel) for pixel in packets] == [tuple(pixel) for pixel in rays]
+
+    def test_same_image(self):
+        self.check()
+
+    def test_primitive_set(self):
+        objects = self.scene.objects
+        spheres = [object for object in objects if isinstance(object, (Sphere, Triangle))]
+        self.scene.objects = [PrimitiveSet.from_objects(spheres, spheres[0].material),
+                              *(object for object in objects if not isinstance(object, (Sphere, Triangle)))]
+        self.check()
+
+    def test_hits(self):
+        directions = self.scene.camera.get_viewplane().reshape(-1, 3)
+        origins = np.broadcast_to(np.array(tuple(self.scene.camera.origin)), directions.shape)
+        distances, vertices = self.scene.bvh.get_closest_hits(origins, directions, normalized=True)
+
+        for distance, vertex, direction in zip(distances.tolist(), vertices, directions.tolist()):
+            intersection = self.scene.bvh.get_closest_intersection(Ray(self.scene.camera.origin, Vector(*direction, normalized=True)))
+            if intersection:
+                assert (distance, vertex.material) == (intersection.distance, intersection.vertex.material)
+            else:
+                assert (distance, vertex) == (np.inf, None)
+
+
+class TestCamera(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = Camera(Vector(0, -5, 7), (0.1, 0.4), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(7, 5))
+
+    def test_viewplane(self):
+        viewplane = self.camera.get_viewplane()
+        assert viewplane.shape == (5, 7, 3)
+
+        for y, z in enumerate(range(4, -1, -1)):
+            for x in range(7):
+                expected = Vector(2 / 7 * x - 1, 2, 2 / 5 * z - 1).rotate(*self.camera.rotation).normalize()
+                np.testing.assert_allclose(viewplane[y, x], tuple(expected))
+                np.testing.assert_allclose(tuple(self.camera.get_ray_direction(x, y)), tuple(expected))
+
+    def test_sub_pixel_directions(self):
+        np.testing.assert_allclose(self.camera.get_ray_directions(np.array([3]), np.array([2]))[0], self.camera.get_viewplane()[2, 3])
+
+        between = self.camera.get_ray_directions(np.array([3.5]), np.array([2]))[0]
+        assert self.camera.get_viewplane()[2, 3][0] < between[0] < self.camera.get_viewplane()[2, 4][0]
+
+    def test_viewplane_cache(self):
+        viewplane = self.camera.get_viewplane()
+        assert self.camera.get_viewplane() is viewplane
+
+        self.camera.rotation = (0.2, 0.4)
+        assert self.camera.get_viewplane() is not viewplane
+
+
+class TestLightObjects(unittest.TestCase):
+
+    def setUp(self):
+        camera = Camera(Vector(0, 0, 0), (0, 0), viewport_size=(4, 4))
+        self.visible = PointLightSource(Vector(0, 5, 0), Intensity(1, 1, 1))
+        self.hidden = PointLightSource(Vector(0, 6, 0), Intensity(1, 1, 1), render_in_picture=False)
+        self.scene = Scene([], [self.visible, self.hidden], camera)
+
+    def test_cached(self):
+        objects = self.scene.get_light_objects()
+        assert len(objects) == 1
+        assert self.scene.get_light_objects()[0] is objects[0]
+
+    def test_refreshed_on_change(self):
+        self.scene.get_light_objects()
+        self.visible.position = Vector(1, 5, 0)
+        assert self.scene.get_light_objects()[0].center == Vector(1, 5, 0)
+
+        self.hidden.render_in_picture = True
+        assert len(self.scene.get_light_objects()) == 2
+
+
+class TestLightSampling(unittest.TestCase):
+
+    def setUp(self):
+        camera = Camera(Vector(0, 0, 0), (0, 0), viewport_size=(4, 4))
+        lights = [PointLightSource(Vector(x, 5, 0), Intensity(1 + x, 1, 1), render_in_picture=False) for x in range(10)]
+        self.scene = Scene([], lights, camera, light_samples=3)
+
+    def test_sample_count(self):
+        assert len(self.scene.get_shading_lights(Vector(0, 0, 0))) == 3
+
+        self.scene.light_samples = None
+        assert all(weight == 1 for _, weight in self.scene.get_shading_lights(Vector(0, 0, 0)))
+
+    def test_light_on_point(self):
+        lights = self.scene.get_shading_lights(Vector(0, 5, 0))
+        assert len(lights) == 3 and all(np.isfinite(weight) and weight > 0 for _, weight in lights)
+
+    def test_unbiased(self):
+        point = Vector(1, 2, 3)
+        expected = sum(light.intensity.luminance() / light.position.distance_squared(point) for light in self.scene.lights)
+
+        for _ in range(20):
+            estimate = sum(weight * light.intensity.luminance() / light.position.distance_squared(point)
+                           for light, weight in self.scene.get_shading_lights(point))
+            self.assertAlmostEqual(estimate, expected)
+
+
+class TestRenderSession(unittest.TestCase):
+
+    def setUp(self):
+        camera = Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(9, 7))
+        material = Material(SolidTexture(Intensity(1, 0.5, 0.5)))
+        objects = [Sphere(Vector(0, 0, 1), 1, material), Plane(Vector(0, 0, 1), 0, material)]
+        lights = [PointLightSource(Vector(2, -2, 4), Intensity(10, 10, 10), render_in_picture=False)]
+        self.scene = Scene(objects, lights, camera)
+
+    def expected(self):
+        width, height = self.scene.camera.viewport_size
+        return [tuple(color) for color in self.scene.trace_tile(0, 0, width, height, 1)]
+
+    def test_tiles(self):
+        tiles = list(get_tiles(9, 7, 4))
+        assert len(tiles) == 6
+        assert sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in tiles) == 63
+
+    def test_trace(self):
+        with RenderSession(self.scene, workers=2, start_method="spawn", tile_size=4) as session:
+            assert [tuple(color) for color in session.trace(1)] == self.expected()
+
+            self.scene.camera.rotation = (0.1, 0.2)
+            assert [tuple(color) for color in session.trace(1)] == self.expected()
+
+    def test_render(self):
+        with RenderSession(self.scene, workers=2, start_method="spawn", tile_size=4) as session:
+            framebuffer = session.render(1)
+            assert framebuffer.array.shape == (7, 9, 3)
+            np.testing.assert_allclose(framebuffer.array.reshape(-1, 3), self.expected(), rtol=1e-6)
+
+
+class TestSharedFramebuffer(unittest.TestCase):
+
+    def test_attach(self):
+        with SharedFramebuffer(3, 2) as framebuffer:
+            framebuffer.write(1, 0, 3, 2, [Intensity(i, 0, 1) for i in range(4)])
+
+            attached = pickle.loads(pickle.dumps(framebuffer))
+            np.testing.assert_array_equal(attached.array[:, 1:, 0], [[0, 1], [2, 3]])
+            attached.close()
+
+    def test_encode_24_bit(self):
+        array = np.array([[[0, 0.25, 1]]], dtype=np.float32)
+        np.testing.assert_array_equal(encode_24_bit(array), [[[0, 128, 255]]])
+
+
+class TestProgressiveRenderer(unittest.TestCase):
+
+    def setUp(self):
+        camera = Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(9, 7))
+        material = Material(SolidTexture(Intensity(1, 0.5, 0.5)))
+        objects = [Sphere(Vector(0, 0, 1), 1, material), Plane(Vector(0, 0, 1), 0, material)]
+        lights = [PointLightSource(Vector(2, -2, 4), Intensity(10, 10, 10), render_in_picture=False)]
+        self.scene = Scene(objects, lights, camera)
+
+    def test_upscale(self):
+        array = np.arange(6).reshape(2, 3)
+        np.testing.assert_array_equal(upscale(array, 6, 3), [[0, 0, 1, 1, 2, 2]] * 2 + [[3, 3, 4, 4, 5, 5]])
+
+    def test_shadows(self):
+        # Looks at the shadow the sphere casts onto the plane
+        ray = Ray(Vector(0, -5, 1), Vector(-2 / 3, 17 / 3, -1).normalize())
+        assert tuple(self.scene.do_raycast(ray, 0)) == (0, 0, 0)
+
+        self.scene.shadows = False
+        assert tuple(self.scene.do_raycast(ray, 0)) != (0, 0, 0)
+
+    def test_passes(self):
+        shown = []
+        with RenderSession(self.scene, workers=2, start_method="spawn", tile_size=4) as session:
+            tiles = []
+            pixels = ProgressiveRenderer(session).render(1, show=lambda preview: shown.append(preview.shape),
+                                                         show_tile=lambda array, tile: tiles.append(tile))
+            assert shown == [(7, 9, 3)] * 4
+            assert sorted(tiles) == sorted(get_tiles(9, 7, 4))
+            assert self.scene.camera.viewport_size == (9, 7) and self.scene.shadows
+
+            expected = self.scene.trace_tile(0, 0, 9, 7, 1)
+            np.testing.assert_allclose(pixels.reshape(-1, 3), [tuple(color) for color in expected], rtol=1e-6)
+
+            assert ProgressiveRenderer(session).render(1, interrupted=lambda: True) is None
+
+
+class TestAdaptiveSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(12, 12))
+
+    def test_offsets(self):
+        offsets = get_offsets(np.arange(16))
+        np.testing.assert_array_equal(offsets[0], [0, 0])
+        assert (np.abs(offsets) <= 0.5).all()
+
+    def test_flat(self):
+        pixels, samples = AdaptiveSampler(Scene([], [], self.camera)).render(0)
+        assert (samples == 1).all()
+        assert (pixels == 0).all()
+
+    def test_edges(self):
+        material = Material(SolidTexture(Intensity(1, 1, 1)), interacts_with_light=False)
+        scene = Scene([Sphere(Vector(0, 0, 1), 1.5, material)], [], self.camera)
+
+        pixels, samples = AdaptiveSampler(scene, max_samples=8).render(0)
+        assert samples.max() == 8
+        assert samples[0, 0] == 1 and samples[6, 6] == 1
+
+        edges = samples > 1
+        assert ((pixels[edges] > 0) & (pixels[edges] < 1)).any()
+
+
+class TestGBuffer(unittest.TestCase):
+
+    def setUp(self):
+        camera = Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(9, 7))
+        material = Material(SolidTexture(Intensity(1, 0.5, 0.5)), specular_reflectivity=Vector.ONE * 0.5)
+        self.sphere = Sphere(Vector(0, 0, 1), 1, material)
+        self.light = PointLightSource(Vector(2, -2, 4), Intensity(10, 10, 10))
+        self.scene = Scene([self.sphere, Plane(Vector(0, 0, 1), 0, material)], [self.light], camera)
+
+    def trace(self, gbuffer=None, reuse=False):
+        return [tuple(color) for color in self.scene.trace_tile(0, 0, 9, 7, 1, gbuffer=gbuffer, reuse=reuse)]
+
+    def test_relight(self):
+        gbuffer = GBuffer.create(9, 7)
+        assert self.trace(gbuffer) == self.trace()
+
+        self.light.position = Vector(0, -3, 1)
+        assert self.trace(gbuffer, reuse=True) == self.trace()
+        assert np.isinf(gbuffer.distance).any()
+
+    def test_key(self):
+        key = self.scene.get_gbuffer_key()
+        self.light.intensity = Intensity(1, 1, 1)
+        assert self.scene.get_gbuffer_key() == key
+
+        # Objects are not watched, edits in place take effect with mark_dirty
+        self.sphere.radius = 2
+        assert self.scene.get_gbuffer_key() == key
+        self.scene.mark_dirty()
+        assert self.scene.get_gbuffer_key() != key
+
+        key = self.scene.get_gbuffer_key()
+        self.scene.camera.rotation = (0.1, 0)
+        assert self.scene.get_gbuffer_key() != key
+
+    def test_mark_dirty(self):
+        # Moved out of the box the BVH still has for it
+        self.sphere.center = Vector(0.5, 0, 1.5)
+        self.scene.mark_dirty()
+
+        moved = Scene([Sphere(Vector(0.5, 0, 1.5), 1, self.sphere.material), self.scene.objects[1]], [self.light], self.scene.camera)
+        assert self.trace() == [tuple(color) for color in moved.trace_tile(0, 0, 9, 7, 1)]
+
+    def test_pickled_key(self):
+        restored = pickle.loads(pickle.dumps(self.scene))
+        assert restored.get_gbuffer_key() == self.scene.get_gbuffer_key()
+
+        # The BVH that comes with the scene is kept for the first tile
+        bvh = restored.bvh
+        restored.trace_tile(0, 0, 9, 7, 1)
+        assert restored.bvh is bvh
+
+    def test_session(self):
+        with RenderSession(self.scene, workers=2, start_method="spawn", tile_size=4) as session:
+            assert [tuple(color) for color in session.trace(1, gbuffer=True)] == self.trace()
+
+            self.light.position = Vector(0, -3, 1)
+            session.update(lights=self.scene.lights)
+            assert [tuple(color) for color in session.trace(1, gbuffer=True)] == self.trace()
+
+
+class TestColorBlend(unittest.TestCase):
+
+    def setUp(self):
+        self.colors = [Intensity(0.2, 0.4, 0.1), Color(0.5, 0.3, 0.9), Intensity(1.5, 0.1, 0.2), Color(0.1, 0.1, 0.1, gamma=0.5)]
+
+    def test_legacy_fold(self):
+        blend = ColorBlend()
+        for color in self.colors:
+            blend.add(color)
+
+        expected = sum(map(Color.apply_gamma, self.colors), Color(0, 0, 0))
+        for gamma in (1, 2.2):
+            assert tuple(blend.blend(gamma)) == tuple(expected.apply_gamma(gamma))
+
+    def test_merge(self):
+        blend = ColorBlend()
+        blend.add(ColorBlend(self.colors))
+        assert tuple(blend.blend()) == tuple(ColorBlend(self.colors).blend())
+
+        with self.assertRaises(Exception):
+            blend.add(ColorBlend(self.colors))
+
+
+class TestTextureStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "texture.png")
+
+        self.pixels = np.random.default_rng(0).integers(0, 256, (6, 5, 3), dtype=np.uint8)
+        Image.fromarray(self.pixels).save(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_dedup(self):
+        store = TextureStore()
+        first = ImageTexture(self.path, store=store)
+        second = ImageTexture(os.path.join(self.directory.name, ".", "texture.png"), store=store)
+
+        assert len(store) == 1
+        assert first.mipmap is second.mipmap
+
+    def test_get_color(self):
+        texture = ImageTexture(self.path, store=TextureStore())
+        for u, v in ((0, 0), (0.5, 0.3), (0.99, 0.99)):
+            i, j = int(u * 5), int(v * 6)
+            assert tuple(texture.get_color(Vector(u, v, 0))) == tuple(self.pixels[j, i] / 256)
+
+    def test_mip_levels(self):
+        mipmap = MipMap(self.pixels / 256)
+        assert [level.shape[:2] for level in mipmap.levels] == [(6, 5), (3, 3), (2, 2), (1, 1)]
+        np.testing.assert_allclose(mipmap.levels[-1].mean(), (self.pixels / 256).mean(), rtol=0.2)
+
+        np.testing.assert_array_equal(mipmap.get_level([0, 1 / 5, 1 / 2.5, 10]), [0, 0, 1, 3])
+
+        texture = ImageTexture(self.path, store=TextureStore())
+        assert tuple(texture.get_color(Vector(0.5, 0.5, 0), 0.3)) == tuple(texture.get_color(Vector(0.5, 0.5, 0)))
+        np.testing.assert_allclose(tuple(texture.get_color(Vector(0.5, 0.5, 0), 10)), mipmap.levels[-1][0, 0], rtol=1e-6)
+
+    def test_sample_nearest(self):
+        texture = ImageTexture(self.path, store=TextureStore())
+        rng = np.random.default_rng(1)
+        uvs = rng.random((200, 2))
+        footprints = rng.choice([0, 0.1, 0.3, 0.5, 1], 200)
+
+        expected = [tuple(texture.get_color(Vector(u, v, 0), footprint))
+                    for (u, v), footprint in zip(uvs.tolist(), footprints.tolist())]
+        assert list(map(tuple, texture.get_colors(uvs, footprints).tolist())) == expected
+        assert list(map(tuple, texture.get_colors(uvs).tolist())) == [tuple(texture.get_color(Vector(u, v, 0))) for u, v in uvs.tolist()]
+
+    def test_sample_bilinear(self):
+        texture = ImageTexture(self.path, store=TextureStore())
+        # Texel centers read one texel, halfway between two centers reads their mean
+        centers = np.array([[(i + 0.5) / 5, (j + 0.5) / 6] for j in range(6) for i in range(5)])
+        np.testing.assert_allclose(texture.get_colors(centers, bilinear=True),
+                                   [tuple(texture.get_color(Vector(u, v, 0))) for u, v in centers.tolist()], rtol=1e-6)
+
+        halfway = np.array([[0.2, 0.25]])
+        expected = (np.array(tuple(texture.get_color(Vector(0.1, 0.25, 0)))) + tuple(texture.get_color(Vector(0.3, 0.25, 0)))) / 2
+        np.testing.assert_allclose(texture.get_colors(halfway, bilinear=True)[0], expected, rtol=1e-6)
+
+        np.testing.assert_allclose(texture.get_colors(centers, 10, bilinear=True), np.broadcast_to(texture.mipmap.levels[-1][0, 0], (30, 3)),
+                                   rtol=1e-6)
+
+    def test_footprint(self):
+        texture = ImageTexture(self.path, store=TextureStore())
+        material = Material(texture)
+        camera = Camera(Vector(0, -5, 1), (0, 0), viewplane_size=(2, 2), viewport_size=(30, 30))
+        scene = Scene([Sphere(Vector(0, 0, 1), 2, material)], [], camera)
+
+        lookups = []
+        get_color = texture.get_color
+        texture.get_color = lambda uv, footprint=0.0: lookups.append(footprint) or get_color(uv, footprint)
+
+        # The same ray at a tenth of the resolution covers about ten times as much texture
+        scene.trace_tile(10, 19, 11, 20, 0)
+        scene.camera.viewport_size = (300, 300)
+        scene.trace_tile(100, 199, 101, 200, 0)
+
+        coarse, fine = lookups
+        assert 0 < fine and 9 < coarse / fine < 11
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_scaling_scene(self):
+        scene = benchmark_scenes.build_scaling_scene(benchmark_scenes.make_spheres(20), 3, (4, 4))
+        assert len(scene.objects) == 21 and len(scene.lights) == 3
+        assert len(scene.trace_tile(0, 0, 4, 4, 1)) == 16
+
+        assert [tuple(sphere.center) for sphere in benchmark_scenes.make_spheres(5)] == \
+               [tuple(sphere.center) for sphere in benchmark_scenes.make_spheres(5)]
+
+    def test_compare(self):
+        baseline = {"a": {"primary_rays_per_second": 100, "wall_time": 1}, "b": {"calls_per_second": 10}}
+        results = {"a": {"primary_rays_per_second": 80, "wall_time": 2}, "b": {"calls_per_second": 9.5}, "c": {"calls_per_second": 1}}
+
+        assert compare(results, baseline, 0.1) == [("a", "primary_rays_per_second", 0.8)]
+        assert compare(results, baseline, 0.25) == []
+
+
+class TestRenderStats(unittest.TestCase):
+
+    def setUp(self):
+        camera = Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(6, 5))
+        material = Material(SolidTexture(Intensity(1, 0.5, 0.5)), specular_reflectivity=Vector.ONE * 0.5)
+        self.sphere = Sphere(Vector(0, 0, 1), 1, material)
+        self.scene = Scene([self.sphere, Plane(Vector(0, 0, 1), 0, material)],
+                           [PointLightSource(Vector(2, -2, 4), Intensity(10, 10, 10), render_in_picture=False)], camera)
+
+    def test_counts(self):
+        expected = [tuple(color) for color in self.scene.trace_tile(0, 0, 6, 5, 1)]
+
+        with Instrumentation(self.scene, RenderStats()) as stats:
+            assert [tuple(color) for color in self.scene.trace_tile(0, 0, 6, 5, 1)] == expected
+
+        assert stats.counts["rays.primary"] == 30
+        assert stats.counts["rays.reflection"] > 0
+        assert stats.counts["Sphere.hits"] > 0 and stats.counts["Sphere.tests"] >= stats.counts["Sphere.hits"]
+        assert stats.counts["rays.shadow"] == stats.counts["texture_lookups.SolidTexture"]
+        assert stats.times["tracing"] >= stats.times["shading"] > 0
+
+        # Everything is unwrapped again
+        assert "trace_tile" not in vars(self.scene) and "get_intersection" not in vars(self.sphere)
+
+    def test_session(self):
+        with Instrumentation(self.scene, RenderStats()) as expected:
+            self.scene.trace_tile(0, 0, 6, 5, 1)
+
+        stats = RenderStats()
+        with RenderSession(self.scene, workers=2, start_method="spawn", tile_size=4) as session:
+            session.trace(1, stats=stats)
+
+        assert stats.counts == expected.counts
+        assert {"tracing", "shading", "output"} <= set(stats.times)
+
+    def test_merge(self):
+        stats = RenderStats({"rays.primary": 2}, {"tracing": 1.5}) + RenderStats({"rays.primary": 3, "rays.shadow": 1})
+        assert stats == pickle.loads(pickle.dumps(stats))
+        assert stats.counts == {"rays.primary": 5, "rays.shadow": 1} and stats.times == {"tracing": 1.5}
+
+
+class TestSceneFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "scene.json")
+        with open(os.path.join(self.directory.name, "tetrahedron.obj"), "w") as file:
+            file.write("v -3 5 0\nv -2 5 0\nv -2.5 6 0\nv -2.5 5.5 1.5\nf 1 2 4\nf 2 3 4\nf 3 1 4\n")
+
+        self.description = {
+            "camera": {"origin": [0, -5, 7], "rotation": [0.02, 0.4], "viewplane_distance": 2, "viewplane_size": [2, 2],
+                       "viewport_size": [12, 10]},
+            "ambient": [0.1, 0.1, 0.1],
+            "gamma": 2,
+            "textures": {"white": {"type": "solid", "color": [1, 1, 1]},
+                         "image": {"type": "image", "path": os.path.join(os.path.dirname(__file__), "..", "raytracer", "res", "texture1.png")}},
+            "materials": {"white": {"albedo": "white"}, "mirror": {"albedo": "image", "specular_reflectivity": [1, 1, 1]}},
+            "objects": [
+                {"type": "triangle", "vertices": [[-5, 6, 5], [0, 0, 3], [5, 6, 3]], "facing": [0, -5, 7], "material": "white"},
+                {"type": "rectangle", "vertices": [[5, 6, -1], [5, 6, 3], [0, 0, -1], [0, 0, 3]], "material": "white"},
+                {"type": "sphere", "center": [1, 4, 4], "radius": 1, "material": "mirror"},
+                {"type": "mesh", "path": "tetrahedron.obj", "material": "white"},
+                {"type": "plane", "normal": [0, 0, 1], "intersect": -1, "material": "white"},
+            ],
+            "lights": [{"type": "point", "position": [-5, -10, 10], "intensity": [400, 400, 400], "render_in_picture": False},
+                       {"type": "point", "position": [4, 4.5, 4], "intensity": [7, 7, 70]}],
+        }
+        self.write()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self):
+        with open(self.path, "w") as file:
+            json.dump(self.description, file)
+
+    def trace(self, scene):
+        return [tuple(color) for color in scene.trace_tile(0, 0, 12, 10, 2)]
+
+    def test_cache(self):
+        scene = load_scene(self.path)
+        assert get_cache_path(self.path).exists()
+        assert [type(object).__name__ for object in scene.objects] == ["Triangle", "Rectangle", "Sphere", "TriangleMesh", "Plane"]
+
+        cached = load_scene(self.path)
+        assert self.trace(cached) == self.trace(scene)
+        for name, array in scene.bvh.to_arrays().items():
+            np.testing.assert_array_equal(cached.bvh.to_arrays()[name], array)
+
+        self.description["objects"].pop(2)
+        self.write()
+        assert len(load_scene(self.path).objects) == 4
+
+    def test_cache_tracks_references(self):
+        mesh_path = os.path.join(self.directory.name, "tetrahedron.obj")
+        assert len(load_scene(self.path).objects[3].faces) == 3
+
+        # Rewritten with a face less, the scene file itself stays untouched
+        with open(mesh_path, "w") as file:
+            file.write("v -3 5 0\nv -2 5 0\nv -2.5 6 0\nv -2.5 5.5 1.5\nf 1 2 4\nf 2 3 4\n")
+        status = os.stat(mesh_path)
+        os.utime(mesh_path, ns=(status.st_atime_ns, status.st_mtime_ns + 1_000_000_000))
+
+        assert len(load_scene(self.path).objects[3].faces) == 2
+
+    def test_cache_skips_parsing(self):
+        load_scene(self.path)
+        assert is_cache_valid(get_cache_path(self.path), self.path)
+
+        # Same size and mtime, the check only compares them and never reads the scene file
+        status = os.stat(self.path)
+        with open(self.path, "w") as file:
+            file.write("x" * status.st_size)
+        os.utime(self.path, ns=(status.st_atime_ns, status.st_mtime_ns))
+        assert is_cache_valid(get_cache_path(self.path), self.path)
+
+        os.utime(self.path, ns=(status.st_atime_ns, status.st_mtime_ns + 1_000_000_000))
+        assert not is_cache_valid(get_cache_path(self.path), self.path)
+
+    def test_compile(self):
+        scene = Scene([Sphere(Vector(0, 0, 1), 1, Material(SolidTexture(Intensity(1, 0.5, 0.5))))],
+                      [PointLightSource(Vector(2, -2, 4), Intensity(10, 10, 10))],
+                      Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(12, 10)))
+        path = os.path.join(self.directory.name, "compiled.rtscene")
+        compile_scene(scene, path)
+
+        assert self.trace(load_compiled(path)) == self.trace(scene)
+        assert load_scene(path, viewport_size=(4, 3)).camera.viewport_size == (4, 3)
+
+    def test_compile_groups(self):
+        rng = np.random.default_rng(2)
+        material = Material(SolidTexture(Intensity(1, 0.5, 0.5)))
+        objects = []
+        for x, y, z in rng.uniform((-3, 3, -1), (3, 8, 3), (90, 3)).tolist():
+            if len(objects) % 3 == 0:
+                objects.append(Sphere(Vector(x, y, z), 0.4, material))
+            elif len(objects) % 3 == 1:
+                objects.append(Triangle(Vector(x, y, z), Vector(x + 0.6, y, z), Vector(x, y + 0.3, z + 0.6), material, Vector(0, -5, 1)))
+            else:
+                objects.append(Rectangle(Vector(x, y, z), Vector(x + 0.5, y, z), Vector(x, y, z + 0.5), Vector(x + 0.5, y, z + 0.5), material))
+        scene = Scene(objects + [Plane(Vector(0, 0, 1), 1, material)], [PointLightSource(Vector(2, -2, 6), Intensity(30, 30, 30))],
+                      Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(12, 10)))
+        path = os.path.join(self.directory.name, "compiled.rtscene")
+        compile_scene(scene, path)
+
+        compiled = load_compiled(path)
+        assert [type(object).__name__ for object in compiled.objects] == ["PrimitiveSet", "Plane"]
+        assert self.trace(compiled) == self.trace(scene)
+
+        primitives = compiled.objects[0]
+        assert len(primitives) == 120
+        origins = np.tile([[0.0, -5.0, 1.0]], (50, 1))
+        directions = np.column_stack([rng.uniform(-0.5, 0.5, 50), np.ones(50), rng.uniform(-0.4, 0.3, 50)])
+        expected = np.min([object.get_intersection_distances(origins, directions) for object in objects], axis=0)
+        np.testing.assert_allclose(primitives.get_intersection_distances(origins, directions), expected)
+        for origin, direction in zip(origins.tolist(), directions.tolist()):
+            ray = Ray(Vector(*origin), Vector(*direction))
+            intersection = primitives.get_intersection(ray)
+            if intersection:
+                assert type(intersection.vertex).__name__ in ("Sphere", "Triangle", "Rectangle")
+                assert intersection.vertex.get_intersection(ray).distance == intersection.distance
+
+
+class TestImageWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pixels = np.random.default_rng(0).uniform(-0.5, 4, (5, 7, 3)).astype(np.float32)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_formats(self):
+        write_image(self.get_path("image.png"), self.pixels)
+        with Image.open(self.get_path("image.png")) as image:
+            np.testing.assert_array_equal(np.asarray(image), encode_24_bit(self.pixels))
+        assert encode_24_bit(self.pixels).min() == 0 and encode_24_bit(self.pixels).max() == 255
+
+        write_image(self.get_path("image.pfm"), self.pixels)
+        np.testing.assert_array_equal(read_pfm(self.get_path("image.pfm")), self.pixels)
+
+        write_image(self.get_path("image.npy"), self.pixels)
+        np.testing.assert_array_equal(np.load(self.get_path("image.npy")), self.pixels)
+
+    def test_bands(self):
+        # Taller than a band, so the image is written in several
+        pixels = np.random.default_rng(1).uniform(-0.5, 4, (BAND_SIZE * 2 + 3, 4, 3)).astype(np.float32)
+
+        write_image_bands(self.get_path("image.png"), pixels)
+        with Image.open(self.get_path("image.png")) as image:
+            np.testing.assert_array_equal(np.asarray(image), encode_24_bit(pixels))
+
+        write_image_bands(self.get_path("image.pfm"), pixels)
+        np.testing.assert_array_equal(read_pfm(self.get_path("image.pfm")), pixels)
+
+        with self.assertRaises(Exception):
+            write_image_bands(self.get_path("image.jpg"), pixels)
+
+    def test_tiled_command(self):
+        arguments = ["render", "--width", "8", "--height", "6", "--bounces", "0", "--tiled", "--tile-size", "4"]
+        result = CliRunner().invoke(cli.main, [*arguments, "--output", self.get_path("image.png")])
+        assert result.exit_code == 0, result.output
+        with Image.open(self.get_path("image.png")) as image:
+            np.testing.assert_array_equal(np.asarray(image), encode_24_bit(np.load(self.get_path("image.png.npy"))))
+
+        result = CliRunner().invoke(cli.main, [*arguments, "--output", self.get_path("image.jpg")])
+        assert result.exit_code == 2 and not os.path.exists(self.get_path("image.jpg.npy"))
+
+    def test_background(self):
+        with ImageWriter() as writer:
+            pixels = self.pixels.copy()
+            writer.write(self.get_path("frame.npy"), pixels)
+            pixels[:] = 0
+            writer.flush()
+            np.testing.assert_array_equal(np.load(self.get_path("frame.npy")), self.pixels)
+
+            writer.write(self.get_path("missing/frame.png"), pixels)
+            with self.assertRaises(FileNotFoundError):
+                writer.flush()
+
+
+class TestTiledRenderer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "poster.npy")
+
+        camera = Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(11, 9))
+        material = Material(SolidTexture(Intensity(1, 0.5, 0.5)))
+        self.scene = Scene([Sphere(Vector(0, 0, 1), 1, material), Plane(Vector(0, 0, 1), 0, material)],
+                           [PointLightSource(Vector(2, -2, 4), Intensity(10, 10, 10))], camera)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_viewplane_region(self):
+        camera = self.scene.camera
+        expected = camera.get_viewplane()[2:7, 3:10]
+
+        camera.MAX_CACHED_PIXELS = 0
+        np.testing.assert_array_equal(camera.get_viewplane_region(3, 2, 10, 7), expected)
+
+    def test_resume(self):
+        def interrupt(done, total):
+            if done == 3:
+                raise KeyboardInterrupt
+
+        with RenderSession(self.scene, workers=2, start_method="spawn") as session:
+            renderer = TiledRenderer(session, self.path, tile_size=4, checkpoint_interval=0)
+            with self.assertRaises(KeyboardInterrupt):
+                renderer.render(1, progress=interrupt)
+
+            with open(get_manifest_path(self.path)) as file:
+                assert len(json.load(file)["completed"]) == 3
+
+            progress = []
+            pixels = renderer.render(1, progress=lambda done, total: progress.append((done, total)))
+            assert progress[0] == (3, 9) and progress[-1] == (9, 9) and len(progress) == 7
+
+        expected = [tuple(color) for color in self.scene.trace_tile(0, 0, 11, 9, 1)]
+        np.testing.assert_allclose(np.load(self.path).reshape(-1, 3), expected, rtol=1e-6)
+        assert isinstance(pixels, np.memmap)
+
+
+class TestAnimationRenderer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        camera = Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(9, 7))
+        material = Material(SolidTexture(Intensity(1, 0.5, 0.5)))
+        self.scene = Scene([Sphere(Vector(0, 0, 1), 1, material), Plane(Vector(0, 0, 1), 0, material)],
+                           [PointLightSource(Vector(2, -2, 4), Intensity(10, 10, 10))], camera)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_zoom_path(self):
+        distances = [camera.viewplane_distance for camera in zoom_path(self.scene.camera, 4, 1, 3)]
+        np.testing.assert_allclose(distances, [4, 2, 1])
+        assert self.scene.camera.viewplane_distance == 2
+
+    def test_sequence(self):
+        cameras = zoom_path(self.scene.camera, 2, 1, 3)
+        progress = []
+
+        with RenderSession(self.scene, workers=2, start_method="spawn", tile_size=4) as session:
+            paths = AnimationRenderer(session, 3, camera_path(cameras)).render(
+                1, os.path.join(self.directory.name, "frame{:02d}.npy"), progress=progress.append)
+
+        assert [path.name for path in paths] == ["frame00.npy", "frame01.npy", "frame02.npy"]
+        assert progress[-1].frames_done == 3 and progress[-1].eta == 0
+        assert all(update.eta is not None for update in progress)
+
+        for path, camera in zip(paths, cameras):
+            self.scene.camera = camera
+            expected = [tuple(color) for color in self.scene.trace_tile(0, 0, 9, 7, 1)]
+            np.testing.assert_allclose(np.load(path).reshape(-1, 3), expected, rtol=1e-6)
+
+    def test_pending_frames(self):
+        with RenderSession(self.scene, workers=2, start_method="spawn", tile_size=4) as session:
+            frames = [session.submit(0), session.submit(0)]
+            remaining = {frame: [] for frame in frames}
+            for _ in range(12):
+                frame, _, _, left = session.next_tile()
+                remaining[frame].append(left)
+
+            assert all(sorted(left) == list(range(6)) for left in remaining.values())
+            with self.assertRaises(Exception):
+                session.next_tile()
+
+
+class TestDistributed(unittest.TestCase):
+
+    def setUp(self):
+        camera = Camera(Vector(0, -5, 1), (0, 0), viewplane_distance=2, viewplane_size=(2, 2), viewport_size=(9, 7))
+        material = Material(SolidTexture(Intensity(1, 0.5, 0.5)), specular_reflectivity=Vector.ONE * 0.5)
+        self.scene = Scene([Sphere(Vector(0, 0, 1), 1, material), Plane(Vector(0, 0, 1), 0, material)],
+                           [PointLightSource(Vector(2, -2, 4), Intensity(10, 10, 10))], camera)
+        self.context = multiprocessing.get_context("spawn")
+        self.authkey = os.urandom(16)
+
+    def start_worker(self, address, max_tiles=None):
+        process = self.context.Process(target=serve, args=(address, self.authkey), kwargs={"max_tiles": max_tiles},
+                                       daemon=True)
+        process.start()
+        return process
+
+    def test_render(self):
+        expected = [tuple(color) for color in self.scene.trace_tile(0, 0, 9, 7, 1)]
+
+        with Coordinator(self.scene, self.authkey, tile_size=4) as coordinator:
+            workers = [self.start_worker(coordinator.address) for _ in range(2)]
+            coordinator.wait_for_workers(2, timeout=30)
+
+            for _ in range(2):
+                pixels = coordinator.render(1, timeout=30)
+                np.testing.assert_allclose(pixels.reshape(-1, 3), expected, rtol=1e-6)
+
+            assert sum(worker.tiles for worker in coordinator.workers) == 12
+            assert all(worker.pixels_per_second > 0 for worker in coordinator.workers if worker.tiles)
+            assert len(coordinator.report().splitlines()) == 2
+
+        for worker in workers:
+            worker.join(10)
+            assert worker.exitcode == 0
+
+    def test_lost_tiles(self):
+        with Coordinator(self.scene, self.authkey, tile_size=4) as coordinator:
+            # The only worker gets two tiles ahead but leaves after tracing one of them
+            leaving = self.start_worker(coordinator.address, max_tiles=1)
+            coordinator.wait_for_workers(1, timeout=30)
+
+            results = []
+            thread = threading.Thread(target=lambda: results.append(coordinator.render(1, timeout=30)))
+            thread.start()
+
+            leaving.join(30)
+            self.start_worker(coordinator.address)
+            thread.join(60)
+
+            expected = [tuple(color) for color in self.scene.trace_tile(0, 0, 9, 7, 1)]
+            np.testing.assert_allclose(results[0].reshape(-1, 3), expected, rtol=1e-6)
+
+            first, second = coordinator.workers
+            assert (first.tiles, first.connected) == (1, False) and first.lost_tiles >= 1
+            assert second.tiles == 5
+
+    def test_timeout(self):
+        with self.assertRaises(Exception):
+            Coordinator(self.scene, b"")
+
+        with Coordinator(self.scene, self.authkey) as coordinator:
+            with self.assertRaises(TimeoutError):
+                coordinator.wait_for_workers(1, timeout=0.2)
+            with self.assertRaises(TimeoutError):
+                coordinator.render(1, timeout=0.2)
+
+    def test_command_needs_authkey(self):
+        runner = CliRunner(env={"RAYTRACER_AUTHKEY": None})
+        result = runner.invoke(cli.main, ["render", "--listen", "127.0.0.1:0"])
+        assert result.exit_code != 0 and "RAYTRACER_AUTHKEY" in result.output
+        result = runner.invoke(cli.main, ["worker", "127.0.0.1:1"])
+        assert result.exit_code != 0 and "authkey" in result.output
+
+        result = runner.invoke(cli.main, ["render", "--width", "4", "--height", "4", "--listen", "127.0.0.1:0",
+                                          "--timeout", "0.2"], env={"RAYTRACER_AUTHKEY": "secret"})
+        assert result.exit_code == 1 and "Only 0 of 1 workers connected" in result.output